@@ -0,0 +1,115 @@
+"""
+Load test of the movie API server.
+
+Start the server with `python -m movie_server.api_server --workers 4` and run
+`python -m benchmarks.api_load_test --url http://127.0.0.1:8000 --connections 64 --duration 10`.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ("/movies", "/movies?order_by=rating&descending=true&limit=20",
+                 "/filter?min_rating=7&start_year=1990", "/search?q=the", "/stats")
+
+
+async def send_requests(host, port, paths, deadline, latencies, statuses, revalidate):
+    """
+    Sends requests over one keep-alive connection until the deadline.
+    :param host: host of the server
+    :param port: port of the server
+    :param paths: request paths, used in turn
+    :param deadline: monotonic timestamp at which the connection stops
+    :param latencies: list which collects the latencies in seconds
+    :param statuses: dictionary which counts the status codes
+    :param revalidate: if True, the ETag of the last response is sent with If-None-Match
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    request_number = 0
+    try:
+        while time.monotonic() < deadline:
+            path = paths[request_number % len(paths)]
+            request_number += 1
+            request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+            if revalidate and path in etags:
+                request += f"If-None-Match: {etags[path]}\r\n"
+
+            started_at = time.perf_counter()
+            writer.write((request + "\r\n").encode("latin-1"))
+            raw_head = await reader.readuntil(b"\r\n\r\n")
+            status, headers = parse_response_head(raw_head)
+            await reader.readexactly(int(headers.get("content-length", 0)))
+            latencies.append(time.perf_counter() - started_at)
+
+            statuses[status] = statuses.get(status, 0) + 1
+            if "etag" in headers:
+                etags[path] = headers["etag"]
+    finally:
+        writer.close()
+
+
+def parse_response_head(raw_head):
+    """
+    Splits the head of a HTTP response.
+    :param raw_head: status line and headers as bytes
+    :return: Tuple (status code, dictionary of the headers with lower case names).
+    """
+    status_line, *header_lines = raw_head.decode("latin-1").strip().split("\r\n")
+    headers = {}
+    for header_line in header_lines:
+        name, _, value = header_line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(status_line.split(" ")[1]), headers
+
+
+async def run_load_test(url, connections, duration, paths, revalidate):
+    """
+    Runs concurrent keep-alive connections against the server.
+    :param url: base URL of the server
+    :param connections: amount of concurrent connections
+    :param duration: length of the test in seconds
+    :param paths: request paths, used in turn by every connection
+    :param revalidate: if True, conditional requests are sent
+    :return: Tuple (list of latencies in seconds, dictionary of status counts, elapsed seconds).
+    """
+    address = urlsplit(url)
+    latencies = []
+    statuses = {}
+    started_at = time.monotonic()
+    deadline = started_at + duration
+    await asyncio.gather(*(send_requests(address.hostname, address.port or 80, paths,
+                                         deadline, latencies, statuses, revalidate)
+                           for _ in range(connections)))
+    return latencies, statuses, time.monotonic() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the movie API server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="length of the test in seconds")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="request path, can be given several times")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="send If-None-Match with the last ETag")
+    arguments = parser.parse_args()
+
+    latencies, statuses, elapsed = asyncio.run(run_load_test(
+        arguments.url, arguments.connections, arguments.duration,
+        arguments.paths or DEFAULT_PATHS, arguments.revalidate))
+    if not latencies:
+        print("No request was answered.")
+        return
+
+    latencies.sort()
+    print(f"Requests: {len(latencies)} in {elapsed:.1f} s, {len(latencies) / elapsed:.0f} requests/s")
+    print("Status codes: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    print(f"Latency mean: {statistics.mean(latencies) * 1000:.2f} ms, "
+          f"p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark of the sync and the async storage under concurrent requests.
+
+Run it with `python -m benchmarks.async_storage --movies 20000 --requests 5000 --concurrency 64`.
+The sync storage is called through a thread pool, like the API server does,
+the async storage directly on the event loop. Both work on the same temporary database.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from movie_storage import movie_storage_async as async_storage
+from movie_storage import movie_storage_sql as storage
+
+
+def make_requests(titles, request_count):
+    """
+    Builds a deterministic mix of reads and rating updates.
+    :param titles: titles in the database
+    :param request_count: amount of requests
+    :return: List of tuples (kind, title, value).
+    """
+    randomizer = random.Random(0)
+    requests = []
+    for _ in range(request_count):
+        kind = randomizer.choices(("get", "query", "update"), weights=(6, 3, 1))[0]
+        requests.append((kind, randomizer.choice(titles), randomizer.randrange(1920, 2020)))
+    return requests
+
+
+def handle_sync_request(request):
+    kind, title, value = request
+    if kind == "get":
+        storage.get_movie_by_title(title)
+    elif kind == "query":
+        list(storage.query_movies(min_rating=5, year_range=(value, value + 5), limit=50))
+    else:
+        storage.update_ratings([(title, value % 10 + 0.5)])
+
+
+async def handle_async_request(request):
+    kind, title, value = request
+    if kind == "get":
+        await async_storage.get_movie_by_title(title)
+    elif kind == "query":
+        async for _ in async_storage.query_movies(min_rating=5, year_range=(value, value + 5), limit=50):
+            pass
+    else:
+        await async_storage.update_ratings([(title, value % 10 + 0.5)])
+
+
+async def run_requests(handle_request, requests, concurrency):
+    """
+    Runs the requests with a limited amount of concurrent tasks.
+    :param handle_request: coroutine function which handles a single request
+    :param requests: list of requests
+    :param concurrency: amount of concurrent tasks
+    :return: Elapsed seconds.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(request):
+        async with semaphore:
+            await handle_request(request)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(limited(request) for request in requests))
+    return time.perf_counter() - started_at
+
+
+async def run_benchmark(movie_count, request_count, concurrency):
+    """
+    Measures the requests per second of both backends on a fresh temporary database.
+    :param movie_count: amount of movies in the database
+    :param request_count: amount of requests per backend
+    :param concurrency: amount of concurrent requests
+    :return: Dictionary backend name -> requests per second.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "movies.db")
+        storage.configure_database(db_path, pool_size=concurrency)
+        storage.connect_to_sql_db()
+        titles = [f"Synthetic Movie {number}" for number in range(movie_count)]
+        storage.add_movies([(title, 1920 + number % 105, round(1 + number % 91 / 10, 1), "")
+                            for number, title in enumerate(titles)])
+        await async_storage.configure_database(db_path, pool_size=concurrency)
+        requests = make_requests(titles, request_count)
+
+        async def handle_in_thread(request):
+            await asyncio.to_thread(handle_sync_request, request)
+
+        elapsed = {"sync in threads": await run_requests(handle_in_thread, requests, concurrency),
+                   "async": await run_requests(handle_async_request, requests, concurrency)}
+        await async_storage.engine.dispose()
+        storage.engine.dispose()
+
+    return {backend: request_count / seconds for backend, seconds in elapsed.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync and async storage under concurrent requests.")
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    arguments = parser.parse_args()
+
+    throughput = asyncio.run(run_benchmark(arguments.movies, arguments.requests, arguments.concurrency))
+    for backend, requests_per_second in throughput.items():
+        print(f"{backend}: {requests_per_second:.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
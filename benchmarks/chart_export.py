@@ -0,0 +1,76 @@
+"""
+Benchmark of the start time of the menu and of the chart rendering.
+
+Run it with `python -m benchmarks.chart_export --movies 100000 --renders 20`.
+The start time is measured in fresh interpreters, the rendering on a temporary database.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from movie_storage import movie_storage_sql as storage
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import_time(module_name, runs):
+    """
+    Measures the time to import a module in a fresh interpreter.
+    :param module_name: name of the module, e.g. "main"
+    :param runs: amount of interpreters
+    :return: Median time in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module_name}"], cwd=PROJECT_FOLDER, check=True)
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def measure_render_time(image_format, renders):
+    """
+    Measures the time to render the rating histogram.
+    The first render includes the import of matplotlib, the render cache is cleared before each render.
+    :param image_format: "png" or "svg"
+    :param renders: amount of renders
+    :return: Tuple (seconds of the first render, median seconds of the later renders).
+    """
+    from movie_charts import chart_export
+    timings = []
+    for _ in range(renders):
+        chart_export._render_histogram.cache_clear()
+        started_at = time.perf_counter()
+        chart_export.render_rating_histogram(image_format)
+        timings.append(time.perf_counter() - started_at)
+    return timings[0], statistics.median(timings[1:] or timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start time of the menu and chart render time.")
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--renders", type=int, default=20)
+    parser.add_argument("--start-runs", type=int, default=5)
+    arguments = parser.parse_args()
+
+    print(f"Import of main: {measure_import_time('main', arguments.start_runs) * 1000:.0f} ms")
+    print(f"Import of matplotlib.pyplot: "
+          f"{measure_import_time('matplotlib.pyplot', arguments.start_runs) * 1000:.0f} ms")
+
+    with tempfile.TemporaryDirectory() as folder:
+        storage.configure_database(os.path.join(folder, "movies.db"))
+        storage.connect_to_sql_db()
+        storage.add_movies([(f"Synthetic Movie {number}", 1920 + number % 105,
+                             round(1 + number % 91 / 10, 1), "") for number in range(arguments.movies)])
+        for image_format in ("png", "svg"):
+            first_render, later_render = measure_render_time(image_format, arguments.renders)
+            print(f"{image_format}: first render {first_render * 1000:.0f} ms, "
+                  f"later renders {later_render * 1000:.0f} ms")
+        storage.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
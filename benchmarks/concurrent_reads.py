@@ -0,0 +1,116 @@
+"""
+Benchmark of the read throughput while another thread writes.
+
+Run it with `python -m benchmarks.concurrent_reads --movies 20000 --readers 8 --duration 5`,
+add `--journal-mode DELETE --synchronous FULL` to compare with the default SQLite settings.
+The benchmark works on a temporary database and leaves data/movies.db untouched.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from movie_storage import movie_storage_sql as storage
+
+WRITE_BATCH_SIZE = 10
+
+
+def fill_database(movie_count):
+    """
+    Adds synthetic movies to the configured database.
+    :param movie_count: amount of movies
+    :return: List of the added titles.
+    """
+    titles = [f"Synthetic Movie {number}" for number in range(movie_count)]
+    storage.add_movies([(title, 1920 + number % 105, round(1 + number % 91 / 10, 1), "")
+                        for number, title in enumerate(titles)])
+    return titles
+
+
+def read_movies(titles, deadline, counters, index):
+    """
+    Runs mixed read queries until the deadline.
+    :param titles: titles in the database
+    :param deadline: monotonic timestamp at which the reader stops
+    :param counters: list of read counts, one per reader
+    :param index: position of this reader in counters
+    """
+    randomizer = random.Random(index)
+    while time.monotonic() < deadline:
+        kind = randomizer.randrange(3)
+        if kind == 0:
+            storage.get_movie_by_title(randomizer.choice(titles))
+        elif kind == 1:
+            start_year = randomizer.randrange(1920, 2020)
+            list(storage.query_movies(min_rating=5, year_range=(start_year, start_year + 5), limit=50))
+        else:
+            storage.rating_stats()
+        counters[index] += 1
+
+
+def write_movies(deadline, counters):
+    """
+    Adds small batches of movies until the deadline, each batch in an own transaction.
+    :param deadline: monotonic timestamp at which the writer stops
+    :param counters: dictionary which counts the written batches
+    """
+    batch_number = 0
+    while time.monotonic() < deadline:
+        storage.add_movies([(f"Written Movie {batch_number}-{number}", 2000, 5.0, "")
+                            for number in range(WRITE_BATCH_SIZE)])
+        batch_number += 1
+    counters["writes"] = batch_number
+
+
+def run_benchmark(movie_count, readers, duration, **engine_options):
+    """
+    Measures the reads and writes per second on a fresh temporary database.
+    :param movie_count: amount of movies in the database
+    :param readers: amount of reading threads
+    :param duration: length of the measurement in seconds
+    :param engine_options: further arguments of storage.create_sqlite_engine
+    :return: Tuple (reads per second, written batches per second).
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        storage.configure_database(os.path.join(folder, "movies.db"), **engine_options)
+        storage.connect_to_sql_db()
+        titles = fill_database(movie_count)
+
+        read_counts = [0] * readers
+        write_counts = {}
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=read_movies, args=(titles, deadline, read_counts, index))
+                   for index in range(readers)]
+        threads.append(threading.Thread(target=write_movies, args=(deadline, write_counts)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        storage.engine.dispose()
+
+    return sum(read_counts) / duration, write_counts.get("writes", 0) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read throughput of the movie storage during writes.")
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="length of the measurement in seconds")
+    parser.add_argument("--journal-mode", default=storage.JOURNAL_MODE)
+    parser.add_argument("--synchronous", default=storage.SYNCHRONOUS)
+    parser.add_argument("--mmap-size", type=int, default=storage.MMAP_SIZE)
+    parser.add_argument("--cache-size", type=int, default=storage.CACHE_SIZE)
+    arguments = parser.parse_args()
+
+    reads_per_second, writes_per_second = run_benchmark(
+        arguments.movies, arguments.readers, arguments.duration,
+        journal_mode=arguments.journal_mode, synchronous=arguments.synchronous,
+        mmap_size=arguments.mmap_size, cache_size=arguments.cache_size)
+    print(f"journal_mode={arguments.journal_mode} synchronous={arguments.synchronous} "
+          f"readers={arguments.readers} movies={arguments.movies}")
+    print(f"Reads: {reads_per_second:.0f}/s, written batches of {WRITE_BATCH_SIZE}: {writes_per_second:.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Local stub of the OMDb API for tests and benchmarks without network access.
+
+Run it with `python -m benchmarks.omdb_stub_server --port 8081` and point the
+client to it with OMDB_API_URL=http://127.0.0.1:8081/.
+"""
+import argparse
+import hashlib
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def synthetic_movie_json(movie_title, host="posters.example"):
+    """
+    Builds a deterministic OMDb response for any title.
+    Titles starting with "unknown" are answered with "Movie not found!".
+    :param movie_title: requested title
+    :param host: host which serves the posters, the stub itself serves them under /posters/
+    :return: OMDb response as dictionary.
+    """
+    if movie_title.lower().startswith("unknown"):
+        return {"Response": "False", "Error": "Movie not found!"}
+
+    digest = int(hashlib.sha256(movie_title.lower().encode("utf-8")).hexdigest(), 16)
+    year = 1920 + digest % 105
+    rating = (digest // 105) % 91 / 10 + 1
+    return {"Response": "True",
+            "Title": movie_title.title(),
+            "Year": str(year),
+            "Poster": f"http://{host}/posters/{digest % 10 ** 8}.jpg",
+            "imdbRating": str(rating),
+            "Ratings": [{"Source": "Internet Movie Database", "Value": f"{rating}/10"}]}
+
+
+class OmdbStubHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET requests like the OMDb API and serves poster images under /posters/.
+    The behaviour is configured on the server:
+    responses (title -> response), latency in seconds and fail_every (every n-th request fails with 503).
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.counter_lock:
+            server.request_count += 1
+            request_number = server.request_count
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.fail_every and request_number % server.fail_every == 0:
+            self._send_json(503, {"Response": "False", "Error": "Service unavailable"})
+            return
+
+        path = urlparse(self.path).path
+        if path.startswith("/posters/"):
+            self._send_poster(path)
+            return
+
+        parameters = parse_qs(urlparse(self.path).query)
+        movie_title = parameters.get("t", [""])[0]
+        if not movie_title:
+            self._send_json(200, {"Response": "False", "Error": "Incorrect IMDb ID."})
+            return
+
+        response_json = server.responses.get(movie_title.lower())
+        if response_json is None:
+            response_json = synthetic_movie_json(movie_title, self.headers.get("Host"))
+        self._send_json(200, response_json)
+
+    def _send_poster(self, path):
+        """
+        Answers with a small generated JPEG image whose colour depends on the path.
+        The ETag of the image is honoured with 304 Not Modified.
+        """
+        etag = f'"{hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # Pillow is only needed by the stub if posters are requested
+        from PIL import Image
+        colour = tuple(bytes.fromhex(etag[1:7]))
+        image_buffer = io.BytesIO()
+        Image.new("RGB", (300, 444), colour).save(image_buffer, "JPEG")
+        body = image_buffer.getvalue()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, response_json):
+        body = json.dumps(response_json).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep the output of tests and benchmarks clean
+        pass
+
+
+def start_stub_server(port=0, responses=None, latency=0.0, fail_every=0):
+    """
+    Starts the stub server in a background thread.
+    :param port: port to listen on, 0 selects a free port
+    :param responses: dictionary title -> OMDb response, other titles get synthetic responses
+    :param latency: delay of every response in seconds
+    :param fail_every: every n-th request is answered with 503, 0 never fails
+    :return: Running server, its URL is f"http://127.0.0.1:{server.server_port}/".
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), OmdbStubHandler)
+    server.daemon_threads = True
+    server.responses = {title.lower(): response for title, response in (responses or {}).items()}
+    server.latency = latency
+    server.fail_every = fail_every
+    server.request_count = 0
+    server.counter_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the OMDb API.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--responses", help="JSON file which maps titles to OMDb responses")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of every response in seconds")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every n-th request with 503")
+    arguments = parser.parse_args()
+
+    responses = None
+    if arguments.responses:
+        with open(arguments.responses, "r", encoding="utf-8") as json_file:
+            responses = json.load(json_file)
+
+    server = start_stub_server(arguments.port, responses, arguments.latency, arguments.fail_every)
+    print(f"OMDb stub server is listening on http://127.0.0.1:{server.server_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
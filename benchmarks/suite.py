@@ -0,0 +1,337 @@
+"""
+Benchmark suite of the storage, search, statistics, filter and website paths.
+
+Run it with `python -m benchmarks.suite --size 100k --save-baseline` once and later with
+`python -m benchmarks.suite --size 100k --compare` to see the changes against the baseline.
+The committed baseline benchmarks/baselines/1k.json is a reference of the default size, timings
+depend on the machine, so save an own baseline before comparing. Without a baseline the results
+are printed with "no base".
+The movies come from benchmarks.synthetic_catalogue, the seeded database of each size is cached
+in data/benchmarks and every run works on a copy of it. Movies are imported from the local OMDb stub.
+
+For each path the median and p95 latency, the throughput in items per second
+and the peak of the memory traced by tracemalloc are measured.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, NamedTuple, Optional
+from sqlalchemy import text
+from benchmarks import synthetic_catalogue
+from benchmarks.omdb_stub_server import start_stub_server
+from movie_storage import movie_storage_sql as storage
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FOLDER = os.path.join(PROJECT_FOLDER, "benchmarks", "baselines")
+CATALOGUE_SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+# Amount of titles used by the lookups, updates and searches
+SAMPLE_SIZE = 100
+# Amount of titles fetched from the OMDb stub by one import
+IMPORT_SIZE = 50
+# A case is reported as regression if it is slower or needs more memory by this fraction
+DEFAULT_TOLERANCE = 0.25
+FTS_QUERIES = ("silent night", "golden", "kingdom returns", "dark sha", "origins", "the lost island")
+
+
+class BenchmarkCase(NamedTuple):
+    name: str
+    # runs the measured operation and returns the amount of processed items
+    run: Callable[[], int]
+    # prepares a run, it is not measured
+    setup: Optional[Callable[[], None]] = None
+
+
+def create_cases(work_folder, sample_titles):
+    """
+    Create the benchmark cases for the configured database.
+    :param work_folder: folder for the generated website files
+    :param sample_titles: titles of movies spread over the database
+    :return: List of BenchmarkCase records.
+    """
+    # the modules with heavy dependencies are imported after the database is configured
+    from movie_analytics import rating_analytics
+    from movie_api import api_communication as api
+    from movie_charts import chart_export
+    from movie_cli import cli
+    from movie_html import html_handler
+    from movie_search import search_index
+
+    misspelled_titles = [title[:5] + title[6:] for title in sample_titles[:10]]
+    import_numbers = itertools.count()
+    rating_offsets = itertools.cycle((0.1, -0.1))
+    website_file = os.path.join(work_folder, "index.html")
+    pages_folder = os.path.join(work_folder, "pages")
+
+    def list_movies():
+        return sum(1 for _ in storage.iter_movies())
+
+    def filter_movies():
+        return sum(1 for _ in storage.query_movies(min_rating=7, year_range=(1990, 2010)))
+
+    def sorted_page():
+        return len(list(storage.query_movies(order_by="rating", descending=True, limit=50, offset=500)))
+
+    def get_movies_by_title():
+        for title in sample_titles:
+            storage.get_movie_by_title(title)
+        return len(sample_titles)
+
+    def update_ratings():
+        rating_offset = next(rating_offsets)
+        storage.update_ratings((title, 5.0 + rating_offset) for title in sample_titles)
+        return len(sample_titles)
+
+    def import_from_omdb():
+        import_number = next(import_numbers)
+        movie_titles = [f"Benchmark Import {import_number} {number}" for number in range(IMPORT_SIZE)]
+        return sum(1 for _ in cli.fetch_and_add_movies(api, movie_titles))
+
+    def search_titles():
+        for query in FTS_QUERIES:
+            storage.search_titles(query)
+        return len(FTS_QUERIES)
+
+    def find_similar_titles():
+        for query in misspelled_titles:
+            search_index.find_similar_titles(query)
+        return len(misspelled_titles)
+
+    def build_search_index():
+        search_index.build_index()
+        return storage.count_movies()
+
+    def load_catalogue():
+        rating_analytics.load_catalogue()
+        return storage.count_movies()
+
+    def sql_rating_stats():
+        storage.rating_stats()
+        storage.year_stats()
+        return 1
+
+    def numpy_rating_stats():
+        rating_analytics.rating_stats()
+        rating_analytics.year_stats()
+        return 1
+
+    def numpy_filter_movies():
+        return len(rating_analytics.filter_movies(min_rating=7, year_range=(1990, 2010)))
+
+    def forget_website():
+        # without cached fragments and chart every movie is rendered again
+        with storage.engine.begin() as connection:
+            connection.execute(text("DELETE FROM movie_html_fragments"))
+        chart_export._render_histogram.cache_clear()
+        if os.path.exists(website_file):
+            os.remove(website_file)
+
+    def build_website():
+        html_handler.build_website(website_file, "Benchmark")
+        return storage.count_movies()
+
+    def forget_pages():
+        shutil.rmtree(pages_folder, ignore_errors=True)
+
+    def build_paginated_website():
+        html_handler.build_paginated_website(pages_folder, "Benchmark")
+        return storage.count_movies()
+
+    return [
+        BenchmarkCase("storage.list_movies", list_movies),
+        BenchmarkCase("storage.filter_movies", filter_movies),
+        BenchmarkCase("storage.sorted_page", sorted_page),
+        BenchmarkCase("storage.get_movie_by_title", get_movies_by_title),
+        BenchmarkCase("storage.update_ratings", update_ratings),
+        BenchmarkCase("storage.import_from_omdb", import_from_omdb),
+        BenchmarkCase("search.fts_titles", search_titles),
+        BenchmarkCase("search.build_index", build_search_index),
+        BenchmarkCase("search.similar_titles", find_similar_titles),
+        BenchmarkCase("stats.sql", sql_rating_stats),
+        BenchmarkCase("analytics.load_catalogue", load_catalogue),
+        BenchmarkCase("analytics.stats", numpy_rating_stats),
+        BenchmarkCase("analytics.filter_movies", numpy_filter_movies),
+        BenchmarkCase("site.build_website_cold", build_website, forget_website),
+        BenchmarkCase("site.build_website_unchanged", build_website),
+        BenchmarkCase("site.build_paginated_website_cold", build_paginated_website, forget_pages),
+    ]
+
+
+def get_percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    rank = max(1, math.ceil(len(sorted_values) * percent / 100))
+    return sorted_values[rank - 1]
+
+
+def measure_case(case, repeat):
+    """
+    Run a case once to warm up, then repeatedly for the latencies and once more under tracemalloc.
+    :param case: BenchmarkCase record
+    :param repeat: amount of measured runs
+    :return: Dictionary with median_seconds, p95_seconds, items_per_second and peak_memory_bytes.
+    """
+    if case.setup is not None:
+        case.setup()
+    case.run()
+
+    timings = []
+    item_count = 0
+    for _ in range(repeat):
+        if case.setup is not None:
+            case.setup()
+        started_at = time.perf_counter()
+        item_count = case.run()
+        timings.append(time.perf_counter() - started_at)
+
+    # tracemalloc slows down the allocations, so the memory is measured in an own run
+    if case.setup is not None:
+        case.setup()
+    tracemalloc.start()
+    try:
+        case.run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    median_seconds = statistics.median(timings)
+    return {"median_seconds": median_seconds,
+            "p95_seconds": get_percentile(timings, 95),
+            "items_per_second": item_count / median_seconds if median_seconds else None,
+            "peak_memory_bytes": peak_memory}
+
+
+def compare_with_baseline(results, baseline_results, tolerance):
+    """
+    Compare the results of a run with the results of the baseline.
+    :param results: case name -> measured values
+    :param baseline_results: case name -> measured values of the baseline
+    :param tolerance: allowed increase of the latency and memory as fraction
+    :return: Tuple (case name -> latency ratio to the baseline, list of regression messages).
+    """
+    ratios = {}
+    regressions = []
+    for name, values in results.items():
+        baseline_values = baseline_results.get(name)
+        if baseline_values is None:
+            continue
+        ratio = values["median_seconds"] / baseline_values["median_seconds"]
+        ratios[name] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: median latency {ratio:.2f}x of the baseline")
+        baseline_memory = baseline_values["peak_memory_bytes"]
+        if baseline_memory and values["peak_memory_bytes"] > baseline_memory * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {values['peak_memory_bytes'] / baseline_memory:.2f}x "
+                               f"of the baseline")
+    return ratios, regressions
+
+
+def print_results(results, ratios):
+    """
+    Print the measured values, cases without a value in the baseline are marked with "no base".
+    :param results: case name -> measured values
+    :param ratios: case name -> latency ratio to the baseline, empty without a baseline
+    """
+    print(f"{'case':36} {'median ms':>10} {'p95 ms':>10} {'items/s':>12} {'peak MiB':>9} {'vs base':>8}")
+    for name, values in results.items():
+        ratio = f"{ratios[name]:.2f}x" if name in ratios else "no base"
+        print(f"{name:36} {values['median_seconds'] * 1000:10.2f} {values['p95_seconds'] * 1000:10.2f} "
+              f"{values['items_per_second'] or 0:12.0f} {values['peak_memory_bytes'] / 1024 / 1024:9.1f} "
+              f"{ratio:>8}")
+
+
+def get_baseline_file_name(baseline_name):
+    return os.path.join(BASELINE_FOLDER, f"{baseline_name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the storage, search, stats and website.")
+    parser.add_argument("--size", choices=CATALOGUE_SIZES, default="1k", help="amount of movies")
+    parser.add_argument("--repeat", type=int, default=5, help="measured runs per case")
+    parser.add_argument("--cases", help="run only the cases whose names start with this prefix")
+    parser.add_argument("--baseline", help="name of the baseline, the size by default")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed increase against the baseline as fraction")
+    parser.add_argument("--cache-folder", default=synthetic_catalogue.DEFAULT_CACHE_FOLDER,
+                        help="folder of the seeded databases")
+    arguments = parser.parse_args()
+    movie_count = CATALOGUE_SIZES[arguments.size]
+    baseline_file_name = get_baseline_file_name(arguments.baseline or arguments.size)
+
+    baseline = None
+    if arguments.compare:
+        try:
+            with open(baseline_file_name, "r", encoding="utf-8") as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            print(f"No baseline {baseline_file_name}, the results are not compared. "
+                  f"Run with --save-baseline to store one.")
+
+    started_at = time.perf_counter()
+    seeded_db_path = synthetic_catalogue.get_seeded_database(movie_count, cache_folder=arguments.cache_folder)
+    print(f"Seeded database with {movie_count} movies ready after {time.perf_counter() - started_at:.1f} s.")
+
+    # the templates of the website are found relative to the project folder
+    os.chdir(PROJECT_FOLDER)
+    stub_server = start_stub_server()
+    with tempfile.TemporaryDirectory() as work_folder:
+        work_db_path = os.path.join(work_folder, "movies.db")
+        shutil.copyfile(seeded_db_path, work_db_path)
+        # the OMDb cache and client are configured before movie_api is imported
+        os.environ["OMDB_CACHE_DB_URL"] = f"sqlite:///{os.path.join(work_folder, 'omdb_cache.db')}"
+        storage.configure_database(work_db_path)
+        storage.connect_to_sql_db()
+
+        from movie_api import api_communication as api
+        api.set_default_client(api.OmdbClient(api_url=f"http://127.0.0.1:{stub_server.server_port}/",
+                                              requests_per_second=10000, burst=IMPORT_SIZE,
+                                              requests_per_day=None))
+
+        step = max(1, movie_count // SAMPLE_SIZE)
+        sample_titles = [movie.title for movie in itertools.islice(storage.iter_movies(), 0, None, step)]
+        cases = create_cases(work_folder, sample_titles[:SAMPLE_SIZE])
+        if arguments.cases:
+            cases = [case for case in cases if case.name.startswith(arguments.cases)]
+
+        results = {}
+        for case in cases:
+            results[case.name] = measure_case(case, arguments.repeat)
+        storage.engine.dispose()
+    stub_server.shutdown()
+
+    ratios, regressions = ({}, []) if baseline is None else \
+        compare_with_baseline(results, baseline["results"], arguments.tolerance)
+    print_results(results, ratios)
+
+    if arguments.save_baseline:
+        os.makedirs(BASELINE_FOLDER, exist_ok=True)
+        with open(baseline_file_name, "w", encoding="utf-8") as baseline_file:
+            json.dump({"movies": movie_count,
+                       "repeat": arguments.repeat,
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, baseline_file, indent=2)
+        print(f"Saved the baseline {baseline_file_name}.")
+
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
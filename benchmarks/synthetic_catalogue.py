@@ -0,0 +1,108 @@
+"""
+Generator of reproducible synthetic movie catalogues for the benchmarks.
+
+Run it with `python -m benchmarks.synthetic_catalogue --movies 100000 --db /tmp/movies_100k.db`.
+The same amount of movies and seed always give the same titles, years and ratings.
+"""
+import argparse
+import os
+import random
+import time
+from movie_storage import movie_storage_sql as storage
+
+DEFAULT_SEED = 42
+# Amount of movies added in one transaction
+SEED_BATCH_SIZE = 10000
+# Seeded databases are kept here and copied by the benchmarks, seeding 1M movies takes minutes
+DEFAULT_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    "data", "benchmarks")
+
+TITLE_ADJECTIVES = ("Silent", "Dark", "Last", "Golden", "Broken", "Hidden", "Eternal", "Wild",
+                    "Lost", "Crimson", "Frozen", "Burning", "Secret", "Distant", "Electric", "Little")
+TITLE_NOUNS = ("Night", "River", "Kingdom", "Dream", "Empire", "Shadow", "Garden", "Storm",
+               "Heart", "City", "Machine", "Road", "Island", "Star", "Mirror", "Winter")
+TITLE_SUFFIXES = ("", "", "", " Returns", " Reloaded", " of the North", " in Paris", ": Origins")
+
+
+def generate_movies(movie_count, seed=DEFAULT_SEED):
+    """
+    Generate synthetic movies with unique titles, years and ratings like OMDb data.
+    :param movie_count: amount of movies
+    :param seed: seed of the random generator
+    :return: Generator of tuples (title, year, rating, poster_url).
+    """
+    randomizer = random.Random(seed)
+    for number in range(movie_count):
+        title = (f"The {randomizer.choice(TITLE_ADJECTIVES)} {randomizer.choice(TITLE_NOUNS)}"
+                 f"{randomizer.choice(TITLE_SUFFIXES)} {number}")
+        year = randomizer.randint(1920, 2024)
+        # most ratings are in the middle of the range, like on IMDb
+        rating = round(min(10.0, max(1.0, randomizer.gauss(6.5, 1.2))), 1)
+        poster_url = f"https://posters.example/{number}.jpg"
+        yield title, year, rating, poster_url
+
+
+def seed_database(db_path, movie_count, seed=DEFAULT_SEED, batch_size=SEED_BATCH_SIZE):
+    """
+    Create a database with synthetic movies, the storage is configured to use it afterwards.
+    :param db_path: path of the new database file
+    :param movie_count: amount of movies
+    :param seed: seed of the random generator
+    :param batch_size: amount of movies added in one transaction
+    :return: Seconds needed to add the movies.
+    """
+    storage.configure_database(db_path)
+    storage.connect_to_sql_db()
+    started_at = time.perf_counter()
+    batch = []
+    for movie in generate_movies(movie_count, seed):
+        batch.append(movie)
+        if len(batch) == batch_size:
+            storage.add_movies(batch)
+            batch = []
+    if batch:
+        storage.add_movies(batch)
+    return time.perf_counter() - started_at
+
+
+def get_seeded_database(movie_count, seed=DEFAULT_SEED, cache_folder=DEFAULT_CACHE_FOLDER):
+    """
+    Return the path of a seeded database, it is created at the first call.
+    The benchmarks should work on a copy, so that the cached database stays unchanged.
+    :param movie_count: amount of movies
+    :param seed: seed of the random generator
+    :param cache_folder: folder of the seeded databases
+    :return: Path of the database file.
+    """
+    db_path = os.path.join(cache_folder, f"movies_{movie_count}_{seed}.db")
+    if os.path.exists(db_path):
+        return db_path
+
+    os.makedirs(cache_folder, exist_ok=True)
+    # an interrupted seed must not leave a half filled database behind
+    partial_db_path = db_path + ".partial"
+    if os.path.exists(partial_db_path):
+        os.remove(partial_db_path)
+    seed_database(partial_db_path, movie_count, seed)
+    # closing the connections checkpoints the WAL into the database file
+    storage.engine.dispose()
+    os.replace(partial_db_path, db_path)
+    return db_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a database with synthetic movies.")
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--db", required=True, help="path of the new database file")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    arguments = parser.parse_args()
+
+    if os.path.exists(arguments.db):
+        parser.error(f"{arguments.db} exists already.")
+    seconds = seed_database(arguments.db, arguments.movies, arguments.seed)
+    storage.engine.dispose()
+    print(f"Added {arguments.movies} movies to {arguments.db} in {seconds:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
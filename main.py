@@ -1,11 +1,13 @@
 from datetime import datetime
 import random
+import sys
 import colorama
-import matplotlib.pyplot as plt
-from rapidfuzz import fuzz
 from movie_storage import movie_storage_sql as storage
 from movie_api import api_communication as api
 from movie_html import html_handler
+from movie_search import search_index
+from movie_analytics import catalogue_snapshot, rating_analytics
+from movie_charts import chart_export
 from helpers import helper_functions as helper
 
 SIMILARITY_THRESHOLD_PERCENTAGE = 50
@@ -15,19 +17,17 @@ def list_all_movies():
     """
     Prints all movies in the list.
     """
-    movies_list = storage.list_movies()
+    amount_of_movies = storage.count_movies()
 
-    if movies_list is None:
+    if amount_of_movies == 0:
         print(f"{colorama.Fore.RED} Not possible to list the empty list.")
         return
 
-    amount_of_movies = len(movies_list)
     print(f"{amount_of_movies} movies in total")
 
-    for movie in movies_list:
-        # _ignore poster_url
-        title, year, rating, _ = movie.values()
-        print(f"{colorama.Style.BRIGHT}{title} ({year}): {colorama.Fore.CYAN}{rating}")
+    # movies are printed while they are fetched from the database
+    for movie in storage.iter_movies():
+        print(f"{colorama.Style.BRIGHT}{movie.title} ({movie.year}): {colorama.Fore.CYAN}{movie.rating}")
 
 
 def add_new_movie():
@@ -39,7 +39,8 @@ def add_new_movie():
         title, year, rating, image_url = api.get_movie_data_from_api(movie_title)
         if not title:
             raise ValueError(f"Movie title '{movie_title}' is unknown.")
-        helper.check_movie_title_is_in_db(movie_title, movie_should_exist = False)
+        # the API returns the canonical title, which differs from the input in letter case
+        helper.check_movie_title_is_in_db(title, movie_should_exist = False, ignore_case = True)
         storage.add_movie(title, year, rating, image_url)
     except (ValueError, TypeError) as error:
         print(f"{colorama.Fore.RED}Error in movie title: {error}")
@@ -88,22 +89,29 @@ def evaluate_stat():
     """
     Display statistical data: average rating, median rating, the best movie, worst movie.
     """
-    movies_list = storage.list_movies()
-    rating_list = helper.get_rating_list(movies_list)
-    helper.calculate_and_print_average(rating_list)
-    helper.calculate_median(rating_list)
-    sorted_movies_list_by_rating = helper.sort_movies_by(movies_list, "rating")
+    stats = rating_analytics.rating_stats()
 
-    if sorted_movies_list_by_rating is not None:
-        helper.print_best_and_worst_movie(sorted_movies_list_by_rating)
+    if stats is None:
+        print(f"{colorama.Fore.RED}No movies for statistics in the database.")
+        return
+    helper.print_rating_stats(stats)
 
 
 def generate_random_movie():
     """
     Generates and prints a movie suggestions from the movie list.
+    With the catalogue snapshot only the picked movie is read.
     """
-    movies_list = storage.list_movies()
-    generated_movie = random.choice(movies_list)
+    snapshot = catalogue_snapshot.refresh_snapshot() if catalogue_snapshot.SNAPSHOT_ENABLED else None
+    if snapshot is not None:
+        movie = snapshot.random_movie()
+        generated_movie = None if movie is None else movie._asdict()
+    else:
+        movies = storage.list_movies()
+        generated_movie = random.choice(movies) if movies else None
+    if generated_movie is None:
+        print(f"{colorama.Fore.RED}No movies in the database.")
+        return
     title = generated_movie["title"]
     rating = generated_movie["rating"]
     print(f"Your movie for tonight: "
@@ -119,25 +127,23 @@ def search_movie():
     If no matching, display the suggestions form the movies list.
     """
     users_movie_input = input(f"{colorama.Fore.MAGENTA}Enter part of movie title: ")
-    movies_list = storage.list_movies()
 
-    # first check if the part of a title is in the movies titles
-    suggestions = helper.search_movie_with_suggestions(users_movie_input, movies_list)
+    # first check if the words of the title are in the full-text index
+    # this step is also important, because the leverstein similarity not always
+    # overlays with the human feeling of a similarity
+    suggestions = storage.search_titles(users_movie_input)
     if suggestions:
         for suggestion_movie in suggestions:
-            print(f"{colorama.Fore.RED}Did you mean: {suggestion_movie['title']}")
+            print(f"{colorama.Fore.RED}Did you mean: {suggestion_movie.title}")
         return
 
     # then do the leverstein comparison
-    similarity_is_found = False
-    for movie in movies_list:
-        similarity_ratio = fuzz.ratio(users_movie_input, movie["title"])
-
-        if similarity_ratio > SIMILARITY_THRESHOLD_PERCENTAGE:
-            similarity_is_found = True
-            print(f"{colorama.Fore.RED}Did you mean: {movie['title']}")
+    similar_titles = search_index.find_similar_titles(
+        users_movie_input, score_cutoff=SIMILARITY_THRESHOLD_PERCENTAGE)
+    for similar_title, _ in similar_titles:
+        print(f"{colorama.Fore.RED}Did you mean: {similar_title}")
 
-    if not similarity_is_found:
+    if not similar_titles:
         print(f"{colorama.Fore.RED}No match for {users_movie_input}.")
 
 
@@ -145,8 +151,7 @@ def sort_movies_by_rating():
     """
     Sorts the list of movies according to the rating.
     """
-    movies_list = storage.list_movies()
-    sorted_movies_by_rating = helper.sort_movies_by(movies_list, "rating")
+    sorted_movies_by_rating = storage.query_movies(order_by="rating", descending=True)
     helper.print_sorted_movies(sorted_movies_by_rating)
 
 
@@ -154,36 +159,28 @@ def sort_movies_by_year():
     """
     Sorts the list of movies according to the year.
     """
-    movies_list = storage.list_movies()
-
     latest_movie_first_string = input("Do you want the latest movie first? (Y/N): ")
     if "y" in latest_movie_first_string.lower():
-        sorted_movies_by_rating = helper.sort_movies_by(movies_list, "year", reverse_list=True)
-        helper.print_sorted_movies(sorted_movies_by_rating)
+        sorted_movies_by_year = storage.query_movies(order_by="year", descending=True)
+        helper.print_sorted_movies(sorted_movies_by_year)
     elif "n" in latest_movie_first_string.lower():
-        sorted_movies_by_rating = helper.sort_movies_by(movies_list, "year", reverse_list=False)
-        helper.print_sorted_movies(sorted_movies_by_rating)
+        sorted_movies_by_year = storage.query_movies(order_by="year", descending=False)
+        helper.print_sorted_movies(sorted_movies_by_year)
 
 
 def create_histogram():
     """
     Generate a histogram: X movie rating, Y amount of movies with a specific rating.
     """
-    movies_list = storage.list_movies()
-    rating_list = []
-    for movie in movies_list:
-        rating_list.append(movie["rating"])
-
-    # bins are number of groups of data
-    plt.hist(rating_list, bins=30, edgecolor='black')
-    plt.xlabel("Rating")
-    plt.ylabel("Movies frequency")
-    plt.title("Movie Rating Histogram")
     hist_file_title = input(f"{colorama.Fore.MAGENTA}"
-                           f"Enter file title for saving the histogram (without extension): ")
-    plt.savefig(hist_file_title + ".png")
+                           f"Enter file title for saving the histogram "
+                           f"(with .svg for a vector image, otherwise a .png is saved): ")
+    if not hist_file_title.lower().endswith((".png", ".svg")):
+        hist_file_title += ".png"
+    # the bins are grouped from the rating buckets precomputed in the database
+    chart_export.save_rating_histogram(hist_file_title)
     print(f"{colorama.Fore.MAGENTA}"
-          f"The histogram was saved to the file {hist_file_title}.png")
+          f"The histogram was saved to the file {hist_file_title}")
 
 
 def filter_movies():
@@ -213,16 +210,17 @@ def filter_movies():
             end_year = datetime.today().year
     except (ValueError, TypeError) as error:
         print(f"{colorama.Fore.RED}Value should be a number: {error}")
+        return
 
-    movies_list = storage.list_movies()
+    filtered_movies = rating_analytics.filter_movies(min_rating=minimum_rating,
+                                                     year_range=(start_year, end_year))
 
-    for movie in movies_list:
-        if movie["rating"] >= minimum_rating and start_year <= movie["year"] <= end_year:
-            print(f"{colorama.Style.BRIGHT}"
-                  f"{movie['title']} "
-                  f"({movie['year']}): "
-                  f"{colorama.Fore.CYAN}"
-                  f"{movie['rating']}")
+    for title, year, rating in filtered_movies:
+        print(f"{colorama.Style.BRIGHT}"
+              f"{title} "
+              f"({year}): "
+              f"{colorama.Fore.CYAN}"
+              f"{rating}")
 
 
 def generate_website():
@@ -230,14 +228,66 @@ def generate_website():
     Generate a website from the movies in database.
     """
     html_file_name = 'index.html'
-    serialized_movies = html_handler.serialise_all_movies()
-    html_template = html_handler.get_template()
-    template_filled_with_title = html_handler.insert_movie_data_into_html_template(
-        html_template, '__TEMPLATE_TITLE__', 'Movie App of Anastasia')
-    filled_template = html_handler.insert_movie_data_into_html_template(
-        template_filled_with_title, '__TEMPLATE_MOVIE_GRID__', serialized_movies)
-    html_handler.create_html_file(html_file_name, filled_template)
-    print(f"Website {html_file_name} is created.")
+    # only the changed movies are rendered again
+    file_is_written = html_handler.build_website(html_file_name, 'Movie App of Anastasia')
+    if file_is_written:
+        print(f"Website {html_file_name} is created.")
+    else:
+        print(f"Website {html_file_name} is up to date.")
+
+
+def generate_paginated_website():
+    """
+    Generate a website with several pages from the movies in database.
+    """
+    output_folder = 'pages'
+    # only the pages with changed movies are rendered again
+    written_pages, page_count = html_handler.build_paginated_website(
+        output_folder, 'Movie App of Anastasia')
+    print(f"Website {output_folder}/index.html is created: "
+          f"{written_pages} of {page_count} pages are written.")
+
+
+def download_posters():
+    """
+    Download the posters of the movies and create their thumbnails for the website.
+    """
+    # imported here, Pillow is only loaded when the posters are downloaded
+    from movie_posters import poster_pipeline
+    summary = poster_pipeline.sync_posters()
+    print(f"Posters: {summary['downloaded']} downloaded, {summary['unchanged']} unchanged, "
+          f"{summary['failed']} failed, {summary['thumbnails_failed']} without thumbnails.")
+
+
+def import_movies_from_file(file_name):
+    """
+    Adds all movies from a file without asking the user.
+    The movie data is fetched concurrently, the movies are stored in a single transaction.
+    :param file_name: path to a text or CSV file with movie titles
+    """
+    try:
+        movie_titles = helper.read_titles_from_file(file_name)
+    except OSError as error:
+        print(f"{colorama.Fore.RED}Error reading {file_name}: {error}")
+        return
+
+    existing_titles = storage.find_existing_titles(movie_titles)
+    new_titles = [title for title in movie_titles if title.lower() not in existing_titles]
+    print(f"{len(new_titles)} of {len(movie_titles)} titles are not in the database yet.")
+
+    fetched_movies = []
+    for movie_title, movie_data, error in api.get_movies_data_from_api(new_titles):
+        if error is not None:
+            print(f"{colorama.Fore.RED}Error fetching {movie_title}: {error}")
+        elif movie_data is None:
+            print(f"{colorama.Fore.RED}Movie title '{movie_title}' is unknown "
+                  f"or has no valid year or rating.")
+        else:
+            fetched_movies.append(movie_data)
+
+    results = storage.add_movies(fetched_movies)
+    added_count = sum(result.status == storage.ADDED for result in results)
+    print(f"{added_count} movies imported from {file_name}.")
 
 
 def display_menu():
@@ -258,6 +308,8 @@ def display_menu():
 10. Create Rating Histogram
 11. Filter movies
 12. Generate website
+13. Generate paginated website
+14. Download posters
     """)
 
 
@@ -285,10 +337,12 @@ def process_menu_choice(menu_cmd):
         sort_movies_by_year,
         create_histogram,
         filter_movies,
-        generate_website
+        generate_website,
+        generate_paginated_website,
+        download_posters
     ]
 
-    if command > len(func_list):
+    if not 0 <= command < len(func_list):
         print(colorama.Fore.RED + "Not supported number for a command!")
         return
     func_list[command]()
@@ -306,7 +360,7 @@ def main():
     while True:
         display_menu()
         user_choice = input(f"{colorama.Fore.MAGENTA}"
-                            f"Enter choice (1-12): ")
+                            f"Enter choice (1-14): ")
         if user_choice == "0":  # a possibility to stop the infinite loop
             print("Bye!")
             break
@@ -315,4 +369,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # python main.py import titles.txt adds all titles from the file without the menu
+    if len(sys.argv) == 3 and sys.argv[1] == "import":
+        colorama.init(autoreset=True)
+        storage.connect_to_sql_db()
+        import_movies_from_file(sys.argv[2])
+    else:
+        main()
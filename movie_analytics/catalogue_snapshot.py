@@ -0,0 +1,293 @@
+"""
+Memory-mapped columnar snapshot of the catalogue for read-only commands.
+
+The snapshot is a single file next to the database (movies.db.snapshot) with the years, ratings,
+offsets-encoded title, poster URL and poster path blobs and the precomputed sort orders of the movies.
+Opening it maps the file without parsing the movies; it is only used while the data version
+of the database is the one it was written from.
+It is switched on with the environment variable MOVIES_SNAPSHOT=1 or the --snapshot option of the CLI.
+"""
+import json
+import mmap
+import os
+import random
+import struct
+import uuid
+import numpy as np
+from movie_analytics import rating_analytics
+from movie_storage import movie_storage_sql as storage
+
+SNAPSHOT_ENABLED = os.getenv("MOVIES_SNAPSHOT", "") not in ("", "0")
+# The header of the file: magic bytes, length of the JSON header as unsigned 64 bit integer
+SNAPSHOT_MAGIC = b"MOVIES-SNAPSHOT\x00"
+SNAPSHOT_FORMAT_VERSION = 2
+# The columns start at multiples of this amount of bytes
+COLUMN_ALIGNMENT = 64
+# Attempts to read the movies without a write of another process in between
+WRITE_ATTEMPTS = 3
+
+
+def get_snapshot_path():
+    """
+    Path of the snapshot of the configured database.
+    :return: Path next to the database file or None for an in-memory database.
+    """
+    database = storage.engine.url.database
+    if not database or database == ":memory:":
+        return None
+    return database + ".snapshot"
+
+
+class CatalogueSnapshot:
+    """
+    Read-only view of the columns of a mapped snapshot file.
+    The arrays are backed by the mapping, only the movies which are read are decoded.
+    """
+
+    def __init__(self, mapped_file):
+        """
+        :param mapped_file: mmap of the snapshot file
+        :raise ValueError: if the file is not a snapshot of the current format.
+        """
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        if mapped_file[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("Not a catalogue snapshot.")
+        header_length, = struct.unpack("<Q", mapped_file[len(SNAPSHOT_MAGIC):header_start])
+        header = json.loads(mapped_file[header_start:header_start + header_length])
+        if header["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Snapshot format {header['format_version']} is not supported.")
+
+        self._mapped_file = mapped_file
+        self.data_version = (header["catalogue_id"], header["data_version"])
+        self.movie_count = header["movie_count"]
+        columns = {name: np.frombuffer(mapped_file, dtype=dtype, count=count, offset=offset)
+                   for name, (dtype, offset, count) in header["columns"].items()}
+        self.years = columns["years"]
+        self.ratings = columns["ratings"]
+        self._title_offsets = columns["title_offsets"]
+        self._poster_offsets = columns["poster_offsets"]
+        self._poster_path_offsets = columns["poster_path_offsets"]
+        self._titles_start = header["columns"]["titles"][1]
+        self._posters_start = header["columns"]["posters"][1]
+        self._poster_paths_start = header["columns"]["poster_paths"][1]
+        self._orders = {column: columns[f"{column}_order"] for column in storage.SORTABLE_COLUMNS}
+
+    def __len__(self):
+        return self.movie_count
+
+    def get_title(self, index):
+        start = self._titles_start + int(self._title_offsets[index])
+        end = self._titles_start + int(self._title_offsets[index + 1])
+        return self._mapped_file[start:end].decode("utf-8")
+
+    def get_movie(self, index):
+        """
+        Decode a single movie.
+        :param index: position of the movie in the order of the ids
+        :return: storage.Movie record.
+        """
+        poster_start = self._posters_start + int(self._poster_offsets[index])
+        poster_end = self._posters_start + int(self._poster_offsets[index + 1])
+        poster_path_start = self._poster_paths_start + int(self._poster_path_offsets[index])
+        poster_path_end = self._poster_paths_start + int(self._poster_path_offsets[index + 1])
+        # a movie without a downloaded poster has an empty poster path in the blob
+        poster_path = self._mapped_file[poster_path_start:poster_path_end].decode("utf-8") or None
+        return storage.Movie(self.get_title(index), int(self.years[index]), float(self.ratings[index]),
+                             self._mapped_file[poster_start:poster_end].decode("utf-8"), poster_path)
+
+    def query_movies(self, min_rating=None, year_range=None, order_by=None,
+                     descending=False, limit=None, offset=0):
+        """
+        Select movies like storage.query_movies, the filters and the sort orders work on the columns.
+        :param min_rating: minimum rating of the movies, None for no minimum.
+        :param year_range: tuple (start_year, end_year), both inclusive.
+        Each of the years can be None for an open range.
+        :param order_by: column to sort by, one of storage.SORTABLE_COLUMNS. None for no sorting.
+        :param descending: if True, sort descending.
+        :param limit: maximum number of movies to return, None for all movies.
+        :param offset: number of movies to skip from the beginning of the result.
+        :return: Generator of storage.Movie records.
+        """
+        if order_by is None:
+            positions = np.arange(self.movie_count)
+        elif order_by in storage.SORTABLE_COLUMNS:
+            # the orders are stable ascending, reversed the ties come last first like in the index
+            positions = self._orders[order_by][::-1] if descending else self._orders[order_by]
+        else:
+            raise ValueError(f"Not possible to sort movies by '{order_by}'.")
+
+        mask = None
+        if min_rating is not None:
+            mask = self.ratings >= min_rating
+        if year_range is not None:
+            start_year, end_year = year_range
+            if start_year is not None:
+                mask = (self.years >= start_year) if mask is None else mask & (self.years >= start_year)
+            if end_year is not None:
+                mask = (self.years <= end_year) if mask is None else mask & (self.years <= end_year)
+        if mask is not None:
+            positions = positions[mask[positions]]
+
+        positions = positions[offset:None if limit is None else offset + limit]
+        for index in positions:
+            yield self.get_movie(int(index))
+
+    def rating_stats(self):
+        """
+        :return: storage.RatingStats or None if the snapshot has no movies.
+        """
+        return rating_analytics.compute_rating_stats(self.ratings, self.get_title)
+
+    def year_stats(self):
+        """
+        :return: List of storage.YearStats sorted by year.
+        """
+        return rating_analytics.compute_year_stats(self.years, self.ratings)
+
+    def random_movie(self, randomizer=random):
+        """
+        Pick a random movie without reading the others.
+        :param randomizer: random.Random instance or the random module
+        :return: storage.Movie record or None if the snapshot has no movies.
+        """
+        if self.movie_count == 0:
+            return None
+        return self.get_movie(randomizer.randrange(self.movie_count))
+
+
+def _read_columns():
+    """
+    Read the columns of all movies in the order of their ids.
+    :return: Dictionary column name -> numpy array.
+    """
+    titles = []
+    years = []
+    ratings = []
+    title_blob = bytearray()
+    title_offsets = [0]
+    poster_blob = bytearray()
+    poster_offsets = [0]
+    poster_path_blob = bytearray()
+    poster_path_offsets = [0]
+    for _, _, movie in storage.iter_movies_with_versions():
+        titles.append(movie.title)
+        years.append(movie.year)
+        ratings.append(movie.rating)
+        title_blob += movie.title.encode("utf-8")
+        title_offsets.append(len(title_blob))
+        poster_blob += movie.poster_url.encode("utf-8")
+        poster_offsets.append(len(poster_blob))
+        poster_path_blob += (movie.poster_path or "").encode("utf-8")
+        poster_path_offsets.append(len(poster_path_blob))
+
+    years = np.array(years, dtype="<i4")
+    ratings = np.array(ratings, dtype="<f8")
+    return {"years": years,
+            "ratings": ratings,
+            "title_offsets": np.array(title_offsets, dtype="<i8"),
+            "titles": np.frombuffer(title_blob, dtype="u1"),
+            "poster_offsets": np.array(poster_offsets, dtype="<i8"),
+            "posters": np.frombuffer(poster_blob, dtype="u1"),
+            "poster_path_offsets": np.array(poster_path_offsets, dtype="<i8"),
+            "poster_paths": np.frombuffer(poster_path_blob, dtype="u1"),
+            # the code point order of Python is the byte order of SQLite for UTF-8 titles
+            "title_order": np.array(sorted(range(len(titles)), key=titles.__getitem__), dtype="<i8"),
+            "year_order": np.argsort(years, kind="stable").astype("<i8"),
+            "rating_order": np.argsort(ratings, kind="stable").astype("<i8")}
+
+
+def _align(position):
+    return -(-position // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT
+
+
+def _write_snapshot_file(snapshot_path, data_version, columns):
+    """
+    Write the columns into a new snapshot file, which replaces the old one at once.
+    Processes which mapped the old file keep reading it.
+    :param snapshot_path: path of the snapshot file
+    :param data_version: tuple (catalogue id, data version) the columns were read at
+    :param columns: dictionary column name -> numpy array
+    """
+    # the offsets are counted from the end of the header, whose length depends on them
+    relative_offsets = {}
+    position = 0
+    for name, column in columns.items():
+        relative_offsets[name] = position
+        position = _align(position + column.nbytes)
+
+    header = {"format_version": SNAPSHOT_FORMAT_VERSION,
+              "catalogue_id": data_version[0],
+              "data_version": data_version[1],
+              "movie_count": len(columns["years"])}
+    header_length = len(json.dumps({**header, "columns": {
+        name: [column.dtype.str, 10 ** 15, len(column)] for name, column in columns.items()}}))
+    data_start = _align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+    header["columns"] = {name: [column.dtype.str, data_start + relative_offsets[name], len(column)]
+                         for name, column in columns.items()}
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    # a unique name, so that concurrent writers do not write into the same file
+    temporary_path = f"{snapshot_path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temporary_path, "xb") as snapshot_file:
+            snapshot_file.write(SNAPSHOT_MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+            for name, column in columns.items():
+                snapshot_file.write(b"\x00" * (data_start + relative_offsets[name] - snapshot_file.tell()))
+                snapshot_file.write(column.tobytes())
+        os.replace(temporary_path, snapshot_path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_snapshot():
+    """
+    Export the movies of the database into the snapshot file.
+    :return: CatalogueSnapshot of the written file or None if it was not written,
+    e.g. for an in-memory database or if the movies changed during every attempt.
+    """
+    snapshot_path = get_snapshot_path()
+    if snapshot_path is None:
+        return None
+    for _ in range(WRITE_ATTEMPTS):
+        data_version = storage.get_data_version()
+        columns = _read_columns()
+        # the reads are not in one transaction, a write in between makes the columns inconsistent
+        if storage.get_data_version() == data_version:
+            _write_snapshot_file(snapshot_path, data_version, columns)
+            return open_snapshot(data_version)
+    return None
+
+
+def open_snapshot(data_version=None):
+    """
+    Map the snapshot file if it was written from the current data of the database.
+    :param data_version: tuple (catalogue id, data version), None reads it from the database
+    :return: CatalogueSnapshot or None if there is no valid snapshot.
+    """
+    snapshot_path = get_snapshot_path()
+    if snapshot_path is None:
+        return None
+    if data_version is None:
+        data_version = storage.get_data_version()
+    try:
+        with open(snapshot_path, "rb") as snapshot_file:
+            # the mapping stays valid after the file is closed
+            snapshot = CatalogueSnapshot(mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError, KeyError):
+        # missing, empty or damaged snapshot files are written again
+        return None
+    return snapshot if snapshot.data_version == data_version else None
+
+
+def refresh_snapshot():
+    """
+    Return the valid snapshot, it is written again if the database changed since.
+    :return: CatalogueSnapshot or None if no snapshot can be written.
+    """
+    # a snapshot of an empty catalogue has no length, but it is valid
+    snapshot = open_snapshot()
+    return snapshot if snapshot is not None else write_snapshot()
@@ -0,0 +1,247 @@
+import numpy as np
+from movie_storage import movie_storage_sql as storage
+
+# Capacity of the arrays at the first load, it grows by doubling
+INITIAL_CAPACITY = 1024
+# Amount of bins of rating_histogram between the lowest and the highest rating
+DEFAULT_HISTOGRAM_BINS = 30
+
+# Titles by their position in the arrays, deleted titles are replaced by None
+_titles = []
+# Position of each title in the arrays
+_title_positions = {}
+# Columns of the catalogue, only the first len(_titles) entries are used
+_years = np.empty(0, dtype=np.int32)
+_ratings = np.empty(0, dtype=np.float64)
+# False at the positions of deleted movies
+_is_alive = np.empty(0, dtype=bool)
+_catalogue_is_loaded = False
+# Data version of the database the arrays were loaded from, see storage.get_data_version
+_data_version = None
+
+
+def load_catalogue():
+    """
+    Load the titles, years and ratings of all movies into columnar arrays
+    and keep them in sync with the later writes.
+    With the catalogue snapshot switched on, the columns are copied from its mapped file.
+    """
+    global _catalogue_is_loaded, _data_version
+    # read before the movies, so that a write during the load is noticed at the next use
+    _data_version = storage.get_data_version()
+    _titles.clear()
+    _title_positions.clear()
+    _reserve(INITIAL_CAPACITY)
+
+    # imported here, because the snapshot module uses the statistics of this module
+    from movie_analytics import catalogue_snapshot
+    snapshot = catalogue_snapshot.refresh_snapshot() if catalogue_snapshot.SNAPSHOT_ENABLED else None
+    if snapshot is not None:
+        _load_snapshot(snapshot)
+    else:
+        for movie in storage.iter_movies():
+            _add_movie(movie)
+
+    storage.add_write_listener(_on_movie_written)
+    _catalogue_is_loaded = True
+
+
+def _load_snapshot(snapshot):
+    """
+    Copy the columns of a catalogue snapshot into the empty arrays.
+    :param snapshot: catalogue_snapshot.CatalogueSnapshot
+    """
+    movie_count = len(snapshot)
+    _reserve(movie_count)
+    _titles.extend(snapshot.get_title(index) for index in range(movie_count))
+    _title_positions.update((title, position) for position, title in enumerate(_titles))
+    _years[:movie_count] = snapshot.years
+    _ratings[:movie_count] = snapshot.ratings
+    _is_alive[:movie_count] = True
+
+
+def _ensure_catalogue():
+    """
+    Load the catalogue at the first use and again if the database changed since.
+    The write listener only sees the writes of this process,
+    the data version also changes with the writes of other processes, e.g. of the CLI.
+    """
+    if not _catalogue_is_loaded or storage.get_data_version() != _data_version:
+        load_catalogue()
+
+
+def _reserve(capacity):
+    """
+    Grow the arrays to hold at least the given amount of movies.
+    :param capacity: required amount of movies
+    """
+    global _years, _ratings, _is_alive
+    if capacity <= len(_years):
+        return
+    new_capacity = max(capacity, 2 * len(_years), INITIAL_CAPACITY)
+    used = len(_titles)
+    _years = _grow_column(_years, new_capacity, used)
+    _ratings = _grow_column(_ratings, new_capacity, used)
+    _is_alive = _grow_column(_is_alive, new_capacity, used)
+
+
+def _grow_column(column, capacity, used):
+    """
+    Copy the used part of a column into a larger array.
+    :param column: array of the column
+    :param capacity: length of the new array
+    :param used: amount of used entries
+    :return: New array with the same dtype.
+    """
+    new_column = np.zeros(capacity, dtype=column.dtype)
+    new_column[:used] = column[:used]
+    return new_column
+
+
+def _on_movie_written(event, movie):
+    """
+    Write listener of the storage, applies a single change to the arrays.
+    :param event: "add", "delete" or "update"
+    :param movie: affected Movie record
+    """
+    if event == "add":
+        _add_movie(movie)
+    elif event == "delete":
+        position = _title_positions.pop(movie.title, None)
+        if position is not None:
+            # keep the positions of the other movies stable
+            _titles[position] = None
+            _is_alive[position] = False
+    elif event == "update":
+        position = _title_positions.get(movie.title)
+        if position is not None:
+            # an upsert can change the year as well
+            _years[position] = movie.year
+            _ratings[position] = movie.rating
+
+
+def _add_movie(movie):
+    """
+    Append a single movie to the arrays.
+    :param movie: Movie record
+    """
+    if movie.title in _title_positions:
+        return
+    position = len(_titles)
+    _reserve(position + 1)
+    _titles.append(movie.title)
+    _title_positions[movie.title] = position
+    _years[position] = movie.year
+    _ratings[position] = movie.rating
+    _is_alive[position] = True
+
+
+def _get_columns():
+    """
+    Return the columns of the movies in the database.
+    :return: Tuple (positions, years, ratings) of the alive movies in insertion order.
+    """
+    _ensure_catalogue()
+    used = len(_titles)
+    positions = np.flatnonzero(_is_alive[:used])
+    if len(positions) == used:
+        # nothing was deleted, the views avoid a copy
+        return positions, _years[:used], _ratings[:used]
+    return positions, _years[positions], _ratings[positions]
+
+
+def filter_movies(min_rating=None, year_range=None):
+    """
+    Select the movies with a minimum rating in a range of years.
+    :param min_rating: minimum rating of the movies, None for no minimum.
+    :param year_range: tuple (start_year, end_year), both inclusive.
+    Each of the years can be None for an open range.
+    :return: List of tuples (title, year, rating) in the order the movies were added.
+    """
+    positions, years, ratings = _get_columns()
+    mask = np.ones(len(positions), dtype=bool)
+    if min_rating is not None:
+        mask &= ratings >= min_rating
+    if year_range is not None:
+        start_year, end_year = year_range
+        if start_year is not None:
+            mask &= years >= start_year
+        if end_year is not None:
+            mask &= years <= end_year
+
+    selected = np.flatnonzero(mask)
+    return [(_titles[positions[i]], int(years[i]), float(ratings[i])) for i in selected]
+
+
+def rating_stats():
+    """
+    Calculate the rating statistics of all movies.
+    :return: storage.RatingStats or None if there are no movies.
+    """
+    positions, _, ratings = _get_columns()
+    return compute_rating_stats(ratings, lambda index: _titles[positions[index]])
+
+
+def compute_rating_stats(ratings, get_title):
+    """
+    Calculate the rating statistics of a ratings column, it is shared with catalogue_snapshot.
+    :param ratings: array of the ratings in insertion order
+    :param get_title: callable which returns the title of the movie at an index of the array
+    :return: storage.RatingStats or None if there are no ratings.
+    """
+    if len(ratings) == 0:
+        return None
+
+    # ties are resolved like in the database: the first best and the last worst movie
+    best_index = int(np.argmax(ratings))
+    worst_index = len(ratings) - 1 - int(np.argmin(ratings[::-1]))
+    # a single partial sort serves the median and all percentiles
+    median, *percentile_values = np.percentile(ratings, (50, *storage.STATS_PERCENTILES))
+    percentiles = {percent: float(value)
+                   for percent, value in zip(storage.STATS_PERCENTILES, percentile_values)}
+    return storage.RatingStats(count=len(ratings),
+                               mean=float(ratings.mean()),
+                               min_rating=float(ratings[worst_index]),
+                               max_rating=float(ratings[best_index]),
+                               best_title=get_title(best_index),
+                               worst_title=get_title(worst_index),
+                               median=float(median),
+                               percentiles=percentiles)
+
+
+def rating_histogram(bins=DEFAULT_HISTOGRAM_BINS):
+    """
+    Count the movies per rating bin.
+    :param bins: amount of bins or a sequence of bin edges
+    :return: Tuple (counts, bin edges) as returned by np.histogram.
+    """
+    _, _, ratings = _get_columns()
+    return np.histogram(ratings, bins=bins)
+
+
+def year_stats():
+    """
+    Group the movies by year.
+    :return: List of storage.YearStats sorted by year.
+    """
+    _, years, ratings = _get_columns()
+    return compute_year_stats(years, ratings)
+
+
+def compute_year_stats(years, ratings):
+    """
+    Group the columns of the movies by year, it is shared with catalogue_snapshot.
+    :param years: array of the years
+    :param ratings: array of the ratings at the same positions
+    :return: List of storage.YearStats sorted by year.
+    """
+    if len(years) == 0:
+        return []
+    # the years are a small dense range, so they are counted without sorting
+    first_year = int(years.min())
+    year_indexes = years - first_year
+    counts = np.bincount(year_indexes)
+    rating_sums = np.bincount(year_indexes, weights=ratings)
+    return [storage.YearStats(first_year + int(year_index), int(counts[year_index]),
+                              float(rating_sums[year_index] / counts[year_index]))
+            for year_index in np.flatnonzero(counts)]
@@ -1,7 +1,16 @@
 import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import colorama
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from movie_api import response_cache
+from movie_metrics import instrumentation
 
 
 # load variables (API-key) from the environment into the script
@@ -9,8 +18,267 @@ load_dotenv()
 
 HTTP_CODE_OK = 200
 API_KEY = os.getenv('API_KEY')
-API_URL = 'https://www.omdbapi.com/?'
+API_URL = os.getenv('OMDB_API_URL', 'https://www.omdbapi.com/')
 RATING_MAX = 10
+# Amount of parallel requests of the bulk import
+IMPORT_WORKERS = 8
+# Preferred rating source if OMDb returns several ratings
+PREFERRED_RATING_SOURCE = 'Internet Movie Database'
+REQUEST_TIMEOUT_SECONDS = 10
+# Retries of timeouts and 5xx responses, the waiting time doubles with each retry
+MAX_RETRIES = int(os.getenv('OMDB_MAX_RETRIES', 3))
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# The free OMDb key allows 1000 requests per day. The requests of the last 24 hours are counted
+# in the database of the response cache, which all processes share, and the client raises
+# OmdbQuotaExceededError instead of sending requests above the quota.
+REQUESTS_PER_DAY = int(os.getenv('OMDB_REQUESTS_PER_DAY', 1000))
+QUOTA_PERIOD_SECONDS = 24 * 60 * 60
+# Within the daily quota the token bucket only spreads out the requests of a burst,
+# e.g. of the bulk import, to an average of REQUESTS_PER_SECOND
+REQUESTS_PER_SECOND = float(os.getenv('OMDB_REQUESTS_PER_SECOND', 10))
+REQUESTS_BURST = int(os.getenv('OMDB_REQUESTS_BURST', 10))
+# Error message of OMDb when the daily limit of the key is reached
+QUOTA_ERROR_MESSAGE = 'Request limit reached!'
+# Size of the connection pool, it should not be smaller than IMPORT_WORKERS
+CONNECTION_POOL_SIZE = 16
+# Amount of latest requests kept for the latency metrics
+LATENCY_WINDOW = 1000
+
+
+class OmdbApiError(Exception):
+    """
+    Raised when the OMDb API can not be reached or answers with an error.
+    """
+
+
+class OmdbQuotaExceededError(OmdbApiError):
+    """
+    Raised when the daily request quota of the OMDb key is used up.
+    """
+
+
+class RequestQuota:
+    """
+    Counter of the requests in a sliding period, e.g. the daily quota of the API key.
+    The requests are stored in the database of the response cache,
+    so the quota is shared by all threads and processes, e.g. the menu and the CLI.
+    """
+
+    def __init__(self, limit, period):
+        """
+        :param limit: allowed amount of requests in the period
+        :param period: length of the period in seconds
+        """
+        self.limit = limit
+        self.period = period
+
+    def acquire(self):
+        """
+        Counts a request.
+        :raises OmdbQuotaExceededError: if the quota of the period is used up.
+        """
+        is_counted, waiting_time = response_cache.record_request(self.limit, self.period)
+        if not is_counted:
+            raise OmdbQuotaExceededError(
+                f"The quota of {self.limit} OMDb requests per {self.period / 3600:g} hours is used up, "
+                f"the next request is possible in {waiting_time / 60:.0f} minutes.")
+
+    def remaining(self):
+        """
+        Returns the amount of requests left in the current period.
+        """
+        return max(0, self.limit - response_cache.count_requests(self.period))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Tokens are refilled continuously at the given rate up to the capacity,
+    each request consumes one token.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: tokens refilled per second
+        :param capacity: maximum amount of tokens, i.e. the allowed burst of requests
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waits until a token is available if the bucket is empty.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                waiting_time = (1 - self._tokens) / self.rate
+            time.sleep(waiting_time)
+
+
+class OmdbClient:
+    """
+    Client of the OMDb API with a pooled keep-alive session,
+    retries with exponential backoff, rate limiting and latency metrics.
+    """
+
+    def __init__(self, api_key=API_KEY, api_url=API_URL,
+                 timeout=REQUEST_TIMEOUT_SECONDS,
+                 max_retries=MAX_RETRIES,
+                 backoff_factor=RETRY_BACKOFF_SECONDS,
+                 requests_per_second=REQUESTS_PER_SECOND,
+                 burst=REQUESTS_BURST,
+                 requests_per_day=REQUESTS_PER_DAY,
+                 pool_size=CONNECTION_POOL_SIZE):
+        """
+        :param api_key: OMDb API key
+        :param api_url: URL of the API, e.g. of a local stub server for tests
+        :param timeout: timeout of a single request in seconds
+        :param max_retries: retries of timeouts, connection errors and 5xx responses
+        :param backoff_factor: waiting time before the first retry in seconds, doubled for each next
+        :param requests_per_second: allowed average rate of requests
+        :param burst: allowed amount of requests at once
+        :param requests_per_day: daily quota of the API key, None for no quota, e.g. of a stub server
+        :param pool_size: amount of kept connections
+        """
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.quota = None if requests_per_day is None else RequestQuota(requests_per_day,
+                                                                       QUOTA_PERIOD_SECONDS)
+
+        retry = Retry(total=max_retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._metrics = {"requests": 0, "errors": 0, "retries": 0}
+        self._metrics_lock = threading.Lock()
+
+    def fetch_movie_json(self, movie_title):
+        """
+        Requests the movie data from the OMDb API.
+        :param movie_title: Part of the title.
+        :return: OMDb response as dictionary.
+        :raises OmdbQuotaExceededError: if the daily quota is used up.
+        """
+        # protect the API key from the injection using parameters
+        parameters = {
+            'apikey': self.api_key,
+            't': movie_title
+        }
+        if self.quota is not None:
+            self.quota.acquire()
+        self.rate_limiter.acquire()
+        start_time = time.perf_counter()
+        try:
+            response = self.session.get(self.api_url, params=parameters, timeout=self.timeout)
+        except requests.RequestException as error:
+            self._record_request(start_time, failed=True)
+            raise OmdbApiError(f"Could not connect to OMDb API: {error}") from error
+
+        retries = len(response.raw.retries.history) if response.raw.retries else 0
+        self._record_request(start_time, failed=response.status_code != HTTP_CODE_OK, retries=retries)
+        try:
+            response_json = response.json()
+        except ValueError as error:
+            raise OmdbApiError(f"OMDb API answered with status {response.status_code} "
+                               f"and no valid JSON.") from error
+
+        # OMDb answers "Movie not found!" with status 200, other errors like
+        # an invalid key or an exceeded request limit come with an error status
+        if response_json.get('Error') == QUOTA_ERROR_MESSAGE:
+            raise OmdbQuotaExceededError(f"The daily quota of the OMDb key is used up: "
+                                         f"{QUOTA_ERROR_MESSAGE}")
+        if response.status_code != HTTP_CODE_OK:
+            raise OmdbApiError(f"OMDb API answered with status {response.status_code}: "
+                               f"{response_json.get('Error', response.reason)}")
+        return response_json
+
+    def _record_request(self, start_time, failed, retries=0):
+        """
+        Records the latency and the counters of a finished request.
+        :param start_time: value of time.perf_counter() before the request
+        :param failed: True if the request failed
+        :param retries: amount of retries of the request
+        """
+        latency = time.perf_counter() - start_time
+        with self._metrics_lock:
+            self._latencies.append(latency)
+            self._metrics["requests"] += 1
+            self._metrics["errors"] += int(failed)
+            self._metrics["retries"] += retries
+        instrumentation.observe("omdb.request", latency)
+        instrumentation.increment("omdb.requests")
+        instrumentation.increment("omdb.errors", int(failed))
+        instrumentation.increment("omdb.retries", retries)
+
+    def get_metrics(self):
+        """
+        Returns the request counters and latency statistics of the latest requests.
+        :return: Dictionary with counters and latencies in seconds.
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+            latencies = sorted(self._latencies)
+
+        if latencies:
+            metrics["latency_mean"] = sum(latencies) / len(latencies)
+            metrics["latency_p50"] = latencies[len(latencies) // 2]
+            metrics["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            metrics["latency_max"] = latencies[-1]
+        if self.quota is not None:
+            metrics["quota_remaining"] = self.quota.remaining()
+        return metrics
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    Returns the client shared by the module functions, it is created at the first call.
+    :return: OmdbClient instance.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = OmdbClient()
+        return _default_client
+
+
+def set_default_client(client):
+    """
+    Replaces the client shared by the module functions, e.g. by a client of a stub server.
+    :param client: OmdbClient instance
+    """
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
 
 
 def get_movie_data_from_api(movie_title):
@@ -18,26 +286,83 @@ def get_movie_data_from_api(movie_title):
     Fetches movie data from API.
     :param movie_title: Part of the title.
     :return: A tuple (title, year, movie ratings and url to the poster).
+    All values are None if the movie is unknown.
     """
-    # protect the API key from the injection using parameters
-    parameters = {
-        'apikey': API_KEY,
-        't': movie_title
-    }
-    try:
-        response = requests.get(API_URL, params = parameters, timeout=10)
-        response_json = response.json()
+    response_json = get_movie_json(movie_title)
+    if response_json.get('Response') != 'True':
+        return None, None, None, None
 
-        raw_year = response_json.get('Year')
-        year = get_year(raw_year)
-        title = response_json.get('Title')
-        image_url = response_json.get('Poster')
-        multiple_ratings = response_json.get('Ratings')
-        rating = get_rating(multiple_ratings, title)
+    raw_year = response_json.get('Year')
+    year = get_year(raw_year)
+    title = response_json.get('Title')
+    image_url = response_json.get('Poster')
+    multiple_ratings = response_json.get('Ratings')
+    rating = get_rating(multiple_ratings, title)
 
-        return title, year, rating, image_url
-    except Exception:
-        raise Exception(f"{colorama.Fore.RED}Could not connect to OMDb API.")
+    return title, year, rating, image_url
+
+
+def get_movie_data_non_interactive(movie_title):
+    """
+    Fetches movie data from API without asking the user.
+    Not valid years and ambiguous ratings are resolved by parse_year and parse_rating.
+    :param movie_title: Part of the title.
+    :return: A tuple (title, year, rating, url to the poster)
+    or None if the movie is unknown or has no usable year or rating.
+    """
+    response_json = get_movie_json(movie_title)
+    if response_json.get('Response') != 'True':
+        return None
+
+    year = parse_year(response_json.get('Year'))
+    rating = parse_rating(response_json)
+    if year is None or rating is None:
+        return None
+    return response_json.get('Title'), year, rating, response_json.get('Poster')
+
+
+def get_movies_data_from_api(movie_titles, max_workers=IMPORT_WORKERS):
+    """
+    Fetches the data of many movies concurrently without asking the user.
+    :param movie_titles: list of titles
+    :param max_workers: amount of parallel requests
+    :return: Generator of tuples (entered title, movie data or None, error or None)
+    in the order of the entered titles.
+    """
+    def fetch(movie_title):
+        try:
+            return movie_title, get_movie_data_non_interactive(movie_title), None
+        except Exception as error:
+            return movie_title, None, error
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(fetch, movie_titles)
+
+
+def get_movie_json(movie_title):
+    """
+    Gets the OMDb response of a movie from the cache or from the API.
+    :param movie_title: Part of the title.
+    :return: OMDb response as dictionary.
+    """
+    response_json = response_cache.get_cached_response(movie_title)
+    if response_json is None:
+        try:
+            response_json = fetch_movie_json(movie_title)
+        except OmdbApiError as error:
+            raise type(error)(f"{colorama.Fore.RED}{error}") from error
+        if response_json.get('Response') == 'True' or response_cache.is_not_found_response(response_json):
+            response_cache.store_response(movie_title, response_json)
+    return response_json
+
+
+def fetch_movie_json(movie_title):
+    """
+    Requests the movie data from the OMDb API, bypassing the cache.
+    :param movie_title: Part of the title.
+    :return: OMDb response as dictionary.
+    """
+    return get_default_client().fetch_movie_json(movie_title)
 
 
 def get_year(raw_year):
@@ -61,6 +386,57 @@ def get_year(raw_year):
     return year
 
 
+def parse_year(raw_year):
+    """
+    Extracts the year from the JSON formatted response without asking the user.
+    For a range of years like 2013–2017 the first year is used.
+    :param raw_year: Year data as string directly from the API
+    :return: Year as an integer or None if there is no year.
+    """
+    match = re.search(r"\d{4}", raw_year or "")
+    if match is None:
+        return None
+    return int(match.group())
+
+
+def parse_rating(response_json):
+    """
+    Gets the rating from the JSON formatted response without asking the user.
+    If there are several ratings, the IMDb rating is used, otherwise the first rating.
+    Ratings like 85/100 or 85% are scaled to the range 0 ... 10.
+    :param response_json: OMDb response as dictionary
+    :return: Rating as float or None if there is no valid rating.
+    """
+    raw_ratings = [source['Value'] for source in response_json.get('Ratings') or []
+                   if source.get('Source') == PREFERRED_RATING_SOURCE]
+    raw_ratings += [source['Value'] for source in response_json.get('Ratings') or []]
+    raw_ratings.append(response_json.get('imdbRating') or '')
+
+    for raw_rating in raw_ratings:
+        rating = _scale_rating(raw_rating)
+        if rating is not None:
+            return rating
+    return None
+
+
+def _scale_rating(raw_rating):
+    """
+    Converts a rating like 7.5/10, 85/100 or 85% to the range 0 ... 10.
+    :param raw_rating: rating as string
+    :return: Rating as float or None if the rating is not valid.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(?:(%)|/\s*(\d+(?:\.\d+)?))?\s*", raw_rating)
+    if match is None:
+        return None
+    value, percent, scale = match.groups()
+    if percent:
+        scale = 100
+    rating = float(value) * RATING_MAX / float(scale or RATING_MAX)
+    if not 0 <= rating <= RATING_MAX:
+        return None
+    return round(rating, 1)
+
+
 def get_rating(multiple_ratings, title):
     """
     Get the rating from the JSON formatted response.
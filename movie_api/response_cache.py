@@ -0,0 +1,313 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+from movie_metrics import instrumentation
+
+
+# load the cache settings from the environment
+load_dotenv()
+
+# The cache lies in the data folder of the project like the movie database,
+# independent of the working directory
+DEFAULT_CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                     "data", "omdb_cache.db")
+CACHE_DB_URL = os.getenv('OMDB_CACHE_DB_URL', f'sqlite:///{DEFAULT_CACHE_DB_PATH}')
+# Time in seconds after which a cached response is fetched again
+CACHE_TTL_SECONDS = int(os.getenv('OMDB_CACHE_TTL', 7 * 24 * 60 * 60))
+# "Movie not found" responses expire earlier, the movie can be added to OMDb in the meantime
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv('OMDB_NEGATIVE_CACHE_TTL', 24 * 60 * 60))
+# Amount of responses kept in memory in front of the persistent store
+MEMORY_CACHE_SIZE = int(os.getenv('OMDB_MEMORY_CACHE_SIZE', 256))
+# Amount of responses kept in the persistent store, the oldest are evicted first
+STORE_MAX_ENTRIES = int(os.getenv('OMDB_CACHE_MAX_ENTRIES', 10000))
+
+cache_engine = create_engine(CACHE_DB_URL)
+
+# normalised title -> (expiry timestamp, response as dictionary), least recently used first
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+_store_is_created = False
+# Amount of responses in the store and the earliest expiry, the store is only cleaned up
+# when one of them crosses its threshold. They are read again after every clean-up.
+_store_lock = threading.Lock()
+_store_entry_count = 0
+_store_next_expiry = None
+_statistics = {"memory_hits": 0, "store_hits": 0, "misses": 0, "evictions": 0}
+
+
+def normalize_key(movie_title):
+    """
+    Normalise a movie title to a cache key, so that spelling variants share an entry.
+    :param movie_title: title as entered by the user
+    :return: Cache key.
+    """
+    return " ".join(movie_title.lower().split())
+
+
+def is_not_found_response(response_json):
+    """
+    Checks if the OMDb response says that the movie is unknown.
+    :param response_json: OMDb response as dictionary
+    :return: True for a "Movie not found!" response.
+    """
+    return (response_json.get('Response') == 'False'
+            and response_json.get('Error') == 'Movie not found!')
+
+
+def _ensure_store():
+    """
+    Create the table of the persistent store if it does not exist.
+    """
+    global _store_is_created
+    if _store_is_created:
+        return
+    database_folder = os.path.dirname(cache_engine.url.database or "")
+    if database_folder:
+        os.makedirs(database_folder, exist_ok=True)
+    with cache_engine.connect() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS omdb_responses (
+                cache_key TEXT PRIMARY KEY,
+                response_json TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL)
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_omdb_responses_stored_at
+            ON omdb_responses (stored_at)
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_omdb_responses_expires_at
+            ON omdb_responses (expires_at)
+        """))
+        # times of the requests to OMDb, the processes share the daily quota of the API key
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS omdb_requests (
+                requested_at REAL NOT NULL)
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_omdb_requests_requested_at
+            ON omdb_requests (requested_at)
+        """))
+        connection.commit()
+        _read_store_state(connection)
+    _store_is_created = True
+
+
+def get_cached_response(movie_title):
+    """
+    Looks up an OMDb response in the memory cache and then in the persistent store.
+    :param movie_title: title as entered by the user
+    :return: OMDb response as dictionary or None if there is no valid entry.
+    """
+    cache_key = normalize_key(movie_title)
+    now = time.time()
+
+    with _memory_cache_lock:
+        entry = _memory_cache.get(cache_key)
+        if entry is not None:
+            expires_at, response_json = entry
+            if expires_at > now:
+                _memory_cache.move_to_end(cache_key)
+                _statistics["memory_hits"] += 1
+                instrumentation.increment("omdb_cache.memory_hits")
+                return response_json
+            del _memory_cache[cache_key]
+
+    _ensure_store()
+    with cache_engine.connect() as connection:
+        row = connection.execute(text("""
+            SELECT response_json, expires_at FROM omdb_responses
+            WHERE cache_key = :cache_key AND expires_at > :now
+        """), {"cache_key": cache_key, "now": now}).fetchone()
+
+    if row is None:
+        with _memory_cache_lock:
+            _statistics["misses"] += 1
+        instrumentation.increment("omdb_cache.misses")
+        return None
+
+    response_json = json.loads(row[0])
+    _remember_in_memory(cache_key, row[1], response_json)
+    with _memory_cache_lock:
+        _statistics["store_hits"] += 1
+    instrumentation.increment("omdb_cache.store_hits")
+    return response_json
+
+
+def store_response(movie_title, response_json):
+    """
+    Stores an OMDb response in the memory cache and in the persistent store.
+    :param movie_title: title as entered by the user
+    :param response_json: OMDb response as dictionary
+    """
+    global _store_entry_count, _store_next_expiry
+    cache_key = normalize_key(movie_title)
+    now = time.time()
+    if is_not_found_response(response_json):
+        expires_at = now + NEGATIVE_CACHE_TTL_SECONDS
+    else:
+        expires_at = now + CACHE_TTL_SECONDS
+
+    _remember_in_memory(cache_key, expires_at, response_json)
+
+    _ensure_store()
+    with cache_engine.connect() as connection:
+        is_new_entry = connection.execute(text("""
+            SELECT 1 FROM omdb_responses WHERE cache_key = :cache_key
+        """), {"cache_key": cache_key}).fetchone() is None
+        connection.execute(text("""
+            INSERT INTO omdb_responses (cache_key, response_json, stored_at, expires_at)
+            VALUES (:cache_key, :response_json, :stored_at, :expires_at)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                response_json = excluded.response_json,
+                stored_at = excluded.stored_at,
+                expires_at = excluded.expires_at
+        """), {"cache_key": cache_key,
+               "response_json": json.dumps(response_json),
+               "stored_at": now,
+               "expires_at": expires_at})
+        with _store_lock:
+            if is_new_entry:
+                _store_entry_count += 1
+            if _store_next_expiry is None or expires_at < _store_next_expiry:
+                _store_next_expiry = expires_at
+            needs_eviction = _store_entry_count > STORE_MAX_ENTRIES or _store_next_expiry <= now
+        evicted = _evict_from_store(connection, now) if needs_eviction else 0
+        connection.commit()
+
+    if evicted:
+        with _memory_cache_lock:
+            _statistics["evictions"] += evicted
+
+
+def _remember_in_memory(cache_key, expires_at, response_json):
+    """
+    Puts a response into the memory cache and evicts the least recently used entries.
+    :param cache_key: normalised title
+    :param expires_at: expiry timestamp of the response
+    :param response_json: OMDb response as dictionary
+    """
+    with _memory_cache_lock:
+        _memory_cache[cache_key] = (expires_at, response_json)
+        _memory_cache.move_to_end(cache_key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+            _statistics["evictions"] += 1
+
+
+def _evict_from_store(connection, now):
+    """
+    Removes the expired responses and the oldest responses above STORE_MAX_ENTRIES.
+    :param connection: open connection to the cache database
+    :param now: current timestamp
+    :return: Amount of evicted responses.
+    """
+    expired = connection.execute(text("""
+        DELETE FROM omdb_responses WHERE expires_at <= :now
+    """), {"now": now}).rowcount
+    oldest = connection.execute(text("""
+        DELETE FROM omdb_responses WHERE cache_key IN (
+            SELECT cache_key FROM omdb_responses
+            ORDER BY stored_at DESC
+            LIMIT -1 OFFSET :max_entries)
+    """), {"max_entries": STORE_MAX_ENTRIES}).rowcount
+    _read_store_state(connection)
+    return expired + oldest
+
+
+def _read_store_state(connection):
+    """
+    Reads the amount of responses in the store and the earliest expiry.
+    Other processes can write to the store as well, so the values are only exact after a read.
+    :param connection: open connection to the cache database
+    """
+    global _store_entry_count, _store_next_expiry
+    entry_count, next_expiry = connection.execute(text("""
+        SELECT COUNT(*), MIN(expires_at) FROM omdb_responses
+    """)).one()
+    with _store_lock:
+        _store_entry_count = entry_count
+        _store_next_expiry = next_expiry
+
+
+def record_request(limit, period):
+    """
+    Counts a request to OMDb in the persistent store, so that all processes share the quota.
+    The request is only counted if less than limit requests were counted in the period before it.
+    :param limit: allowed amount of requests in the period
+    :param period: length of the period in seconds
+    :return: Tuple (True if the request was counted, seconds until the next request is possible).
+    """
+    _ensure_store()
+    now = time.time()
+    with cache_engine.connect() as connection:
+        # the insert takes the write lock first, so that other processes count after this one
+        connection.execute(text("INSERT INTO omdb_requests (requested_at) VALUES (:now)"), {"now": now})
+        connection.execute(text("DELETE FROM omdb_requests WHERE requested_at <= :start"),
+                           {"start": now - period})
+        request_count, first_request = connection.execute(text("""
+            SELECT COUNT(*), MIN(requested_at) FROM omdb_requests
+        """)).one()
+        if request_count > limit:
+            connection.rollback()
+            return False, first_request + period - now
+        connection.commit()
+    return True, 0.0
+
+
+def count_requests(period):
+    """
+    Counts the requests to OMDb of all processes in the latest period.
+    :param period: length of the period in seconds
+    :return: Amount of requests.
+    """
+    _ensure_store()
+    with cache_engine.connect() as connection:
+        return connection.execute(text("""
+            SELECT COUNT(*) FROM omdb_requests WHERE requested_at > :start
+        """), {"start": time.time() - period}).scalar()
+
+
+def warm_cache_from_file(file_name):
+    """
+    Fills the cache with OMDb responses from a JSON file, e.g. for offline runs.
+    The file contains an object which maps the movie titles to the OMDb responses.
+    :param file_name: path to the JSON file
+    :return: Amount of stored responses.
+    """
+    with open(file_name, "r", encoding="utf-8") as json_file:
+        responses = json.load(json_file)
+
+    for movie_title, response_json in responses.items():
+        store_response(movie_title, response_json)
+    return len(responses)
+
+
+def get_cache_statistics():
+    """
+    Returns the hit and miss counters of the cache.
+    :return: Dictionary with the counters and the size of the memory cache.
+    """
+    with _memory_cache_lock:
+        statistics = dict(_statistics)
+    statistics["hits"] = statistics["memory_hits"] + statistics["store_hits"]
+    statistics["memory_entries"] = len(_memory_cache)
+    return statistics
+
+
+def clear_cache():
+    """
+    Removes all responses from the memory cache and from the persistent store.
+    """
+    with _memory_cache_lock:
+        _memory_cache.clear()
+    _ensure_store()
+    with cache_engine.connect() as connection:
+        connection.execute(text("DELETE FROM omdb_responses"))
+        connection.commit()
+        _read_store_state(connection)
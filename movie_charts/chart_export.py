@@ -0,0 +1,117 @@
+import functools
+import io
+import os
+import numpy as np
+from movie_metrics import instrumentation
+from movie_storage import movie_storage_sql as storage
+
+# Amount of bins of the rating histogram
+DEFAULT_HISTOGRAM_BINS = 30
+# Ratings range of OMDb and of the user input
+RATING_RANGE = (0, 10)
+# Size of the chart in inches and the resolution of PNG images
+FIGURE_SIZE = (8, 4.5)
+PNG_DPI = 100
+SUPPORTED_FORMATS = ("png", "svg")
+# Fixed seed of the ids in the SVG output, so that an unchanged chart gives the same file
+SVG_HASH_SALT = "movie-rating-histogram"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_chart_classes():
+    """
+    Import matplotlib at the first chart, it adds a noticeable delay to the start.
+    The Agg canvas renders without a display and without the global state of pyplot.
+    :return: Tuple (matplotlib module, Figure class, FigureCanvasAgg class).
+    """
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    return matplotlib, Figure, FigureCanvasAgg
+
+
+def get_histogram_bins(bins=DEFAULT_HISTOGRAM_BINS, user_id=None):
+    """
+    Group the precomputed rating buckets of the database into histogram bins.
+    Only the buckets are read, not the ratings of all movies.
+    :param bins: amount of bins
+    :param user_id: id of the user whose ratings are shown, None for all movies
+    :return: Tuple (movie counts, bin edges) as numpy arrays.
+    """
+    rating_histogram = storage.rating_histogram(user_id)
+    ratings = [rating for rating, _ in rating_histogram]
+    movie_counts = [movie_count for _, movie_count in rating_histogram]
+    return np.histogram(ratings, bins=bins, range=RATING_RANGE, weights=movie_counts)
+
+
+def render_rating_histogram(image_format="png", bins=DEFAULT_HISTOGRAM_BINS, user_id=None):
+    """
+    Render the rating histogram: X movie rating, Y amount of movies with a specific rating.
+    :param image_format: "png" or "svg"
+    :param bins: amount of bins
+    :param user_id: id of the user whose ratings are shown, None for all movies
+    :return: Image as bytes.
+    """
+    if image_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Not possible to export a chart as '{image_format}'.")
+    movie_counts, bin_edges = get_histogram_bins(bins, user_id)
+    # the image depends only on the counts, an unchanged database renders nothing
+    return _render_histogram(tuple(movie_counts), tuple(bin_edges), image_format)
+
+
+@functools.lru_cache(maxsize=8)
+@instrumentation.timed("charts.render_histogram")
+def _render_histogram(movie_counts, bin_edges, image_format):
+    """
+    Render the bars of a histogram on an own figure, which is released afterwards.
+    :param movie_counts: tuple of the movie counts per bin
+    :param bin_edges: tuple of the bin edges
+    :param image_format: "png" or "svg"
+    :return: Image as bytes.
+    """
+    matplotlib, Figure, FigureCanvasAgg = _get_chart_classes()
+    figure = Figure(figsize=FIGURE_SIZE)
+    FigureCanvasAgg(figure)
+    try:
+        axes = figure.add_subplot()
+        bin_edges = np.array(bin_edges)
+        axes.bar(bin_edges[:-1], movie_counts, width=np.diff(bin_edges),
+                 align="edge", edgecolor="black")
+        axes.set_xlabel("Rating")
+        axes.set_ylabel("Movies frequency")
+        axes.set_title("Movie Rating Histogram")
+        figure.tight_layout()
+
+        image_buffer = io.BytesIO()
+        with matplotlib.rc_context({"svg.hashsalt": SVG_HASH_SALT}):
+            # without the date the image only changes with the data
+            metadata = {"Date": None} if image_format == "svg" else None
+            figure.savefig(image_buffer, format=image_format, dpi=PNG_DPI, metadata=metadata)
+        return image_buffer.getvalue()
+    finally:
+        figure.clear()
+
+
+def save_rating_histogram(file_name, bins=DEFAULT_HISTOGRAM_BINS, user_id=None):
+    """
+    Save the rating histogram to a file, the format is chosen by the extension.
+    :param file_name: name of the image file ending with .png or .svg
+    :param bins: amount of bins
+    :param user_id: id of the user whose ratings are shown, None for all movies
+    """
+    image_format = os.path.splitext(file_name)[1].lstrip(".").lower()
+    image = render_rating_histogram(image_format, bins, user_id)
+    with open(file_name, "wb") as image_file:
+        image_file.write(image)
+
+
+def serialize_rating_histogram(bins=DEFAULT_HISTOGRAM_BINS, user_id=None):
+    """
+    Render the rating histogram as SVG element to embed it in a HTML page.
+    :param bins: amount of bins
+    :param user_id: id of the user whose ratings are shown, None for all movies
+    :return: HTML formatted string with the <svg> element.
+    """
+    svg_image = render_rating_histogram("svg", bins, user_id).decode("utf-8")
+    # the XML declaration and the doctype are not allowed inside HTML
+    return svg_image[svg_image.index("<svg"):]
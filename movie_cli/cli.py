@@ -0,0 +1,416 @@
+"""
+Non-interactive command line interface for scripts and batch jobs.
+
+Run it with `python -m movie_cli.cli <command>`, e.g.
+    python -m movie_cli.cli list --order-by rating --descending --format csv
+    python -m movie_cli.cli add "The Matrix" "Alien"
+    python -m movie_cli.cli update "Alien" 8.7
+    python -m movie_cli.cli import titles.txt
+    python -m movie_cli.cli --profile --metrics metrics.prom build-site
+
+Results are written as JSON lines (default) or CSV while they are produced.
+Modules with heavy dependencies are only imported by the commands which need them.
+With --profile a cProfile and tracemalloc report of the command is written to stderr,
+with --metrics the timings and counters of the command are written to a file.
+With --snapshot (or MOVIES_SNAPSHOT=1) list, filter, stats and random read the memory-mapped
+catalogue snapshot, which the write commands export after their batch.
+With --user NAME the commands work on the collection of a user with the ratings of the user,
+the user is created by the first write command.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from movie_metrics import instrumentation
+from movie_storage import movie_storage_sql as storage
+
+OUTPUT_FORMATS = ("jsonl", "csv")
+MOVIE_FIELDS = ("title", "year", "rating", "poster_url", "poster_path")
+RESULT_FIELDS = ("title", "status", "error")
+DEFAULT_PAGE_TITLE = "Movie App of Anastasia"
+# The snapshot module imports numpy, so only its switch is read here
+SNAPSHOT_ENABLED = os.getenv("MOVIES_SNAPSHOT", "") not in ("", "0")
+# Statuses which mean that the row was applied or did not need a change
+SUCCESS_STATUSES = (storage.ADDED, storage.UPDATED, storage.UNCHANGED, storage.DELETED)
+
+
+def write_rows(rows, fields, output_format, output=None):
+    """
+    Writes dictionaries one by one as JSON lines or as CSV with a header.
+    :param rows: iterable of dictionaries
+    :param fields: names of the written fields, also the CSV header
+    :param output_format: "jsonl" or "csv"
+    :param output: writable text stream, None for the current sys.stdout
+    :return: Amount of written rows.
+    """
+    if output is None:
+        output = sys.stdout
+    row_count = 0
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            row_count += 1
+    else:
+        for row in rows:
+            output.write(json.dumps({field: row.get(field) for field in fields}) + "\n")
+            row_count += 1
+    return row_count
+
+
+def write_results(results, output_format):
+    """
+    Writes the per-row results of a write command.
+    :param results: iterable of dictionaries with title, status and error
+    :param output_format: "jsonl" or "csv"
+    :return: Exit code, 1 if a row was not applied.
+    """
+    statuses = []
+
+    def remember_status(rows):
+        for row in rows:
+            statuses.append(row["status"])
+            yield row
+
+    write_rows(remember_status(results), RESULT_FIELDS, output_format)
+    return 0 if all(status in SUCCESS_STATUSES for status in statuses) else 1
+
+
+def write_result_records(result_records, output_format):
+    """
+    Writes storage.WriteResult records of a bulk write function.
+    :param result_records: list of WriteResult records
+    :param output_format: "jsonl" or "csv"
+    :return: Exit code, 1 if a row was not applied.
+    """
+    return write_results(({"title": result.title, "status": result.status}
+                          for result in result_records), output_format)
+
+
+def get_snapshot(arguments):
+    """
+    Returns the catalogue snapshot if it is switched on, a stale snapshot is written again.
+    :return: CatalogueSnapshot or None to read from the database.
+    """
+    # the snapshot holds the shared movies, not the collections of the users
+    if not arguments.snapshot or arguments.user_id is not None:
+        return None
+    from movie_analytics import catalogue_snapshot
+    return catalogue_snapshot.refresh_snapshot()
+
+
+def query_movies(arguments, **filters):
+    """
+    Selects movies from the snapshot if it is switched on, otherwise from the scope of the user.
+    :param filters: keyword arguments of storage.query_movies
+    :return: Iterable of storage.Movie records.
+    """
+    snapshot = get_snapshot(arguments)
+    if snapshot is not None:
+        return snapshot.query_movies(**filters)
+    return storage.query_movies(user_id=arguments.user_id, **filters)
+
+
+def list_command(arguments):
+    """
+    Streams all movies, optionally sorted and paginated.
+    """
+    movies = query_movies(arguments, order_by=arguments.order_by, descending=arguments.descending,
+                          limit=arguments.limit, offset=arguments.offset)
+    write_rows((movie._asdict() for movie in movies), MOVIE_FIELDS, arguments.format)
+    return 0
+
+
+def filter_command(arguments):
+    """
+    Streams the movies with a minimum rating in a range of years.
+    """
+    movies = query_movies(arguments, min_rating=arguments.min_rating,
+                          year_range=(arguments.start_year, arguments.end_year),
+                          order_by=arguments.order_by, descending=arguments.descending,
+                          limit=arguments.limit, offset=arguments.offset)
+    write_rows((movie._asdict() for movie in movies), MOVIE_FIELDS, arguments.format)
+    return 0
+
+
+def add_command(arguments):
+    """
+    Fetches the movies from OMDb concurrently and adds them in one transaction.
+    """
+    from movie_api import api_communication as api
+    return write_results(fetch_and_add_movies(api, arguments.titles, arguments.user_id), arguments.format)
+
+
+def import_command(arguments):
+    """
+    Adds all movies of a text or CSV file with titles.
+    """
+    from helpers import helper_functions as helper
+    from movie_api import api_communication as api
+    try:
+        movie_titles = helper.read_titles_from_file(arguments.file)
+    except OSError as error:
+        print(f"Error reading {arguments.file}: {error}", file=sys.stderr)
+        return 2
+    return write_results(fetch_and_add_movies(api, movie_titles, arguments.user_id), arguments.format)
+
+
+def fetch_and_add_movies(api, movie_titles, user_id=None):
+    """
+    Fetches the data of the titles which are not in the database yet and adds the movies.
+    A user gets the movies which are in the database already without fetching them again.
+    :param api: api_communication module
+    :param movie_titles: list of titles
+    :param user_id: id of the user whose collection gets the movies, None for the shared movies
+    :return: Generator of result dictionaries with title, status and error, one per title.
+    """
+    existing_titles = storage.find_existing_titles(movie_titles, user_id)
+    fetched_movies = []
+    for movie_title in movie_titles:
+        if movie_title.lower() in existing_titles:
+            yield {"title": movie_title, "status": storage.EXISTS}
+    new_titles = [title for title in movie_titles if title.lower() not in existing_titles]
+    if user_id is not None:
+        # the shared data is stored once, the user starts with the rating of OMDb
+        shared_movies = storage.get_movies_by_titles(new_titles)
+        fetched_movies.extend(shared_movies.values())
+        new_titles = [title for title in new_titles if title.lower() not in shared_movies]
+
+    for movie_title, movie_data, error in api.get_movies_data_from_api(new_titles):
+        if error is not None:
+            yield {"title": movie_title, "status": "error", "error": str(error)}
+        elif movie_data is None:
+            yield {"title": movie_title, "status": storage.NOT_FOUND,
+                   "error": "unknown or without valid year or rating"}
+        else:
+            fetched_movies.append(movie_data)
+
+    for result in storage.add_movies(fetched_movies, user_id):
+        yield {"title": result.title, "status": result.status}
+
+
+def delete_command(arguments):
+    """
+    Deletes the movies with the given titles in one transaction.
+    """
+    return write_result_records(storage.delete_movies(arguments.titles, arguments.user_id), arguments.format)
+
+
+def update_command(arguments):
+    """
+    Updates the ratings of the given movies in one transaction.
+    """
+    if len(arguments.pairs) % 2 != 0:
+        print("Error: expected pairs of title and rating.", file=sys.stderr)
+        return 2
+    titles = arguments.pairs[0::2]
+    try:
+        ratings = [float(raw_rating) for raw_rating in arguments.pairs[1::2]]
+    except ValueError as error:
+        print(f"Error: rating should be a number: {error}", file=sys.stderr)
+        return 2
+    if any(not 0 <= rating <= 10 for rating in ratings):
+        print("Error: rating should be in the range 0 ... 10.", file=sys.stderr)
+        return 2
+    return write_result_records(storage.update_ratings(zip(titles, ratings), arguments.user_id),
+                                arguments.format)
+
+
+def stats_command(arguments):
+    """
+    Writes the rating statistics, or with --by-year the statistics per year.
+    """
+    snapshot = get_snapshot(arguments)
+    if arguments.by_year:
+        year_stats = snapshot.year_stats() if snapshot is not None else storage.year_stats(arguments.user_id)
+        write_rows((stats._asdict() for stats in year_stats), storage.YearStats._fields, arguments.format)
+        return 0
+
+    stats = snapshot.rating_stats() if snapshot is not None else storage.rating_stats(arguments.user_id)
+    if stats is None:
+        print("Error: no movies for statistics in the database.", file=sys.stderr)
+        return 1
+    row = stats._asdict()
+    percentiles = row.pop("percentiles")
+    row.update({f"percentile_{percent}": value for percent, value in percentiles.items()})
+    write_rows([row], list(row), arguments.format)
+    return 0
+
+
+def random_command(arguments):
+    """
+    Picks a random movie.
+    """
+    snapshot = get_snapshot(arguments)
+    if snapshot is not None:
+        movie = snapshot.random_movie()
+    else:
+        movie_count = storage.count_movies(arguments.user_id)
+        movies = (storage.query_movies(limit=1, offset=random.randrange(movie_count),
+                                       user_id=arguments.user_id) if movie_count else [])
+        movie = next(iter(movies), None)
+    if movie is None:
+        print("Error: no movies in the database.", file=sys.stderr)
+        return 1
+    write_rows([movie._asdict()], MOVIE_FIELDS, arguments.format)
+    return 0
+
+
+def search_command(arguments):
+    """
+    Searches the words of the titles, if nothing is found the most similar titles.
+    """
+    movies = storage.search_titles(arguments.query, arguments.limit, arguments.user_id)
+    # the similar titles are searched in the shared movies, not in the collection of the user
+    if movies or arguments.user_id is not None:
+        write_rows(({**movie._asdict(), "score": None} for movie in movies),
+                   MOVIE_FIELDS + ("score",), arguments.format)
+        return 0 if movies else 1
+
+    # rapidfuzz is only loaded if the full-text search finds nothing
+    from movie_search import search_index
+    similar_titles = search_index.find_similar_titles(arguments.query, arguments.limit)
+    write_rows(({"title": title, "score": score} for title, score in similar_titles),
+               ("title", "score"), arguments.format)
+    return 0 if similar_titles else 1
+
+
+def build_site_command(arguments):
+    """
+    Builds the website or the paginated website.
+    """
+    from movie_html import html_handler
+    if arguments.paginated:
+        output_folder = arguments.output or "pages"
+        written_pages, page_count = html_handler.build_paginated_website(
+            output_folder, arguments.title,
+            arguments.movies_per_page or html_handler.DEFAULT_MOVIES_PER_PAGE, user_id=arguments.user_id)
+        row = {"file": f"{output_folder}/index.html", "written_pages": written_pages,
+               "page_count": page_count}
+    else:
+        file_name = arguments.output or "index.html"
+        written = html_handler.build_website(file_name, arguments.title, arguments.user_id)
+        row = {"file": file_name, "written": written}
+    write_rows([row], list(row), arguments.format)
+    return 0
+
+
+def add_sorting_arguments(parser):
+    parser.add_argument("--order-by", choices=storage.SORTABLE_COLUMNS)
+    parser.add_argument("--descending", action="store_true")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--offset", type=int, default=0)
+
+
+def create_parser():
+    """
+    Creates the parser with a subcommand per function.
+    :return: argparse.ArgumentParser
+    """
+    format_parser = argparse.ArgumentParser(add_help=False)
+    format_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="jsonl",
+                               help="output as JSON lines or CSV")
+
+    parser = argparse.ArgumentParser(prog="python -m movie_cli.cli",
+                                     description="Manage the movie database without prompts.")
+    parser.add_argument("--profile", action="store_true",
+                        help="write the slowest functions and largest allocations to stderr")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write timings and counters as JSON, or Prometheus text for .prom, - for stderr")
+    parser.add_argument("--snapshot", action="store_true", default=SNAPSHOT_ENABLED,
+                        help="read from the memory-mapped catalogue snapshot and export it after writes")
+    parser.add_argument("--user", metavar="NAME",
+                        help="work on the collection and the ratings of a user")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", parents=[format_parser], help="list all movies")
+    add_sorting_arguments(list_parser)
+    list_parser.set_defaults(handler=list_command)
+
+    add_parser = commands.add_parser("add", parents=[format_parser], help="add movies from OMDb")
+    add_parser.add_argument("titles", nargs="+")
+    add_parser.set_defaults(handler=add_command, writes=True)
+
+    delete_parser = commands.add_parser("delete", parents=[format_parser], help="delete movies")
+    delete_parser.add_argument("titles", nargs="+")
+    delete_parser.set_defaults(handler=delete_command, writes=True)
+
+    update_parser = commands.add_parser("update", parents=[format_parser],
+                                        help="update ratings, e.g. update Alien 8.5 Heat 8.3")
+    update_parser.add_argument("pairs", nargs="+", metavar="TITLE RATING")
+    update_parser.set_defaults(handler=update_command, writes=True)
+
+    stats_parser = commands.add_parser("stats", parents=[format_parser], help="rating statistics")
+    stats_parser.add_argument("--by-year", action="store_true")
+    stats_parser.set_defaults(handler=stats_command)
+
+    random_parser = commands.add_parser("random", parents=[format_parser], help="pick a random movie")
+    random_parser.set_defaults(handler=random_command)
+
+    search_parser = commands.add_parser("search", parents=[format_parser], help="search titles")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=20)
+    search_parser.set_defaults(handler=search_command)
+
+    filter_parser = commands.add_parser("filter", parents=[format_parser],
+                                        help="movies by minimum rating and years")
+    filter_parser.add_argument("--min-rating", type=float)
+    filter_parser.add_argument("--start-year", type=int)
+    filter_parser.add_argument("--end-year", type=int)
+    add_sorting_arguments(filter_parser)
+    filter_parser.set_defaults(handler=filter_command)
+
+    site_parser = commands.add_parser("build-site", parents=[format_parser], help="build the website")
+    site_parser.add_argument("--paginated", action="store_true")
+    site_parser.add_argument("--output", help="HTML file, or folder with --paginated")
+    site_parser.add_argument("--title", default=DEFAULT_PAGE_TITLE)
+    site_parser.add_argument("--movies-per-page", type=int)
+    site_parser.set_defaults(handler=build_site_command)
+
+    import_parser = commands.add_parser("import", parents=[format_parser],
+                                        help="add the movies of a text or CSV file")
+    import_parser.add_argument("file")
+    import_parser.set_defaults(handler=import_command, writes=True)
+    return parser
+
+
+def run_command(arguments):
+    storage.connect_to_sql_db()
+    arguments.user_id = None
+    if arguments.user is not None:
+        if getattr(arguments, "writes", False):
+            arguments.user_id = storage.add_user(arguments.user)
+        else:
+            arguments.user_id = storage.get_user_id(arguments.user)
+            if arguments.user_id is None:
+                print(f"Error: user '{arguments.user}' doesn't exist.", file=sys.stderr)
+                return 2
+    exit_code = arguments.handler(arguments)
+    if arguments.snapshot and getattr(arguments, "writes", False):
+        # the readers map the snapshot of the finished batch instead of writing it themselves
+        from movie_analytics import catalogue_snapshot
+        catalogue_snapshot.write_snapshot()
+    return exit_code
+
+
+def main(argv=None):
+    arguments = create_parser().parse_args(argv)
+    if arguments.metrics:
+        instrumentation.enable()
+    try:
+        if arguments.profile:
+            return instrumentation.run_profiled(run_command, arguments)
+        return run_command(arguments)
+    except BrokenPipeError:
+        # e.g. the output was piped into head
+        return 0
+    finally:
+        if arguments.metrics:
+            instrumentation.dump_metrics(arguments.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,55 @@
+import functools
+import hashlib
+import html
+import json
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from movie_storage import movie_storage_sql as storage
+from movie_charts import chart_export
+from movie_metrics import instrumentation
 
+# Increase when serialize_movie changes, so that the cached fragments are rendered again
+FRAGMENT_FORMAT_VERSION = 2
+# Folder of the poster thumbnails relative to the website, see movie_posters.poster_pipeline
+THUMBNAIL_URL_FOLDER = "static/posters/thumbs"
+# Widths of the poster thumbnails for the normal and the high density displays
+THUMBNAIL_WIDTHS = (128, 256)
+# Folder of the templates, the stylesheet and the posters, relative to the working directory
+STATIC_FOLDER = "static"
+INDEX_TEMPLATE_FILE = "static/index_template.html"
+PAGE_TEMPLATE_FILE = "static/page_template.html"
+# Name of the file in the output folder which records the content of the written pages
+PAGES_MANIFEST_FILE = "pages.json"
+DEFAULT_MOVIES_PER_PAGE = 100
+# Placeholders in the templates look like __TEMPLATE_MOVIE_GRID__
+PLACEHOLDER_PATTERN = re.compile(r"(__TEMPLATE_[A-Z_]+__)")
+# Size of the write buffer of the rendered files
+WRITE_BUFFER_SIZE = 1024 * 1024
 
-def serialize_movie(movie):
+
+def serialize_movie(movie, static_prefix=""):
     """
     Serialize a movie into HTML formatted string.
-    :param movie: movie to serialize
+    A downloaded poster is shown as a local thumbnail, otherwise the remote poster is shown.
+    :param movie: Movie record to serialize
+    :param static_prefix: path from the HTML file to the folder of the static folder, e.g. "../"
     :return: HTML formatted string with movie data
     """
     # _ means ignore rating
-    title, year, _, poster_url = movie.values()
+    title, year, _, poster_url, poster_path = movie
+    if poster_path:
+        thumbnail_urls = [get_thumbnail_url(poster_path, width, static_prefix) for width in THUMBNAIL_WIDTHS]
+        poster_source = (f"src='{thumbnail_urls[0]}'\n"
+                         f"srcset='{thumbnail_urls[0]} 1x, {thumbnail_urls[1]} 2x'")
+    else:
+        poster_source = f"src='{poster_url}'"
     serialized_movie = ("<li>\n"
                         "<div class='movie'>\n"
-                        "<img class='movie-poster'\n"
-                        f"src='{poster_url}'/>\n"
+                        "<img class='movie-poster' loading='lazy'\n"
+                        f"{poster_source}/>\n"
                         f"<div class='movie-title'>{title}</div>\n"
                         f"<div class='movie-year'>{year}</div>\n"
                         f"</div>\n"
@@ -20,26 +57,84 @@ def serialize_movie(movie):
     return serialized_movie
 
 
-def serialise_all_movies():
+def get_thumbnail_url(poster_path, width, static_prefix=""):
+    """
+    URL of a poster thumbnail relative to the website.
+    :param poster_path: file name of the downloaded poster
+    :param width: width of the thumbnail in pixels
+    :param static_prefix: path from the HTML file to the folder of the static folder
+    :return: Relative URL of the thumbnail.
+    """
+    poster_name = os.path.splitext(poster_path)[0]
+    return f"{static_prefix}{THUMBNAIL_URL_FOLDER}/{poster_name}-{width}.jpg"
+
+
+def get_static_prefix(page_folder):
+    """
+    Path from the folder of an HTML file to the folder which contains the static folder.
+    :param page_folder: folder of the HTML file
+    :return: Relative URL prefix like "../", empty if the HTML file lies next to the static folder.
+    """
+    project_folder = os.path.dirname(os.path.abspath(STATIC_FOLDER))
+    relative_path = os.path.relpath(project_folder, os.path.abspath(page_folder))
+    if relative_path == os.curdir:
+        return ""
+    return relative_path.replace(os.sep, "/") + "/"
+
+
+def get_content_hash(movie, static_prefix=""):
+    """
+    Calculate the hash of the movie data shown in the HTML fragment.
+    :param movie: Movie record
+    :param static_prefix: path from the HTML file to the folder of the static folder
+    :return: Hexadecimal SHA-256 hash.
+    """
+    # the rating is not shown on the website
+    content = (f"{FRAGMENT_FORMAT_VERSION}\x1f{movie.title}\x1f{movie.year}"
+               f"\x1f{movie.poster_url}\x1f{movie.poster_path}\x1f{static_prefix}")
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def iter_serialized_movies(user_id=None, static_prefix=""):
     """
-    Serialize all movie data to the HTML.
-    :return: String with the serialized movie data.
+    Serialize all movies to HTML, reusing the cached fragments of the unchanged movies.
+    Only the movies whose version changed since the last build are hashed,
+    and only the movies whose shown data changed are rendered again.
+    The fragments don't show the rating, so the websites of all users share them.
+    :param user_id: id of the user whose collection is serialized, None for all movies
+    :param static_prefix: path from the HTML file to the folder of the static folder, see get_static_prefix
+    :return: Generator of HTML formatted strings, one per movie.
     """
-    all_movies_data = storage.list_movies()
-    serialized_movies = ""
+    changed_fragments = []
+    for movie_id, movie_version, movie, cached_hash, cached_fragment, fragment_is_current in \
+            storage.iter_movies_with_fragments(FRAGMENT_FORMAT_VERSION, user_id=user_id,
+                                               static_prefix=static_prefix):
+        if fragment_is_current:
+            instrumentation.increment("html.fragments_reused")
+            yield cached_fragment
+            continue
 
-    for movie in all_movies_data:
-        serialized_movies += serialize_movie(movie)
+        content_hash = get_content_hash(movie, static_prefix)
+        if content_hash == cached_hash:
+            # e.g. only the rating changed, which is not shown
+            fragment = cached_fragment
+        else:
+            fragment = serialize_movie(movie, static_prefix)
+            instrumentation.increment("html.fragments_rendered")
+        changed_fragments.append((movie_id, movie_version, FRAGMENT_FORMAT_VERSION, static_prefix,
+                                  content_hash, fragment))
+        yield fragment
 
-    return serialized_movies
+    # the cache is written after the reading cursor is closed
+    storage.save_html_fragments(changed_fragments)
 
 
-def get_template():
+def get_template(file_name=INDEX_TEMPLATE_FILE):
     """
     Reads the content of the template HTML file.
+    :param file_name: Name of the template file.
     :return: Content of the template HTML file.
     """
-    file_name = "static/index_template.html"
     try:
         with open(file_name, "r", encoding="utf-8") as html_file:
             html_template = html_file.read()
@@ -52,38 +147,260 @@ def get_template():
     return None
 
 
-def insert_movie_data_into_html_template(html_template, placeholder, insert_data):
+@functools.lru_cache(maxsize=None)
+def compile_template(file_name):
     """
-    Replaces HTML content with new text.
-    :param placeholder: Placeholder text to be replaced.
-    :param html_template: HTML template with placeholders for data
-    :param insert_data: HTML formatted string
-    :return: Filled HTML template as string.
+    Reads a template and splits it at its placeholders once, the result is cached.
+    :param file_name: Name of the template file.
+    :return: Tuple of the template parts, the parts with odd indexes are placeholder names.
     """
-    if placeholder not in html_template:
-        raise Exception("Error: the "
-                        f"{placeholder} "
-                        "is not in the template.")
-
-    filled_template = html_template.replace(placeholder, insert_data)
+    html_template = get_template(file_name)
+    if html_template is None:
+        raise Exception(f"Error: the template {file_name} could not be read.")
+    return tuple(PLACEHOLDER_PATTERN.split(html_template))
 
-    return filled_template
 
-
-def create_html_file(file_name, html_content):
+def render_template_to_file(file_name, template_parts, values):
     """
-    Writes the content of the HTML file to the HTML file.
+    Writes a filled template to a file part by part, without building the whole content in memory.
+    The content is written to a temporary file which replaces the target file atomically,
+    so that readers never see a half-written file. The temporary file has a unique name,
+    so that concurrent builds do not write into the same file. The target file is kept untouched
+    if the content did not change.
     :param file_name: Name of the HTML file.
-    :param html_content: HTML content of the HTML file as string.
-    :return: None
+    :param template_parts: compiled template, see compile_template
+    :param values: dictionary placeholder -> HTML formatted string or iterable of strings.
+    An iterable is consumed at its first placeholder.
+    :return: True if the file was written, False if it was up to date.
     """
+    temporary_file_name = f"{file_name}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    new_hash = hashlib.sha256()
     try:
         # use encoding for correct representation of
         # such special symbols like an apostrophe
-        with open(file_name, "w", encoding="utf-8") as html_file:
-            html_file.write(html_content)
+        with open(temporary_file_name, "x", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as html_file:
+            for index, part in enumerate(template_parts):
+                if index % 2 == 0:
+                    chunks = (part,)
+                elif part not in values:
+                    raise Exception("Error: the "
+                                    f"{part} "
+                                    "has no value.")
+                elif isinstance(values[part], str):
+                    chunks = (values[part],)
+                else:
+                    chunks = values[part]
+                for chunk in chunks:
+                    html_file.write(chunk)
+                    new_hash.update(chunk.encode("utf-8"))
 
-    except FileNotFoundError as error:
-        print(f"Error: File {file_name} is not found.\n{error}")
-    except Exception as error:
-        print(f"Error: Unexpected error at writing {file_name}.\n{error}")
+        if new_hash.hexdigest() == get_file_hash(file_name):
+            os.remove(temporary_file_name)
+            return False
+        os.replace(temporary_file_name, file_name)
+        return True
+    except BaseException:
+        try:
+            os.remove(temporary_file_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@instrumentation.timed("html.build_website")
+def build_website(file_name, page_title, user_id=None):
+    """
+    Build the website from the movies in the database.
+    The movie fragments are taken from the cache where possible and streamed into the file,
+    the file is only replaced if its content changed. The rating histogram is embedded as SVG.
+    :param file_name: Name of the HTML file, its folder is created if it does not exist.
+    :param page_title: Title shown on the top of the page.
+    :param user_id: id of the user whose collection is shown, None for all movies
+    :return: True if the file was written, False if it was up to date.
+    """
+    output_folder = os.path.dirname(file_name) or os.curdir
+    os.makedirs(output_folder, exist_ok=True)
+    # the stylesheet and the thumbnails are linked relative to the folder of the file
+    static_prefix = get_static_prefix(output_folder)
+    return render_template_to_file(file_name, compile_template(INDEX_TEMPLATE_FILE), {
+        '__TEMPLATE_TITLE__': page_title,
+        '__TEMPLATE_STATIC_PREFIX__': static_prefix,
+        '__TEMPLATE_RATING_CHART__': chart_export.serialize_rating_histogram(user_id=user_id),
+        '__TEMPLATE_MOVIE_GRID__': iter_serialized_movies(user_id, static_prefix)})
+
+
+def get_page_file_name(page_number):
+    """
+    Name of the file of a page of the paginated website.
+    :param page_number: number of the page, starting with 1
+    :return: File name like page-0001.html.
+    """
+    return f"page-{page_number:04d}.html"
+
+
+def serialize_page_navigation(page_number, page_count):
+    """
+    Serialize the links to the previous and the next page and to the index page.
+    :param page_number: number of the current page, starting with 1
+    :param page_count: amount of pages
+    :return: HTML formatted string with the navigation.
+    """
+    links = []
+    if page_number > 1:
+        links.append(f"<a href='{get_page_file_name(page_number - 1)}'>&larr; Previous</a>")
+    links.append(f"<a href='index.html'>Page {page_number} of {page_count}</a>")
+    if page_number < page_count:
+        links.append(f"<a href='{get_page_file_name(page_number + 1)}'>Next &rarr;</a>")
+    return "\n".join(links)
+
+
+def render_page_file(page_title, file_name, page_number, page_count, movies, static_prefix):
+    """
+    Renders a single page of the paginated website and writes it to a file.
+    It runs in a worker process of build_paginated_website.
+    :param page_title: Title shown on the top of the page.
+    :param file_name: path of the page file
+    :param page_number: number of the page, starting with 1
+    :param page_count: amount of pages
+    :param movies: list of Movie records shown on the page
+    :param static_prefix: path from the page to the folder of the static folder, see get_static_prefix
+    :return: Path of the written file.
+    """
+    render_template_to_file(file_name, compile_template(PAGE_TEMPLATE_FILE), {
+        '__TEMPLATE_TITLE__': page_title,
+        '__TEMPLATE_STATIC_PREFIX__': static_prefix,
+        '__TEMPLATE_PAGE_NAV__': serialize_page_navigation(page_number, page_count),
+        '__TEMPLATE_MOVIE_GRID__': (serialize_movie(movie, static_prefix) for movie in movies)})
+    return file_name
+
+
+def iter_pages(movies_per_page, user_id=None):
+    """
+    Splits the movies streamed from the database into pages.
+    :param movies_per_page: amount of movies on a page
+    :param user_id: id of the user whose collection is split, None for all movies
+    :return: Generator of tuples (page number, page signature, list of Movie records).
+    The signature changes if any movie on the page was added, removed or changed.
+    """
+    movies = storage.iter_movies_with_versions(user_id=user_id)
+    page_number = 0
+    while True:
+        page_rows = list(islice(movies, movies_per_page))
+        if not page_rows:
+            break
+        page_number += 1
+        signature = hashlib.sha256(f"{FRAGMENT_FORMAT_VERSION}".encode("utf-8"))
+        for movie_id, movie_version, _ in page_rows:
+            signature.update(f"\x1f{movie_id}:{movie_version}".encode("utf-8"))
+        yield page_number, signature.hexdigest(), [movie for _, _, movie in page_rows]
+
+
+@instrumentation.timed("html.build_paginated_website")
+def build_paginated_website(output_folder, page_title,
+                            movies_per_page=DEFAULT_MOVIES_PER_PAGE, workers=None, user_id=None):
+    """
+    Build a website with a fixed amount of movies per page and an index page.
+    The pages are rendered in parallel by worker processes,
+    only the pages whose movies changed since the last build are written again.
+    :param output_folder: folder of the page files
+    :param page_title: Title shown on the top of the pages.
+    :param movies_per_page: amount of movies on a page
+    :param workers: amount of worker processes, None for the amount of CPU cores
+    :param user_id: id of the user whose collection is shown, None for all movies
+    :return: Tuple (amount of written pages, amount of pages).
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_file_name = os.path.join(output_folder, PAGES_MANIFEST_FILE)
+    old_manifest = read_pages_manifest(manifest_file_name)
+
+    # the stylesheet and the thumbnails are linked relative to the output folder
+    static_prefix = get_static_prefix(output_folder)
+    page_count = max(1, -(-storage.count_movies(user_id) // movies_per_page))
+    new_manifest = {"page_count": page_count, "static_prefix": static_prefix, "pages": {}}
+    page_ranges = []
+    written_pages = 0
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # a limited amount of pages is in flight, so that memory does not grow with the catalogue
+        max_pending = 2 * workers
+        pending = []
+        for page_number, signature, movies in iter_pages(movies_per_page, user_id):
+            file_name = get_page_file_name(page_number)
+            new_manifest["pages"][file_name] = signature
+            page_ranges.append((file_name, movies[0].title, movies[-1].title))
+
+            page_is_unchanged = (old_manifest.get("page_count") == page_count
+                                 and old_manifest.get("static_prefix") == static_prefix
+                                 and old_manifest.get("pages", {}).get(file_name) == signature
+                                 and os.path.exists(os.path.join(output_folder, file_name)))
+            if page_is_unchanged:
+                continue
+
+            pending.append(executor.submit(render_page_file, page_title,
+                                           os.path.join(output_folder, file_name),
+                                           page_number, page_count, movies, static_prefix))
+            written_pages += 1
+            if len(pending) >= max_pending:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+
+    # pages of a previous build with more movies
+    for file_name in set(old_manifest.get("pages", {})) - set(new_manifest["pages"]):
+        stale_file_name = os.path.join(output_folder, file_name)
+        if os.path.exists(stale_file_name):
+            os.remove(stale_file_name)
+
+    write_pages_index(output_folder, page_title, page_ranges, static_prefix)
+    with open(manifest_file_name, "w", encoding="utf-8") as manifest_file:
+        json.dump(new_manifest, manifest_file)
+    return written_pages, len(page_ranges)
+
+
+def read_pages_manifest(manifest_file_name):
+    """
+    Reads the signatures of the pages written by the last build.
+    :param manifest_file_name: path of the manifest file
+    :return: Dictionary with the page count and the signatures, empty if there was no build.
+    """
+    try:
+        with open(manifest_file_name, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_pages_index(output_folder, page_title, page_ranges, static_prefix):
+    """
+    Writes the index page with links to all pages, if its content changed.
+    :param output_folder: folder of the page files
+    :param page_title: Title shown on the top of the page.
+    :param page_ranges: list of tuples (file name, first title, last title) of the pages
+    :param static_prefix: path from the output folder to the folder of the static folder
+    """
+    page_links = (f"<li><a href='{file_name}'>"
+                  f"{html.escape(first_title)} &ndash; {html.escape(last_title)}"
+                  f"</a></li>\n"
+                  for file_name, first_title, last_title in page_ranges)
+    render_template_to_file(os.path.join(output_folder, "index.html"),
+                            compile_template(PAGE_TEMPLATE_FILE), {
+                                '__TEMPLATE_TITLE__': page_title,
+                                '__TEMPLATE_STATIC_PREFIX__': static_prefix,
+                                '__TEMPLATE_PAGE_NAV__': f"{len(page_ranges)} pages",
+                                '__TEMPLATE_MOVIE_GRID__': page_links})
+
+
+def get_file_hash(file_name):
+    """
+    Calculate the hash of an existing file.
+    :param file_name: Name of the file.
+    :return: Hexadecimal SHA-256 hash or None if the file does not exist.
+    """
+    if not os.path.exists(file_name):
+        return None
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as existing_file:
+        for chunk in iter(lambda: existing_file.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
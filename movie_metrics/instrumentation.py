@@ -0,0 +1,258 @@
+"""
+Lightweight timers, counters and latency histograms for the hot paths.
+
+The instrumentation is off by default, then a timed function costs a single flag check.
+It is switched on with the environment variable MOVIES_METRICS=1 or with enable().
+"""
+import bisect
+import functools
+import inspect
+import io
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Prefix of the metric names in the Prometheus export
+PROMETHEUS_PREFIX = "movies_"
+# Amount of functions and allocations shown by run_profiled
+PROFILE_LIMIT = 25
+
+_enabled = os.getenv("MOVIES_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+# name -> value
+_counters = {}
+# name -> [counts per bucket and one for +Inf, sum of the observed values, amount of observations]
+_histograms = {}
+# returned by timer() while the instrumentation is off
+_NULL_TIMER = nullcontext()
+
+
+def enable():
+    """
+    Switch the instrumentation on.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Switch the instrumentation off, the collected metrics are kept.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Remove all collected metrics.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def increment(name, amount=1):
+    """
+    Increase a counter, e.g. of fetched rows or cache hits.
+    :param name: dotted name of the counter, e.g. "storage.rows_fetched"
+    :param amount: value added to the counter
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, seconds):
+    """
+    Record a latency in the histogram of an operation.
+    :param name: dotted name of the operation, e.g. "omdb.request"
+    :param seconds: duration of the operation
+    """
+    if not _enabled:
+        return
+    bucket_index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram[0][bucket_index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+class _Timer:
+    """
+    Context manager which records its duration in the histogram of an operation.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+def timer(name):
+    """
+    Measure the duration of a block:
+
+        with instrumentation.timer("html.render_page"):
+            ...
+
+    :param name: dotted name of the operation
+    :return: Context manager.
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed(name):
+    """
+    Decorator which records the duration of every call of a function.
+    For a generator function the time until the generator is exhausted or closed is recorded.
+    :param name: dotted name of the operation
+    :return: Decorator.
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                return _timed_generator(name, function(*args, **kwargs))
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                start_time = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def _timed_generator(name, generator):
+    start_time = time.perf_counter()
+    try:
+        yield from generator
+    finally:
+        observe(name, time.perf_counter() - start_time)
+
+
+def export_json():
+    """
+    Return the collected metrics.
+    :return: Dictionary with the counters and for each histogram
+    the cumulative bucket counts, the sum and the count.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {name: (list(counts), total, count)
+                      for name, (counts, total, count) in _histograms.items()}
+
+    exported_histograms = {}
+    for name, (counts, total, count) in histograms.items():
+        cumulative_counts = []
+        running_count = 0
+        for bucket_count in counts:
+            running_count += bucket_count
+            cumulative_counts.append(running_count)
+        exported_histograms[name] = {
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], cumulative_counts)),
+            "sum": total,
+            "count": count,
+            "mean": total / count if count else None}
+    return {"counters": counters, "histograms": exported_histograms}
+
+
+def _prometheus_name(name):
+    return PROMETHEUS_PREFIX + "".join(character if character.isalnum() else "_" for character in name)
+
+
+def export_prometheus():
+    """
+    Return the collected metrics in the Prometheus text exposition format.
+    :return: String with one sample per line.
+    """
+    metrics = export_json()
+    lines = []
+    for name, value in sorted(metrics["counters"].items()):
+        metric_name = _prometheus_name(name) + "_total"
+        lines.append(f"# TYPE {metric_name} counter")
+        lines.append(f"{metric_name} {value}")
+    for name, histogram in sorted(metrics["histograms"].items()):
+        metric_name = _prometheus_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric_name} histogram")
+        for bound, cumulative_count in histogram["buckets"].items():
+            lines.append(f'{metric_name}_bucket{{le="{bound}"}} {cumulative_count}')
+        lines.append(f"{metric_name}_sum {histogram['sum']}")
+        lines.append(f"{metric_name}_count {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def dump_metrics(file_name):
+    """
+    Write the collected metrics to a file, .prom files get the Prometheus format, others JSON.
+    :param file_name: path of the file, "-" writes to stderr
+    """
+    if file_name.endswith(".prom"):
+        content = export_prometheus()
+    else:
+        content = json.dumps(export_json(), indent=2) + "\n"
+    if file_name == "-":
+        sys.stderr.write(content)
+        return
+    with open(file_name, "w", encoding="utf-8") as metrics_file:
+        metrics_file.write(content)
+
+
+def run_profiled(function, *args, output=sys.stderr, **kwargs):
+    """
+    Run a function under cProfile and tracemalloc and print the most expensive
+    functions and allocations.
+    :param function: callable to run
+    :param output: writable text stream for the report
+    :return: Return value of the function.
+    """
+    # the profilers are only imported if they are used
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        result = profiler.runcall(function, *args, **kwargs)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_size = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_LIMIT)
+        output.write(report.getvalue())
+        output.write(f"Peak traced memory: {peak_size / 1024 / 1024:.1f} MiB\n")
+        for statistic in snapshot.statistics("lineno")[:PROFILE_LIMIT]:
+            output.write(f"{statistic}\n")
+    return result
@@ -0,0 +1,163 @@
+import hashlib
+import mimetypes
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from movie_html import html_handler
+from movie_storage import movie_storage_sql as storage
+
+# Downloaded posters are named by the hash of their content
+POSTER_FOLDER = "static/posters"
+THUMBNAIL_FOLDER = html_handler.THUMBNAIL_URL_FOLDER
+THUMBNAIL_WIDTHS = html_handler.THUMBNAIL_WIDTHS
+THUMBNAIL_QUALITY = 85
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_TIMEOUT_SECONDS = 10
+HTTP_CODE_OK = 200
+HTTP_CODE_NOT_MODIFIED = 304
+
+
+def create_session(pool_size=DOWNLOAD_WORKERS):
+    """
+    Creates a keep-alive session with a connection pool for the download workers.
+    :param pool_size: amount of kept connections per host
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_poster_extension(poster_url, content_type):
+    """
+    Chooses the file extension of a downloaded poster.
+    :param poster_url: URL of the poster
+    :param content_type: Content-Type header of the response
+    :return: Extension like ".jpg".
+    """
+    extension = mimetypes.guess_extension((content_type or "").split(";")[0].strip())
+    if extension in (".jpe", ".jpeg", None):
+        extension = os.path.splitext(urlparse(poster_url).path)[1].lower() or ".jpg"
+    return ".jpg" if extension == ".jpeg" else extension
+
+
+def download_poster(session, poster_source):
+    """
+    Downloads a single poster, if it changed since the last download.
+    The If-None-Match and If-Modified-Since headers are sent for an already downloaded poster.
+    :param session: requests.Session shared by the workers
+    :param poster_source: tuple (movie id, poster URL, poster path, ETag, Last-Modified)
+    :return: Tuple (movie id, poster path, ETag, Last-Modified, True if the poster is new)
+    or None if the download failed.
+    """
+    movie_id, poster_url, poster_path, poster_etag, poster_last_modified = poster_source
+    headers = {}
+    if poster_path and os.path.exists(os.path.join(POSTER_FOLDER, poster_path)):
+        if poster_etag:
+            headers["If-None-Match"] = poster_etag
+        if poster_last_modified:
+            headers["If-Modified-Since"] = poster_last_modified
+
+    try:
+        response = session.get(poster_url, headers=headers, timeout=DOWNLOAD_TIMEOUT_SECONDS)
+    except requests.RequestException as error:
+        print(f"Error: Poster {poster_url} could not be downloaded.\n{error}")
+        return None
+
+    if response.status_code == HTTP_CODE_NOT_MODIFIED:
+        return movie_id, poster_path, poster_etag, poster_last_modified, False
+    if response.status_code != HTTP_CODE_OK:
+        print(f"Error: Poster {poster_url} could not be downloaded, status {response.status_code}.")
+        return None
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    new_poster_path = content_hash + get_poster_extension(poster_url, response.headers.get("Content-Type"))
+    poster_file_name = os.path.join(POSTER_FOLDER, new_poster_path)
+    # the same content is stored only once, even if several movies share it
+    if not os.path.exists(poster_file_name):
+        temporary_file_name = f"{poster_file_name}.{movie_id}.tmp"
+        with open(temporary_file_name, "wb") as poster_file:
+            poster_file.write(response.content)
+        os.replace(temporary_file_name, poster_file_name)
+
+    return (movie_id, new_poster_path,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            new_poster_path != poster_path)
+
+
+def create_thumbnails(poster_path):
+    """
+    Creates the thumbnails of a downloaded poster, existing thumbnails are kept.
+    It runs in a worker process of sync_posters.
+    :param poster_path: file name of the poster in the poster folder
+    :return: Tuple (poster path, True if all thumbnails exist).
+    """
+    poster_name = os.path.splitext(poster_path)[0]
+    try:
+        with Image.open(os.path.join(POSTER_FOLDER, poster_path)) as poster:
+            poster = poster.convert("RGB")
+            for width in THUMBNAIL_WIDTHS:
+                thumbnail_file_name = os.path.join(THUMBNAIL_FOLDER, f"{poster_name}-{width}.jpg")
+                if os.path.exists(thumbnail_file_name):
+                    continue
+                height = round(poster.height * width / poster.width)
+                thumbnail = poster.resize((width, height), Image.Resampling.LANCZOS)
+                thumbnail.save(thumbnail_file_name, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    except (OSError, ValueError) as error:
+        print(f"Error: Thumbnails of {poster_path} could not be created.\n{error}")
+        return poster_path, False
+    return poster_path, True
+
+
+def thumbnails_exist(poster_path):
+    """
+    Checks if all thumbnails of a poster were created.
+    :param poster_path: file name of the poster in the poster folder
+    :return: True if all thumbnails exist.
+    """
+    poster_name = os.path.splitext(poster_path)[0]
+    return all(os.path.exists(os.path.join(THUMBNAIL_FOLDER, f"{poster_name}-{width}.jpg"))
+               for width in THUMBNAIL_WIDTHS)
+
+
+def sync_posters(download_workers=DOWNLOAD_WORKERS, thumbnail_workers=None):
+    """
+    Downloads the changed posters of all movies concurrently,
+    creates their thumbnails in worker processes and stores the local paths in the database.
+    :param download_workers: amount of parallel downloads
+    :param thumbnail_workers: amount of thumbnail processes, None for the amount of CPU cores
+    :return: Dictionary with the amount of downloaded, unchanged and failed posters
+    and of posters whose thumbnails could not be created.
+    """
+    os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+    poster_sources = storage.list_poster_sources()
+    summary = {"downloaded": 0, "unchanged": 0, "failed": 0, "thumbnails_failed": 0}
+
+    session = create_session(download_workers)
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        results = list(executor.map(lambda source: download_poster(session, source), poster_sources))
+    session.close()
+
+    downloaded_posters = [result for result in results if result is not None]
+    summary["failed"] = len(results) - len(downloaded_posters)
+    for *_, poster_is_new in downloaded_posters:
+        summary["downloaded" if poster_is_new else "unchanged"] += 1
+
+    poster_paths = {poster_path for _, poster_path, *_ in downloaded_posters
+                    if not thumbnails_exist(poster_path)}
+    with ProcessPoolExecutor(max_workers=thumbnail_workers) as executor:
+        failed_paths = {poster_path for poster_path, thumbnails_are_created
+                        in executor.map(create_thumbnails, poster_paths) if not thumbnails_are_created}
+
+    # without thumbnails the remote poster is shown
+    storage.save_poster_paths([
+        (movie_id, None if poster_path in failed_paths else poster_path, poster_etag, poster_last_modified)
+        for movie_id, poster_path, poster_etag, poster_last_modified, _ in downloaded_posters])
+    summary["thumbnails_failed"] = len(failed_paths)
+    return summary
@@ -0,0 +1,188 @@
+import threading
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+from movie_storage import movie_storage_sql as storage
+
+# Minimum similarity of a suggested title in percent
+DEFAULT_SCORE_CUTOFF = 50
+# Maximum amount of suggestions returned by find_similar_titles
+DEFAULT_SUGGESTIONS_LIMIT = 10
+# Trigrams contained in more than this part of all titles are too common
+# to narrow down the candidates and are skipped by the prefilter
+COMMON_TRIGRAM_FRACTION = 0.2
+# Below this amount of titles every shared trigram is used by the prefilter
+MIN_COMMON_TRIGRAM_SIZE = 1000
+# -1 uses all CPU cores for the batch scoring
+SCORING_WORKERS = -1
+
+# Titles by their position in the index, deleted titles are replaced by None
+_titles = []
+# Normalised titles at the same positions as in _titles
+_normalized_titles = []
+# Position of each title in _titles
+_title_positions = {}
+# Trigram -> set of positions of the titles which contain the trigram
+_trigram_index = {}
+_index_is_built = False
+# Guards the index, the API server searches on several threads while it is built again
+# or changed by the write listener. The scoring itself runs outside of the lock.
+_index_lock = threading.RLock()
+
+
+def normalize_title(title):
+    """
+    Normalise a title for comparison: lower case, without punctuation and surrounding spaces.
+    :param title: title as entered or stored
+    :return: Normalised title.
+    """
+    return utils.default_process(title)
+
+
+def get_trigrams(normalized_text):
+    """
+    Split a normalised text into overlapping sequences of three characters.
+    The text is padded with spaces, so that its beginning and end get own trigrams.
+    :param normalized_text: normalised text
+    :return: Set of trigrams.
+    """
+    normalized_text = f"  {normalized_text} "
+    return {normalized_text[i:i + 3] for i in range(len(normalized_text) - 2)}
+
+
+def build_index():
+    """
+    Load all titles from the database into the index
+    and keep the index in sync with the later writes.
+    """
+    global _index_is_built
+    with _index_lock:
+        _titles.clear()
+        _normalized_titles.clear()
+        _title_positions.clear()
+        _trigram_index.clear()
+
+        for movie in storage.iter_movies():
+            _add_title(movie.title)
+
+        storage.add_write_listener(_on_movie_written)
+        _index_is_built = True
+
+
+def invalidate_index():
+    """
+    Drop the index, it is built again at the next search.
+    It is used when other processes wrote to the database, which the write listener does not see.
+    """
+    global _index_is_built
+    with _index_lock:
+        _index_is_built = False
+
+
+def _ensure_index():
+    """
+    Build the index at the first search.
+    """
+    with _index_lock:
+        if not _index_is_built:
+            build_index()
+
+
+def _on_movie_written(event, movie):
+    """
+    Write listener of the storage, applies a single change to the index.
+    :param event: "add", "delete" or "update"
+    :param movie: affected Movie record
+    """
+    with _index_lock:
+        if event == "add":
+            _add_title(movie.title)
+        elif event == "delete":
+            _remove_title(movie.title)
+    # an update changes only the rating, the title stays in the index
+
+
+def _add_title(title):
+    """
+    Add a single title to the index.
+    :param title: title of the movie
+    """
+    if title in _title_positions:
+        return
+    position = len(_titles)
+    normalized_title = normalize_title(title)
+    _titles.append(title)
+    _normalized_titles.append(normalized_title)
+    _title_positions[title] = position
+    for trigram in get_trigrams(normalized_title):
+        _trigram_index.setdefault(trigram, set()).add(position)
+
+
+def _remove_title(title):
+    """
+    Remove a single title from the index.
+    :param title: title of the movie
+    """
+    position = _title_positions.pop(title, None)
+    if position is None:
+        return
+    for trigram in get_trigrams(_normalized_titles[position]):
+        positions = _trigram_index.get(trigram)
+        if positions is not None:
+            positions.discard(position)
+            if not positions:
+                del _trigram_index[trigram]
+    # keep the positions of the other titles stable
+    _titles[position] = None
+    _normalized_titles[position] = None
+
+
+def find_similar_titles(query, limit=DEFAULT_SUGGESTIONS_LIMIT,
+                        score_cutoff=DEFAULT_SCORE_CUTOFF, workers=SCORING_WORKERS):
+    """
+    Find the titles which are most similar to the query.
+    The candidates sharing trigrams with the query are scored in one batch by rapidfuzz.
+    :param query: title as entered by the user
+    :param limit: maximum amount of returned titles
+    :param score_cutoff: minimum similarity in percent
+    :param workers: amount of threads for scoring, -1 for all CPU cores
+    :return: List of tuples (title, score) sorted by descending score.
+    """
+    normalized_query = normalize_title(query)
+    if not normalized_query:
+        return []
+
+    # the candidates are copied, so that the index can change during the scoring
+    with _index_lock:
+        _ensure_index()
+        candidates = _get_candidates(normalized_query) if _title_positions else []
+        titles = [_titles[position] for position in candidates]
+        choices = [_normalized_titles[position] for position in candidates]
+    if not candidates:
+        return []
+
+    scores = process.cdist([normalized_query], choices,
+                           scorer=fuzz.ratio,
+                           score_cutoff=score_cutoff,
+                           workers=workers)[0]
+
+    # scores below the cutoff are set to 0
+    matches = np.flatnonzero(scores)
+    # stable sort keeps the insertion order for equal scores
+    best_matches = matches[np.argsort(-scores[matches], kind="stable")][:limit]
+    return [(titles[i], float(scores[i])) for i in best_matches]
+
+
+def _get_candidates(normalized_query):
+    """
+    Prefilter the titles by their trigrams shared with the query.
+    :param normalized_query: normalised title as entered by the user
+    :return: Sorted list of title positions.
+    """
+    common_size = max(COMMON_TRIGRAM_FRACTION * len(_title_positions), MIN_COMMON_TRIGRAM_SIZE)
+    posting_sets = [_trigram_index[trigram] for trigram in get_trigrams(normalized_query)
+                    if trigram in _trigram_index]
+    selective_sets = [positions for positions in posting_sets if len(positions) <= common_size]
+
+    # if the query consists of common trigrams only, all of them are used
+    candidates = set().union(*(selective_sets or posting_sets))
+    return sorted(candidates)
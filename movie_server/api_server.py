@@ -0,0 +1,362 @@
+"""
+Read-only HTTP JSON API over the movie database.
+
+Run it with `python -m movie_server.api_server --port 8000 --workers 4`.
+Endpoints:
+    GET /movies?min_rating=&start_year=&end_year=&order_by=&descending=&limit=&offset=
+    GET /movies/<title>
+    GET /search?q=&limit=
+    GET /filter (same parameters as /movies)
+    GET /stats
+    GET /metrics (Prometheus text format, with --metrics; every worker process reports its own)
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+from movie_metrics import instrumentation
+from movie_storage import movie_storage_sql as storage
+from movie_search import search_index
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Cached responses are dropped at the latest after this time,
+# so that writes of other processes (e.g. the menu) are seen as well
+RESPONSE_CACHE_TTL_SECONDS = 5
+RESPONSE_CACHE_SIZE = 1024
+# Writes of other processes are noticed by polling the data version of the database at this interval
+DATA_VERSION_POLL_SECONDS = 0.5
+MAX_HEADER_BYTES = 16 * 1024
+JSON_CONTENT_TYPE = "application/json; charset=utf-8"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request",
+                404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# request target -> (expiry timestamp, ETag, body), cleared on every write
+_response_cache = {}
+# data version of the database the cached responses and the search index were built from
+_data_version = None
+_next_data_version_poll = 0.0
+
+
+class HttpError(Exception):
+    """
+    Raised by the endpoints to answer with an error status.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def invalidate_response_cache(event=None, movie=None):
+    """
+    Drops all cached responses. It is registered as a write listener of the storage.
+    :param event: "add", "delete" or "update", not used
+    :param movie: affected Movie record, not used
+    """
+    _response_cache.clear()
+
+
+async def check_data_version(now):
+    """
+    Drops the cached responses and the search index if another process wrote to the database.
+    The write listeners only see the writes of this process, the server itself never writes.
+    The data version is read at most every DATA_VERSION_POLL_SECONDS,
+    on a worker thread like the endpoints, so that the event loop is not blocked.
+    :param now: current monotonic time
+    """
+    global _data_version, _next_data_version_poll
+    if now < _next_data_version_poll:
+        return
+    _next_data_version_poll = now + DATA_VERSION_POLL_SECONDS
+    data_version = await asyncio.to_thread(storage.get_data_version)
+    if data_version != _data_version:
+        if _data_version is not None:
+            invalidate_response_cache()
+            search_index.invalidate_index()
+        _data_version = data_version
+
+
+def get_int_parameter(parameters, name, default=None, minimum=None, maximum=None):
+    """
+    Reads an integer query parameter.
+    :param parameters: parsed query parameters
+    :param name: name of the parameter
+    :param default: value if the parameter is missing
+    :param minimum: smallest allowed value
+    :param maximum: values above are reduced to it
+    :return: Integer value or the default.
+    """
+    raw_value = parameters.get(name, [None])[0]
+    if raw_value in (None, ""):
+        return default
+    try:
+        value = int(raw_value)
+    except ValueError:
+        raise HttpError(400, f"Parameter {name} should be an integer.")
+    if minimum is not None and value < minimum:
+        raise HttpError(400, f"Parameter {name} should be at least {minimum}.")
+    return value if maximum is None else min(value, maximum)
+
+
+def list_movies_endpoint(parameters):
+    """
+    Lists the movies with optional filters, sorting and pagination.
+    :param parameters: parsed query parameters
+    :return: Dictionary with the movies and the pagination data.
+    """
+    raw_min_rating = parameters.get("min_rating", [""])[0]
+    try:
+        min_rating = float(raw_min_rating) if raw_min_rating else None
+    except ValueError:
+        raise HttpError(400, "Parameter min_rating should be a number.")
+    year_range = (get_int_parameter(parameters, "start_year"),
+                  get_int_parameter(parameters, "end_year"))
+    order_by = parameters.get("order_by", [None])[0]
+    if order_by is not None and order_by not in storage.SORTABLE_COLUMNS:
+        raise HttpError(400, f"Parameter order_by should be one of {', '.join(storage.SORTABLE_COLUMNS)}.")
+    descending = parameters.get("descending", ["false"])[0].lower() in ("1", "true", "yes")
+    limit = get_int_parameter(parameters, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    offset = get_int_parameter(parameters, "offset", 0, minimum=0)
+
+    # one more movie is fetched to know if there is a next page
+    movies = list(storage.query_movies(min_rating=min_rating, year_range=year_range,
+                                       order_by=order_by, descending=descending,
+                                       limit=limit + 1, offset=offset))
+    next_offset = offset + limit if len(movies) > limit else None
+    return {"movies": [movie._asdict() for movie in movies[:limit]],
+            "limit": limit,
+            "offset": offset,
+            "next_offset": next_offset}
+
+
+def get_movie_endpoint(title):
+    """
+    Returns a single movie.
+    :param title: exact title of the movie
+    :return: Movie as dictionary.
+    """
+    movie = storage.get_movie_by_title(title)
+    if movie is None:
+        raise HttpError(404, f"Movie {title} doesn't exist.")
+    return movie
+
+
+def search_endpoint(parameters):
+    """
+    Searches the movies by the words of their titles, if nothing is found by similarity.
+    :param parameters: parsed query parameters
+    :return: Dictionary with the found movies and the similar titles.
+    """
+    query = parameters.get("q", [""])[0].strip()
+    if not query:
+        raise HttpError(400, "Parameter q is required.")
+    limit = get_int_parameter(parameters, "limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+
+    movies = storage.search_titles(query, limit)
+    similar_titles = [] if movies else search_index.find_similar_titles(query, limit)
+    return {"movies": [movie._asdict() for movie in movies],
+            "similar_titles": [{"title": title, "score": score} for title, score in similar_titles]}
+
+
+def stats_endpoint():
+    """
+    Returns the rating statistics and the statistics per year.
+    :return: Dictionary with the statistics.
+    """
+    rating_stats = storage.rating_stats()
+    return {"ratings": None if rating_stats is None else rating_stats._asdict(),
+            "years": [year_stats._asdict() for year_stats in storage.year_stats()]}
+
+
+def route_request(path, parameters):
+    """
+    Calls the endpoint of a request path. It runs in a worker thread,
+    because the storage functions block.
+    :param path: path of the request
+    :param parameters: parsed query parameters
+    :return: Response data, serializable to JSON.
+    """
+    if path in ("/movies", "/filter"):
+        return list_movies_endpoint(parameters)
+    if path.startswith("/movies/"):
+        return get_movie_endpoint(unquote(path[len("/movies/"):]))
+    if path == "/search":
+        return search_endpoint(parameters)
+    if path == "/stats":
+        return stats_endpoint()
+    raise HttpError(404, f"Path {path} doesn't exist.")
+
+
+async def get_response(target):
+    """
+    Returns the response of a request target from the cache or from the endpoint.
+    :param target: path with query string
+    :return: Tuple (status, ETag, body).
+    """
+    now = time.monotonic()
+    await check_data_version(now)
+    cached_response = _response_cache.get(target)
+    if cached_response is not None and cached_response[0] > now:
+        instrumentation.increment("api.response_cache_hits")
+        return 200, cached_response[1], cached_response[2]
+    instrumentation.increment("api.response_cache_misses")
+
+    url = urlsplit(target)
+    try:
+        data = await asyncio.to_thread(route_request, url.path, parse_qs(url.query))
+    except HttpError as error:
+        return error.status, None, json.dumps({"error": error.message}).encode("utf-8")
+
+    body = json.dumps(data).encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    if len(_response_cache) >= RESPONSE_CACHE_SIZE:
+        _response_cache.clear()
+    _response_cache[target] = (now + RESPONSE_CACHE_TTL_SECONDS, etag, body)
+    return 200, etag, body
+
+
+async def handle_connection(reader, writer):
+    """
+    Serves the requests of a keep-alive connection.
+    :param reader: stream of the request data
+    :param writer: stream of the response data
+    """
+    try:
+        while True:
+            try:
+                raw_head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+
+            request_line, *header_lines = raw_head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = request_line.split(" ")
+            except ValueError:
+                await write_response(writer, 400, None, b'{"error": "Bad request line."}', False)
+                break
+            headers = {}
+            for header_line in header_lines:
+                name, _, value = header_line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = (headers.get("connection", "").lower() != "close"
+                          and version == "HTTP/1.1")
+
+            if method not in ("GET", "HEAD"):
+                await write_response(writer, 405, None, b'{"error": "Only GET is supported."}', keep_alive)
+            elif target == "/metrics" and instrumentation.is_enabled():
+                # the metrics are not cached and not part of the JSON API
+                body = instrumentation.export_prometheus().encode("utf-8")
+                await write_response(writer, 200, None, b"" if method == "HEAD" else body, keep_alive,
+                                     content_type=METRICS_CONTENT_TYPE)
+            else:
+                with instrumentation.timer("api.request"):
+                    try:
+                        status, etag, body = await get_response(target)
+                    except Exception as error:
+                        status, etag, body = 500, None, json.dumps({"error": str(error)}).encode("utf-8")
+                if etag is not None and headers.get("if-none-match") == etag:
+                    status, body = 304, b""
+                await write_response(writer, status, etag, b"" if method == "HEAD" else body, keep_alive)
+
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def write_response(writer, status, etag, body, keep_alive, content_type=JSON_CONTENT_TYPE):
+    """
+    Writes a HTTP response.
+    :param writer: stream of the response data
+    :param status: HTTP status code
+    :param etag: ETag of the body or None
+    :param body: body as bytes, JSON unless another content type is given
+    :param keep_alive: if False, the connection is closed after the response
+    :param content_type: value of the Content-Type header
+    """
+    head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if etag is not None:
+        head.append(f"ETag: {etag}")
+        head.append("Cache-Control: max-age=0, must-revalidate")
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def serve(host, port, reuse_port=False):
+    """
+    Runs the server until the process is stopped.
+    :param host: address to listen on
+    :param port: port to listen on
+    :param reuse_port: if True, several processes listen on the same port
+    """
+    server = await asyncio.start_server(handle_connection, host, port,
+                                        reuse_port=reuse_port, limit=MAX_HEADER_BYTES)
+    async with server:
+        await server.serve_forever()
+
+
+def run_worker(host, port, reuse_port):
+    """
+    Runs the server in the current process.
+    :param host: address to listen on
+    :param port: port to listen on
+    :param reuse_port: if True, several processes listen on the same port
+    """
+    storage.add_write_listener(invalidate_response_cache)
+    try:
+        asyncio.run(serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only HTTP JSON API over the movie database.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="amount of server processes sharing the port")
+    parser.add_argument("--metrics", action="store_true",
+                        help="collect timings and counters and serve them at /metrics")
+    arguments = parser.parse_args()
+    if arguments.metrics:
+        instrumentation.enable()
+
+    # the schema is migrated once, before the workers are started
+    storage.connect_to_sql_db()
+    print(f"Movie API is listening on http://{arguments.host}:{arguments.port}/ "
+          f"with {arguments.workers} worker(s).")
+    if arguments.workers == 1:
+        run_worker(arguments.host, arguments.port, reuse_port=False)
+        return
+
+    # the worker processes share the port, the kernel balances the connections
+    worker_ids = []
+    for _ in range(arguments.workers):
+        worker_id = os.fork()
+        if worker_id == 0:
+            # the pooled connections of the parent must not be shared with the worker
+            storage.engine.dispose(close=False)
+            run_worker(arguments.host, arguments.port, reuse_port=True)
+            os._exit(0)
+        worker_ids.append(worker_id)
+    try:
+        for worker_id in worker_ids:
+            os.waitpid(worker_id, 0)
+    except KeyboardInterrupt:
+        for worker_id in worker_ids:
+            os.kill(worker_id, signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    main()
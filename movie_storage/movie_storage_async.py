@@ -0,0 +1,197 @@
+"""
+Async counterpart of movie_storage_sql for front ends running on an event loop.
+It uses the same database, schema, Movie record and write listeners.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from movie_metrics import instrumentation
+from movie_storage import movie_storage_sql as storage
+from movie_storage.movie_storage_sql import Movie
+
+DEFAULT_BATCH_SIZE = storage.DEFAULT_BATCH_SIZE
+
+
+def create_async_sqlite_engine(db_path=storage.DB_PATH, journal_mode=storage.JOURNAL_MODE,
+                               synchronous=storage.SYNCHRONOUS, mmap_size=storage.MMAP_SIZE,
+                               cache_size=storage.CACHE_SIZE, busy_timeout=storage.BUSY_TIMEOUT,
+                               pool_size=storage.POOL_SIZE):
+    """
+    Create an async engine on aiosqlite with the same pragmas as create_sqlite_engine.
+    :param db_path: path to the database file or ":memory:"
+    :param journal_mode: journal mode, e.g. "WAL" or "DELETE"
+    :param synchronous: synchronous mode, e.g. "NORMAL" or "FULL"
+    :param mmap_size: bytes of the database file read through memory mapping, 0 turns it off
+    :param cache_size: page cache per connection, negative values are KiB
+    :param busy_timeout: milliseconds a writer waits for the lock of another writer
+    :param pool_size: connections kept open in the pool
+    :return: SQLAlchemy AsyncEngine
+    """
+    if db_path == ":memory:":
+        new_engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    else:
+        new_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}",
+                                         pool_size=pool_size, max_overflow=pool_size,
+                                         connect_args={"timeout": busy_timeout / 1000})
+    storage._add_pragma_listener(new_engine.sync_engine, db_path, journal_mode, synchronous,
+                                 mmap_size, cache_size, busy_timeout)
+    return new_engine
+
+
+engine = create_async_sqlite_engine()
+
+
+async def configure_database(db_path=storage.DB_PATH, **engine_options):
+    """
+    Replace the engine of the module, e.g. to use another database file.
+    connect_to_sql_db has to be called afterwards.
+    :param db_path: path to the database file or ":memory:"
+    :param engine_options: further arguments of create_async_sqlite_engine
+    """
+    global engine
+    await engine.dispose()
+    engine = create_async_sqlite_engine(db_path, **engine_options)
+
+
+async def connect_to_sql_db():
+    """
+    Establish connection to the SQL database and create the missing tables.
+    """
+    try:
+        async with engine.connect() as connection:
+            await connection.run_sync(storage._create_schema)
+            await connection.commit()
+    except Exception:
+        raise Exception("Could not connect to SQL database.")
+
+
+async def list_movies():
+    """Retrieve all movies from the database."""
+    return [movie._asdict() async for movie in iter_movies()]
+
+
+async def iter_movies(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream all movies from the database without loading the whole table at once.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :return: Async generator of Movie records.
+    """
+    query = "SELECT title, year, rating, poster_url, poster_path FROM movies"
+    async for movie in _stream_movies(query, {}, batch_size):
+        yield movie
+
+
+async def query_movies(min_rating=None, year_range=None, order_by=None,
+                       descending=False, limit=None, offset=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Retrieve movies filtered, sorted and paginated by the database,
+    the arguments are the same as of movie_storage_sql.query_movies.
+    :return: Async generator of Movie records.
+    """
+    query, parameters = storage._build_movies_query(min_rating, year_range, order_by,
+                                                    descending, limit, offset)
+    async for movie in _stream_movies(query, parameters, batch_size):
+        yield movie
+
+
+async def _stream_movies(query, parameters, batch_size):
+    """
+    Execute a query selecting movie columns and yield the rows batch by batch.
+    :param query: SQL query selecting title, year, rating, poster_url and poster_path.
+    :param parameters: parameters bound to the query.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :return: Async generator of Movie records.
+    """
+    async with engine.connect() as connection:
+        result = await connection.stream(text(query), parameters)
+        async for rows in result.partitions(batch_size):
+            instrumentation.increment("storage.rows_fetched", len(rows))
+            for row in rows:
+                yield Movie(*row)
+
+
+async def count_movies():
+    """
+    Count the movies in the database, the amount is read from the summary table.
+    :return: Amount of movies.
+    """
+    async with engine.connect() as connection:
+        result = await connection.execute(text("SELECT movie_count FROM movie_summary WHERE id = 1"))
+        return result.scalar()
+
+
+async def get_movie_by_title(title, ignore_case=False):
+    """
+    Retrieve a single movie by its title using the title index.
+    :param title: title of the movie
+    :param ignore_case: if True, the title is compared case-insensitively.
+    :return: Movie as dictionary or None if the movie is not in the database.
+    """
+    async with engine.connect() as connection:
+        movie = await connection.run_sync(storage._select_movie_by_title, title, ignore_case)
+
+    if movie is None:
+        return None
+    return movie._asdict()
+
+
+async def add_movie(title, year, rating, poster_url):
+    """Add a new movie to the database."""
+    try:
+        async with engine.begin() as connection:
+            await connection.execute(text("""INSERT INTO movies (title, year, rating, poster_url)
+                                             VALUES (:title, :year, :rating, :poster_url)"""),
+                                     {"title": title, "year": year, "rating": rating,
+                                      "poster_url": poster_url})
+        print(f"Movie '{title}' added successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+    storage._notify_write_listeners("add", Movie(title, year, rating, poster_url))
+
+
+async def delete_movie(title):
+    """Delete a movie from the database."""
+    try:
+        async with engine.begin() as connection:
+            deleted_movie = await connection.run_sync(storage._select_movie_by_title, title)
+            await connection.execute(text("DELETE FROM movies WHERE title = :title"), {"title": title})
+        print(f"Movie '{title}' deleted successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+    if deleted_movie is not None:
+        storage._notify_write_listeners("delete", deleted_movie)
+
+
+async def update_movie(title, rating):
+    """Update a movie's rating in the database."""
+    try:
+        async with engine.begin() as connection:
+            await connection.execute(text("""UPDATE movies
+                                             SET rating = :rating, version = version + 1
+                                             WHERE title = :title"""),
+                                     {"title": title, "rating": rating})
+            updated_movie = await connection.run_sync(storage._select_movie_by_title, title)
+        print(f"Movie '{title}' updated successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+    if updated_movie is not None:
+        storage._notify_write_listeners("update", updated_movie)
+
+
+async def update_ratings(ratings):
+    """
+    Update the ratings of many movies in a single transaction,
+    like movie_storage_sql.update_ratings.
+    :param ratings: iterable of tuples (title, rating) or a dictionary title -> rating
+    :return: List of WriteResult records in the order of the input,
+    with the status UPDATED or NOT_FOUND.
+    """
+    async with engine.begin() as connection:
+        results = await connection.run_sync(storage._update_ratings, ratings)
+    for result in results:
+        if result.status == storage.UPDATED:
+            storage._notify_write_listeners("update", result.movie)
+    return results
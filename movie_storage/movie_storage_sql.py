@@ -1,84 +1,1527 @@
-from sqlalchemy import create_engine, text
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool, StaticPool
+from dotenv import load_dotenv
+from movie_metrics import instrumentation
 
-# Define the database URL
-DB_URL = "sqlite:///data/movies.db"
+# load the database settings from the environment
+load_dotenv()
+
+# The database lies in the data folder of the project, independent of the working directory.
+# It can be moved with the environment variable MOVIES_DB_PATH, ":memory:" keeps it in memory.
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "data", "movies.db")
+DB_PATH = os.getenv("MOVIES_DB_PATH", DEFAULT_DB_PATH)
+
+# Readers are not blocked by a writer in WAL mode,
+# synchronous=NORMAL syncs at checkpoints instead of at every commit
+JOURNAL_MODE = os.getenv("MOVIES_DB_JOURNAL_MODE", "WAL")
+SYNCHRONOUS = os.getenv("MOVIES_DB_SYNCHRONOUS", "NORMAL")
+# Bytes of the database file read through memory mapping
+MMAP_SIZE = int(os.getenv("MOVIES_DB_MMAP_SIZE", 256 * 1024 * 1024))
+# Page cache per connection, negative values are KiB
+CACHE_SIZE = int(os.getenv("MOVIES_DB_CACHE_SIZE", -64 * 1024))
+# Milliseconds a writer waits for the lock of another writer
+BUSY_TIMEOUT = int(os.getenv("MOVIES_DB_BUSY_TIMEOUT", 5000))
+# Connections kept open for multithreaded callers
+POOL_SIZE = int(os.getenv("MOVIES_DB_POOL_SIZE", 8))
+# Execution option of a connection with the mode of its transactions, e.g. "IMMEDIATE"
+TRANSACTION_MODE_OPTION = "sqlite_transaction_mode"
+
+# Columns which are allowed in the ORDER BY clause of query_movies
+SORTABLE_COLUMNS = ("title", "year", "rating")
+
+# Callables notified after a successful write, see add_write_listener
+_write_listeners = []
+
+# Connection and buffered notifications of the open transaction of each thread, see transaction
+_transaction_state = threading.local()
+
+# Status of a single row in the results of the bulk write functions
+ADDED = "added"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+DELETED = "deleted"
+EXISTS = "exists"
+DUPLICATE = "duplicate"
+NOT_FOUND = "not_found"
+
+# Percentiles of the ratings reported by rating_stats
+STATS_PERCENTILES = (25, 50, 75, 90)
+
+# Number of rows fetched from the cursor at once by the streaming functions
+DEFAULT_BATCH_SIZE = 500
+
+# The movies in the scope of a user: the shared data of the movies with the rating of the user.
+# It replaces the movies table in the queries, SQLite flattens the subquery into the outer query,
+# so that the filters and sort orders on the rating use the index (user_id, rating) of user_movies.
+# The version is the one of the shared data, which is what the website shows.
+# The id is taken from user_movies, so that the order of the ids is the one of its primary key.
+_USER_MOVIES_TABLE = """(
+    SELECT user_movies.movie_id AS id, movies.version AS version, movies.title AS title, movies.year AS year,
+           user_movies.rating AS rating, movies.poster_url AS poster_url, movies.poster_path AS poster_path
+    FROM user_movies
+    JOIN movies ON movies.id = user_movies.movie_id
+    WHERE user_movies.user_id = :user_id) AS movies"""
+
+
+def create_sqlite_engine(db_path=DB_PATH, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS,
+                         mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE,
+                         busy_timeout=BUSY_TIMEOUT, pool_size=POOL_SIZE):
+    """
+    Create an engine for a SQLite database, every new connection gets the pragmas.
+    :param db_path: path to the database file or ":memory:"
+    :param journal_mode: journal mode, e.g. "WAL" or "DELETE"
+    :param synchronous: synchronous mode, e.g. "NORMAL" or "FULL"
+    :param mmap_size: bytes of the database file read through memory mapping, 0 turns it off
+    :param cache_size: page cache per connection, negative values are KiB
+    :param busy_timeout: milliseconds a writer waits for the lock of another writer
+    :param pool_size: connections kept open in the pool
+    :return: SQLAlchemy engine
+    """
+    if db_path == ":memory:":
+        # all threads share the single connection, otherwise each would see an own empty database.
+        # Returning it must not roll back, that would discard the writes of an open transaction.
+        new_engine = create_engine("sqlite://", poolclass=StaticPool, pool_reset_on_return=None,
+                                   connect_args={"check_same_thread": False})
+    else:
+        new_engine = create_engine(f"sqlite:///{db_path}", poolclass=QueuePool,
+                                   pool_size=pool_size, max_overflow=pool_size,
+                                   connect_args={"check_same_thread": False,
+                                                 "timeout": busy_timeout / 1000})
+
+    _add_pragma_listener(new_engine, db_path, journal_mode, synchronous,
+                         mmap_size, cache_size, busy_timeout)
+    return new_engine
+
+
+def _add_pragma_listener(sync_engine, db_path, journal_mode, synchronous,
+                         mmap_size, cache_size, busy_timeout):
+    """
+    Set the pragmas on every new connection of an engine.
+    For a database file the transactions are started by the engine instead of the driver,
+    which would only start them at the first write: transaction() starts them with
+    BEGIN IMMEDIATE, so that its reads already hold the write lock, see TRANSACTION_MODE_OPTION.
+    It is shared with the async engine of movie_storage_async.
+    :param sync_engine: engine, for an async engine its sync_engine
+    :param db_path: path to the database file or ":memory:"
+    :param journal_mode: journal mode, e.g. "WAL" or "DELETE"
+    :param synchronous: synchronous mode, e.g. "NORMAL" or "FULL"
+    :param mmap_size: bytes of the database file read through memory mapping
+    :param cache_size: page cache per connection, negative values are KiB
+    :param busy_timeout: milliseconds a writer waits for the lock of another writer
+    """
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if db_path != ":memory:":
+            cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+            cursor.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+        cursor.execute(f"PRAGMA cache_size = {int(cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        cursor.close()
+        if db_path != ":memory:":
+            # turns off the implicit BEGIN of the driver, see the "begin" listener
+            dbapi_connection.isolation_level = None
+
+    if db_path != ":memory:":
+        @event.listens_for(sync_engine, "begin")
+        def begin_transaction(connection):
+            transaction_mode = connection.get_execution_options().get(TRANSACTION_MODE_OPTION, "DEFERRED")
+            connection.exec_driver_sql(f"BEGIN {transaction_mode}")
+
+
+engine = create_sqlite_engine()
+
+
+def configure_database(db_path=DB_PATH, **engine_options):
+    """
+    Replace the engine of the module, e.g. to use another database file.
+    connect_to_sql_db has to be called afterwards.
+    :param db_path: path to the database file or ":memory:"
+    :param engine_options: further arguments of create_sqlite_engine
+    """
+    global engine
+    engine.dispose()
+    engine = create_sqlite_engine(db_path, **engine_options)
+
+
+class Movie(NamedTuple):
+    """
+    Compact, tuple-backed record of a single movie row.
+    """
+    title: str
+    year: int
+    rating: float
+    poster_url: str
+    # file name of the downloaded poster in the local poster cache, None if not downloaded
+    poster_path: str = None
+
+
+class WriteResult(NamedTuple):
+    """
+    Result of a single row of a bulk write function.
+    """
+    title: str
+    # one of ADDED, UPDATED, UNCHANGED, DELETED, EXISTS, DUPLICATE and NOT_FOUND
+    status: str
+    # written or deleted Movie record, None if the row was skipped
+    movie: Movie = None
+
+
+class User(NamedTuple):
+    """
+    Owner of a movie collection.
+    """
+    id: int
+    name: str
+
+
+class YearStats(NamedTuple):
+    """
+    Amount of movies and their average rating in a single year.
+    """
+    year: int
+    count: int
+    average_rating: float
+
+
+class RatingStats(NamedTuple):
+    """
+    Aggregate statistics of the movie ratings.
+    """
+    count: int
+    mean: float
+    min_rating: float
+    max_rating: float
+    best_title: str
+    worst_title: str
+    median: float
+    percentiles: dict
 
-# Create the engine
-# echo=True tells SQLAlchemy to print all SQL statements it runs
-engine = create_engine(DB_URL)
 
 def connect_to_sql_db():
     """
     Establish connection to the SQL database.
     """
     try:
-        # Create the movies table if it does not exist
+        database_folder = os.path.dirname(engine.url.database or "")
+        if database_folder:
+            os.makedirs(database_folder, exist_ok=True)
         with engine.connect() as conn:
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS movies (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT UNIQUE NOT NULL,
-                    year INTEGER NOT NULL,
-                    rating REAL NOT NULL,
-                    poster_url TEXT NOT NULL)
-            """))
+            _create_schema(conn)
             conn.commit()
     except Exception:
         raise Exception("Could not connect to SQL database.")
 
-def list_movies():
-    """Retrieve all movies from the database."""
+def _create_schema(conn):
+    """
+    Create the tables, indexes and triggers which do not exist yet.
+    It is shared with movie_storage_async.
+    :param conn: open database connection
+    """
+    # Create the movies table if it does not exist
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS movies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT UNIQUE NOT NULL,
+            year INTEGER NOT NULL,
+            rating REAL NOT NULL,
+            poster_url TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1)
+    """))
+    # databases created before the version column get it added
+    _add_column_if_missing(conn, "movies", "version", "INTEGER NOT NULL DEFAULT 1")
+    # local poster cache, see movie_posters.poster_pipeline
+    _add_column_if_missing(conn, "movies", "poster_path", "TEXT")
+    _add_column_if_missing(conn, "movies", "poster_etag", "TEXT")
+    _add_column_if_missing(conn, "movies", "poster_last_modified", "TEXT")
+    # The UNIQUE constraint on title already gives an exact-match index,
+    # the NOCASE index serves the case-insensitive existence checks.
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_movies_title_nocase
+        ON movies (title COLLATE NOCASE)
+    """))
+    # Indexes for filtering and sorting in query_movies
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_movies_year ON movies (year)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_movies_rating ON movies (rating)"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_movies_year_rating
+        ON movies (year, rating)
+    """))
+    _create_title_search_table(conn)
+    _create_summary_tables(conn)
+    _create_html_fragments_table(conn)
+    _create_user_tables(conn)
+
+def _add_column_if_missing(connection, table_name, column_name, column_definition):
+    """
+    Add a column to an existing table if the table does not have it yet.
+    :param connection: open database connection
+    :param table_name: name of the table
+    :param column_name: name of the new column
+    :param column_definition: type and constraints of the new column
+    """
+    columns = connection.execute(text(f"PRAGMA table_info({table_name})")).fetchall()
+    if column_name not in (column[1] for column in columns):
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}"))
+
+def _create_user_tables(connection):
+    """
+    Create the users and their collections. The data of a movie is stored once in the movies table
+    and shared by all users, a user has an own rating of each movie in the collection.
+    :param connection: open database connection
+    """
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL)
+    """))
+    # the primary key clusters the rows of each user, so a collection is read as one range
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_movies (
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            movie_id INTEGER NOT NULL REFERENCES movies (id),
+            rating REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (user_id, movie_id)) WITHOUT ROWID
+    """))
+    # filters, sort orders and percentiles of the ratings of a user
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_user_movies_user_rating
+        ON user_movies (user_id, rating)
+    """))
+    # removal of a deleted movie from all collections
+    connection.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_user_movies_movie
+        ON user_movies (movie_id)
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS user_movies_movie_delete AFTER DELETE ON movies BEGIN
+            DELETE FROM user_movies WHERE movie_id = old.id;
+        END
+    """))
+
+def _create_html_fragments_table(connection):
+    """
+    Create the cache of the rendered HTML fragments of the movies.
+    A fragment is valid for the version of the movie it was rendered from
+    and for the path to the static folder its links were rendered with.
+    :param connection: open database connection
+    """
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS movie_html_fragments (
+            movie_id INTEGER PRIMARY KEY,
+            movie_version INTEGER NOT NULL,
+            format_version INTEGER NOT NULL,
+            static_prefix TEXT NOT NULL DEFAULT '',
+            content_hash TEXT NOT NULL,
+            fragment TEXT NOT NULL)
+    """))
+    # caches created before the static prefix were rendered next to the static folder
+    _add_column_if_missing(connection, "movie_html_fragments", "static_prefix", "TEXT NOT NULL DEFAULT ''")
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS movie_html_fragments_delete AFTER DELETE ON movies BEGIN
+            DELETE FROM movie_html_fragments WHERE movie_id = old.id;
+        END
+    """))
+
+def _create_title_search_table(connection):
+    """
+    Create the FTS5 full-text index over the movie titles
+    and the triggers which keep it in sync with the movies table.
+    :param connection: open database connection
+    """
+    fts_table_exists = connection.execute(text("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movies_fts'
+    """)).fetchone() is not None
+    if fts_table_exists:
+        return
+
+    # external content table: the titles are stored only once in the movies table
+    connection.execute(text("""
+        CREATE VIRTUAL TABLE movies_fts USING fts5(
+            title,
+            content = 'movies',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2')
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN
+            INSERT INTO movies_fts (rowid, title) VALUES (new.id, new.title);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN
+            INSERT INTO movies_fts (movies_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF title ON movies BEGIN
+            INSERT INTO movies_fts (movies_fts, rowid, title) VALUES ('delete', old.id, old.title);
+            INSERT INTO movies_fts (rowid, title) VALUES (new.id, new.title);
+        END
+    """))
+    # index the movies which were stored before the search table existed
+    connection.execute(text("INSERT INTO movies_fts (movies_fts) VALUES ('rebuild')"))
+
+# Statements which add a row to the summary tables, shared by the insert and update triggers.
+# The rating buckets have the width of 0.1, the bucket number is the rating multiplied by 10.
+_SUMMARY_ADD_ROW = """
+    UPDATE movie_summary
+    SET movie_count = movie_count + 1, rating_sum = rating_sum + new.rating,
+        data_version = data_version + 1
+    WHERE id = 1;
+    INSERT INTO movie_year_stats (year, movie_count, rating_sum)
+    VALUES (new.year, 1, new.rating)
+    ON CONFLICT (year) DO UPDATE SET
+        movie_count = movie_count + 1,
+        rating_sum = rating_sum + excluded.rating_sum;
+    INSERT INTO movie_rating_buckets (bucket, movie_count)
+    VALUES (CAST(ROUND(new.rating * 10) AS INTEGER), 1)
+    ON CONFLICT (bucket) DO UPDATE SET movie_count = movie_count + 1;
+"""
+
+# Statements which remove a row from the summary tables, shared by the delete and update triggers
+_SUMMARY_REMOVE_ROW = """
+    UPDATE movie_summary
+    SET movie_count = movie_count - 1, rating_sum = rating_sum - old.rating,
+        data_version = data_version + 1
+    WHERE id = 1;
+    UPDATE movie_year_stats
+    SET movie_count = movie_count - 1, rating_sum = rating_sum - old.rating
+    WHERE year = old.year;
+    DELETE FROM movie_year_stats WHERE year = old.year AND movie_count = 0;
+    UPDATE movie_rating_buckets
+    SET movie_count = movie_count - 1
+    WHERE bucket = CAST(ROUND(old.rating * 10) AS INTEGER);
+    DELETE FROM movie_rating_buckets
+    WHERE bucket = CAST(ROUND(old.rating * 10) AS INTEGER) AND movie_count = 0;
+"""
+
+# The best and the worst movie are looked up in the rating index after each change,
+# ties are resolved as in a stable sort of the table by rating.
+# MAX/MIN and the equality seek keep it logarithmic, an ORDER BY mixing the directions
+# of rating and id can not use the index and would scan the table on every write.
+_SUMMARY_UPDATE_BEST_AND_WORST = """
+    UPDATE movie_summary SET
+        best_movie_id = (SELECT id FROM movies WHERE rating = (SELECT MAX(rating) FROM movies)
+                         ORDER BY id ASC LIMIT 1),
+        worst_movie_id = (SELECT id FROM movies WHERE rating = (SELECT MIN(rating) FROM movies)
+                          ORDER BY id DESC LIMIT 1)
+    WHERE id = 1;
+"""
+
+def _create_summary_tables(connection):
+    """
+    Create the summary tables with precomputed aggregates of the movies
+    and the triggers which keep them up to date on every write.
+    The summary also holds the data version, which is increased by every write of a movie,
+    and a random catalogue id, so that the versions of different databases are not mixed up.
+    :param connection: open database connection
+    """
+    summary_table_exists = connection.execute(text("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movie_summary'
+    """)).fetchone() is not None
+
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS movie_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            movie_count INTEGER NOT NULL,
+            rating_sum REAL NOT NULL,
+            best_movie_id INTEGER,
+            worst_movie_id INTEGER,
+            data_version INTEGER NOT NULL DEFAULT 0,
+            catalogue_id TEXT)
+    """))
+    _add_column_if_missing(connection, "movie_summary", "data_version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(connection, "movie_summary", "catalogue_id", "TEXT")
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS movie_year_stats (
+            year INTEGER PRIMARY KEY,
+            movie_count INTEGER NOT NULL,
+            rating_sum REAL NOT NULL)
+    """))
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS movie_rating_buckets (
+            bucket INTEGER PRIMARY KEY,
+            movie_count INTEGER NOT NULL)
+    """))
+    # the triggers are created again, so that existing databases get their current version
+    for trigger_name in ("movie_summary_insert", "movie_summary_delete", "movie_summary_update",
+                         "movie_summary_version"):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger_name}"))
+    connection.execute(text(f"""
+        CREATE TRIGGER movie_summary_insert AFTER INSERT ON movies BEGIN
+            {_SUMMARY_ADD_ROW}
+            {_SUMMARY_UPDATE_BEST_AND_WORST}
+        END
+    """))
+    connection.execute(text(f"""
+        CREATE TRIGGER movie_summary_delete AFTER DELETE ON movies BEGIN
+            {_SUMMARY_REMOVE_ROW}
+            {_SUMMARY_UPDATE_BEST_AND_WORST}
+        END
+    """))
+    connection.execute(text(f"""
+        CREATE TRIGGER movie_summary_update AFTER UPDATE OF year, rating ON movies BEGIN
+            {_SUMMARY_REMOVE_ROW}
+            {_SUMMARY_ADD_ROW}
+            {_SUMMARY_UPDATE_BEST_AND_WORST}
+        END
+    """))
+    # changes of the year and the rating increase the version in the statements above
+    connection.execute(text("""
+        CREATE TRIGGER movie_summary_version AFTER UPDATE OF title, poster_url, poster_path ON movies
+        WHEN OLD.title IS NOT NEW.title OR OLD.poster_url IS NOT NEW.poster_url
+            OR OLD.poster_path IS NOT NEW.poster_path
+        BEGIN
+            UPDATE movie_summary SET data_version = data_version + 1 WHERE id = 1;
+        END
+    """))
+    if not summary_table_exists:
+        _rebuild_summary_tables(connection)
+    connection.execute(text("""
+        UPDATE movie_summary SET catalogue_id = lower(hex(randomblob(8)))
+        WHERE id = 1 AND catalogue_id IS NULL
+    """))
+
+def _rebuild_summary_tables(connection):
+    """
+    Recompute the summary tables from the movies table.
+    :param connection: open database connection
+    """
+    connection.execute(text("DELETE FROM movie_summary"))
+    connection.execute(text("DELETE FROM movie_year_stats"))
+    connection.execute(text("DELETE FROM movie_rating_buckets"))
+    connection.execute(text("""
+        INSERT INTO movie_summary (id, movie_count, rating_sum)
+        SELECT 1, COUNT(*), COALESCE(SUM(rating), 0) FROM movies
+    """))
+    connection.execute(text("""
+        INSERT INTO movie_year_stats (year, movie_count, rating_sum)
+        SELECT year, COUNT(*), SUM(rating) FROM movies GROUP BY year
+    """))
+    connection.execute(text("""
+        INSERT INTO movie_rating_buckets (bucket, movie_count)
+        SELECT CAST(ROUND(rating * 10) AS INTEGER), COUNT(*) FROM movies
+        GROUP BY CAST(ROUND(rating * 10) AS INTEGER)
+    """))
+    connection.execute(text(_SUMMARY_UPDATE_BEST_AND_WORST))
+
+def _get_movies_table(user_id):
+    """
+    Return the table of the movies in a scope for the FROM clause of a query.
+    The columns are the ones of the movies table, the query has to bind the user_id parameter.
+    :param user_id: id of the user, None for all movies with their shared ratings
+    :return: SQL table or subquery named movies.
+    """
+    return "movies" if user_id is None else _USER_MOVIES_TABLE
+
+def add_user(name):
+    """
+    Add a user, an existing user with the name is kept.
+    :param name: unique name of the user
+    :return: Id of the user.
+    """
+    with transaction() as connection:
+        connection.execute(text("INSERT INTO users (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                           {"name": name})
+        return connection.execute(text("SELECT id FROM users WHERE name = :name"), {"name": name}).scalar()
+
+def get_user_id(name):
+    """
+    Look up the id of a user by the name.
+    :param name: name of the user
+    :return: Id of the user or None if there is no user with the name.
+    """
+    with _connect() as connection:
+        return connection.execute(text("SELECT id FROM users WHERE name = :name"), {"name": name}).scalar()
+
+def list_users():
+    """
+    List all users.
+    :return: List of User records sorted by name.
+    """
+    with _connect() as connection:
+        return [User(*row) for row in connection.execute(text("SELECT id, name FROM users ORDER BY name"))]
+
+def delete_user(user_id):
+    """
+    Delete a user and the collection of the user, the shared movie data is kept.
+    :param user_id: id of the user
+    :return: True if the user existed.
+    """
+    with transaction() as connection:
+        connection.execute(text("DELETE FROM user_movies WHERE user_id = :user_id"), {"user_id": user_id})
+        result = connection.execute(text("DELETE FROM users WHERE id = :user_id"), {"user_id": user_id})
+        return result.rowcount > 0
+
+def _check_user(connection, user_id):
+    """
+    Make sure that a user exists before the collection of the user is written.
+    :param connection: open database connection
+    :param user_id: id of the user
+    :raise ValueError: if there is no user with the id.
+    """
+    user_exists = connection.execute(text("SELECT 1 FROM users WHERE id = :user_id"),
+                                     {"user_id": user_id}).fetchone() is not None
+    if not user_exists:
+        raise ValueError(f"User {user_id} doesn't exist.")
+
+def list_movies(user_id=None):
+    """Retrieve all movies from the database, or the collection of a user."""
+    return [movie._asdict() for movie in iter_movies(user_id=user_id)]
+
+@instrumentation.timed("storage.iter_movies")
+def iter_movies(batch_size=DEFAULT_BATCH_SIZE, user_id=None):
+    """
+    Stream all movies from the database without loading the whole table at once.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :param user_id: id of the user whose collection is streamed, None for all movies.
+    :return: Generator of Movie records.
+    """
+    query = f"SELECT title, year, rating, poster_url, poster_path FROM {_get_movies_table(user_id)}"
+    yield from _stream_movies(query, {"user_id": user_id}, batch_size)
+
+def count_movies(user_id=None):
+    """
+    Count the movies in the database, the amount is read from the summary table.
+    The movies of a user are counted in the primary key range of the user.
+    :param user_id: id of the user whose collection is counted, None for all movies.
+    :return: Amount of movies.
+    """
+    with _connect() as connection:
+        if user_id is None:
+            return connection.execute(text("SELECT movie_count FROM movie_summary WHERE id = 1")).scalar()
+        return connection.execute(text("SELECT COUNT(*) FROM user_movies WHERE user_id = :user_id"),
+                                  {"user_id": user_id}).scalar()
+
+def get_data_version():
+    """
+    Read the data version of the movies, it is increased by every write of a movie.
+    Caches derived from the movies, e.g. the catalogue snapshot, are valid as long as it is unchanged.
+    :return: Tuple (catalogue id, data version).
+    """
+    with _connect() as connection:
+        return tuple(connection.execute(text("""
+            SELECT catalogue_id, data_version FROM movie_summary WHERE id = 1
+        """)).one())
+
+def _stream_movies(query, parameters, batch_size):
+    """
+    Execute a query selecting movie columns and yield the rows batch by batch.
+    :param query: SQL query selecting title, year, rating, poster_url and poster_path.
+    :param parameters: parameters bound to the query.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :return: Generator of Movie records.
+    """
+    with _connect() as connection:
+        result = connection.execute(text(query), parameters)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            instrumentation.increment("storage.rows_fetched", len(rows))
+            for row in rows:
+                yield Movie(*row)
+
+@instrumentation.timed("storage.query_movies")
+def query_movies(min_rating=None, year_range=None, order_by=None,
+                 descending=False, limit=None, offset=0, batch_size=DEFAULT_BATCH_SIZE, user_id=None):
+    """
+    Retrieve movies filtered, sorted and paginated by the database.
+    :param min_rating: minimum rating of the movies, None for no minimum.
+    :param year_range: tuple (start_year, end_year), both inclusive.
+    Each of the years can be None for an open range.
+    :param order_by: column to sort by, one of SORTABLE_COLUMNS. None for no sorting.
+    :param descending: if True, sort descending.
+    :param limit: maximum number of movies to return, None for all movies.
+    :param offset: number of movies to skip from the beginning of the result.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :param user_id: id of the user whose collection is queried, None for all movies.
+    :return: Generator of Movie records.
+    """
+    query, parameters = _build_movies_query(min_rating, year_range, order_by, descending, limit, offset,
+                                            user_id)
+    yield from _stream_movies(query, parameters, batch_size)
+
+def _build_movies_query(min_rating, year_range, order_by, descending, limit, offset, user_id=None):
+    """
+    Build the SQL query of query_movies, it is shared with movie_storage_async.
+    :return: Tuple (query, parameters).
+    """
+    conditions = []
+    parameters = {"user_id": user_id}
+
+    if min_rating is not None:
+        conditions.append("rating >= :min_rating")
+        parameters["min_rating"] = min_rating
+
+    if year_range is not None:
+        start_year, end_year = year_range
+        if start_year is not None:
+            conditions.append("year >= :start_year")
+            parameters["start_year"] = start_year
+        if end_year is not None:
+            conditions.append("year <= :end_year")
+            parameters["end_year"] = end_year
+
+    query = f"SELECT title, year, rating, poster_url, poster_path FROM {_get_movies_table(user_id)}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    if order_by is not None:
+        # column names can not be bound as parameters, so they are checked against a whitelist
+        if order_by not in SORTABLE_COLUMNS:
+            raise ValueError(f"Not possible to sort movies by '{order_by}'.")
+        direction = "DESC" if descending else "ASC"
+        query += f" ORDER BY {order_by} {direction}"
+
+    if limit is not None or offset:
+        # SQLite requires a LIMIT for an OFFSET, -1 means no limit
+        query += " LIMIT :limit OFFSET :offset"
+        parameters["limit"] = -1 if limit is None else limit
+        parameters["offset"] = offset
+
+    return query, parameters
+
+@instrumentation.timed("storage.search_titles")
+def search_titles(query, limit=20, user_id=None):
+    """
+    Search movies by the words of their titles in the full-text index.
+    Every word of the query has to match the beginning of a word in the title,
+    the results are ranked by relevance (bm25).
+    :param query: words or beginnings of words of the title, case-insensitive
+    :param limit: maximum amount of returned movies
+    :param user_id: id of the user whose collection is searched, None for all movies
+    :return: List of Movie records, the best match first.
+    """
+    # quote the words, so that the FTS5 query syntax in the input has no effect
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+    match_expression = " ".join(f'"{word}"*' for word in words)
+
+    with _connect() as connection:
+        result = connection.execute(text(f"""
+            SELECT movies.title, movies.year, movies.rating, movies.poster_url, movies.poster_path
+            FROM movies_fts
+            JOIN {_get_movies_table(user_id)} ON movies.id = movies_fts.rowid
+            WHERE movies_fts MATCH :match_expression
+            ORDER BY bm25(movies_fts)
+            LIMIT :limit
+        """), {"match_expression": match_expression, "limit": limit, "user_id": user_id})
+        return [Movie(*row) for row in result.fetchall()]
+
+@instrumentation.timed("storage.iter_movies_with_fragments")
+def iter_movies_with_fragments(format_version, batch_size=DEFAULT_BATCH_SIZE, user_id=None, static_prefix=""):
+    """
+    Stream all movies together with their cached HTML fragments.
+    The fragments show only shared data, so the users share them as well.
+    :param format_version: version of the HTML format of the fragments
+    :param batch_size: number of rows fetched from the cursor at once.
+    :param user_id: id of the user whose collection is streamed, None for all movies.
+    :param static_prefix: path from the HTML file to the folder of the static folder
+    :return: Generator of tuples (movie id, movie version, Movie, cached content hash,
+    cached fragment, True if the fragment was rendered from the current movie version in the given format
+    with the given static prefix).
+    The cached values are None if the movie has no fragment yet.
+    """
+    with _connect() as connection:
+        result = connection.execute(text(f"""
+            SELECT movies.id, movies.version,
+                   movies.title, movies.year, movies.rating, movies.poster_url, movies.poster_path,
+                   fragments.content_hash, fragments.fragment,
+                   fragments.movie_version = movies.version
+                   AND fragments.format_version = :format_version
+                   AND fragments.static_prefix = :static_prefix
+            FROM {_get_movies_table(user_id)}
+            LEFT JOIN movie_html_fragments AS fragments ON fragments.movie_id = movies.id
+        """), {"format_version": format_version, "user_id": user_id, "static_prefix": static_prefix})
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            instrumentation.increment("storage.rows_fetched", len(rows))
+            for row in rows:
+                yield row[0], row[1], Movie(*row[2:7]), row[7], row[8], bool(row[9])
+
+def iter_movies_with_versions(batch_size=DEFAULT_BATCH_SIZE, user_id=None):
+    """
+    Stream all movies in the order of their ids together with their ids and versions.
+    :param batch_size: number of rows fetched from the cursor at once.
+    :param user_id: id of the user whose collection is streamed, None for all movies.
+    :return: Generator of tuples (movie id, movie version, Movie).
+    """
+    with _connect() as connection:
+        result = connection.execute(text(f"""
+            SELECT id, version, title, year, rating, poster_url, poster_path
+            FROM {_get_movies_table(user_id)} ORDER BY id
+        """), {"user_id": user_id})
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            instrumentation.increment("storage.rows_fetched", len(rows))
+            for row in rows:
+                yield row[0], row[1], Movie(*row[2:])
+
+def list_poster_sources():
+    """
+    List the movies which have a poster URL, with the state of their downloaded posters.
+    :return: List of tuples (movie id, poster URL, poster path, ETag, Last-Modified),
+    the last three are None if the poster was not downloaded yet.
+    """
+    with _connect() as connection:
+        result = connection.execute(text("""
+            SELECT id, poster_url, poster_path, poster_etag, poster_last_modified
+            FROM movies
+            WHERE poster_url LIKE 'http%'
+        """))
+        return [tuple(row) for row in result.fetchall()]
+
+def save_poster_paths(posters):
+    """
+    Store the local paths and the cache validators of downloaded posters in a single transaction.
+    The version of a movie is increased if its poster path changed.
+    :param posters: list of tuples (movie id, poster path, ETag, Last-Modified)
+    """
+    if not posters:
+        return
+    with transaction() as connection:
+        connection.execute(text("""
+            UPDATE movies SET
+                version = version + (poster_path IS NOT :poster_path),
+                poster_path = :poster_path,
+                poster_etag = :poster_etag,
+                poster_last_modified = :poster_last_modified
+            WHERE id = :movie_id
+        """), [{"movie_id": movie_id,
+                "poster_path": poster_path,
+                "poster_etag": poster_etag,
+                "poster_last_modified": poster_last_modified}
+               for movie_id, poster_path, poster_etag, poster_last_modified in posters])
+
+def save_html_fragments(fragments):
+    """
+    Store rendered HTML fragments of the movies in a single transaction.
+    :param fragments: list of tuples (movie id, movie version, format version, static prefix,
+    content hash, fragment)
+    """
+    if not fragments:
+        return
+    with transaction() as connection:
+        connection.execute(text("""
+            INSERT INTO movie_html_fragments
+                (movie_id, movie_version, format_version, static_prefix, content_hash, fragment)
+            VALUES (:movie_id, :movie_version, :format_version, :static_prefix, :content_hash, :fragment)
+            ON CONFLICT (movie_id) DO UPDATE SET
+                movie_version = excluded.movie_version,
+                format_version = excluded.format_version,
+                static_prefix = excluded.static_prefix,
+                content_hash = excluded.content_hash,
+                fragment = excluded.fragment
+        """), [{"movie_id": movie_id,
+                "movie_version": movie_version,
+                "format_version": format_version,
+                "static_prefix": static_prefix,
+                "content_hash": content_hash,
+                "fragment": fragment}
+               for movie_id, movie_version, format_version, static_prefix, content_hash, fragment
+               in fragments])
+
+@instrumentation.timed("storage.rating_stats")
+def rating_stats(user_id=None):
+    """
+    Calculate the rating statistics in the database.
+    Count, mean, the best and the worst movie are read from the summary table,
+    the percentiles are read from the rating index.
+    For a user they are aggregated in the rating index of the collection of the user.
+    :param user_id: id of the user whose ratings are evaluated, None for all movies.
+    :return: RatingStats or None if the database has no movies.
+    """
+    with _connect() as connection:
+        if user_id is None:
+            summary = connection.execute(text("""
+                SELECT summary.movie_count, summary.rating_sum,
+                       best.title, best.rating,
+                       worst.title, worst.rating
+                FROM movie_summary AS summary
+                LEFT JOIN movies AS best ON best.id = summary.best_movie_id
+                LEFT JOIN movies AS worst ON worst.id = summary.worst_movie_id
+                WHERE summary.id = 1
+            """)).one()
+        else:
+            summary = _select_user_summary(connection, user_id)
+        count, rating_sum, best_title, max_rating, worst_title, min_rating = summary
+        if count == 0:
+            return None
+
+        percentiles = {percent: _rating_percentile(connection, count, percent, user_id)
+                       for percent in STATS_PERCENTILES}
+
+    return RatingStats(count=count,
+                       mean=rating_sum / count,
+                       min_rating=min_rating,
+                       max_rating=max_rating,
+                       best_title=best_title,
+                       worst_title=worst_title,
+                       median=percentiles[50],
+                       percentiles=percentiles)
+
+def _select_user_summary(connection, user_id):
+    """
+    Aggregate the ratings of the collection of a user like the summary table,
+    ties of the best and the worst movie are resolved by the order of the movie ids.
+    :param connection: open database connection
+    :param user_id: id of the user
+    :return: Tuple (count, rating sum, best title, max rating, worst title, min rating).
+    """
+    movies_table = _get_movies_table(user_id)
+    # the aggregates only read the rating index, the titles are joined for the two movies
+    return connection.execute(text(f"""
+        SELECT COUNT(*), COALESCE(SUM(rating), 0),
+               (SELECT title FROM {movies_table}
+                WHERE rating = (SELECT MAX(rating) FROM {movies_table}) ORDER BY id ASC LIMIT 1),
+               MAX(rating),
+               (SELECT title FROM {movies_table}
+                WHERE rating = (SELECT MIN(rating) FROM {movies_table}) ORDER BY id DESC LIMIT 1),
+               MIN(rating)
+        FROM user_movies
+        WHERE user_id = :user_id
+    """), {"user_id": user_id}).one()
+
+@instrumentation.timed("storage.year_stats")
+def year_stats(user_id=None):
+    """
+    Read the amount of movies and the average rating per year from the summary table.
+    The collection of a user is grouped by year in the query.
+    :param user_id: id of the user whose ratings are evaluated, None for all movies.
+    :return: List of YearStats sorted by year.
+    """
+    with _connect() as connection:
+        if user_id is None:
+            result = connection.execute(text("""
+                SELECT year, movie_count, rating_sum / movie_count
+                FROM movie_year_stats
+                ORDER BY year
+            """))
+        else:
+            result = connection.execute(text(f"""
+                SELECT year, COUNT(*), AVG(rating)
+                FROM {_get_movies_table(user_id)}
+                GROUP BY year
+                ORDER BY year
+            """), {"user_id": user_id})
+        return [YearStats(*row) for row in result.fetchall()]
+
+@instrumentation.timed("storage.rating_histogram")
+def rating_histogram(user_id=None):
+    """
+    Read the amount of movies per rating from the summary table.
+    The ratings are rounded to one decimal place.
+    :param user_id: id of the user whose ratings are counted, None for all movies.
+    :return: List of tuples (rating, amount of movies) sorted by rating.
+    """
+    with _connect() as connection:
+        if user_id is None:
+            result = connection.execute(text("""
+                SELECT bucket, movie_count FROM movie_rating_buckets ORDER BY bucket
+            """))
+        else:
+            result = connection.execute(text("""
+                SELECT CAST(ROUND(rating * 10) AS INTEGER) AS bucket, COUNT(*)
+                FROM user_movies
+                WHERE user_id = :user_id
+                GROUP BY bucket
+                ORDER BY bucket
+            """), {"user_id": user_id})
+        return [(bucket / 10, movie_count) for bucket, movie_count in result.fetchall()]
+
+def _rating_percentile(connection, count, percent, user_id=None):
+    """
+    Calculate a percentile of the ratings with linear interpolation between the closest ranks.
+    Only the two neighbouring ratings are read from the rating index.
+    :param connection: open database connection
+    :param count: amount of movies in the database
+    :param percent: percentile in the range 0 ... 100
+    :param user_id: id of the user whose ratings are evaluated, None for all movies.
+    :return: Rating at the given percentile.
+    """
+    position = (count - 1) * percent / 100
+    lower_rank = int(position)
+    if user_id is None:
+        ratings = connection.execute(text("""
+            SELECT rating FROM movies ORDER BY rating LIMIT 2 OFFSET :offset
+        """), {"offset": lower_rank}).scalars().all()
+    else:
+        ratings = connection.execute(text("""
+            SELECT rating FROM user_movies WHERE user_id = :user_id
+            ORDER BY rating LIMIT 2 OFFSET :offset
+        """), {"user_id": user_id, "offset": lower_rank}).scalars().all()
+
+    if len(ratings) == 1:
+        return ratings[0]
+    fraction = position - lower_rank
+    return ratings[0] + (ratings[1] - ratings[0]) * fraction
+
+@instrumentation.timed("storage.get_movie_by_title")
+def get_movie_by_title(title, ignore_case=False, user_id=None):
+    """
+    Retrieve a single movie by its title using the title index.
+    :param title: title of the movie
+    :param ignore_case: if True, the title is compared case-insensitively.
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Movie as dictionary or None if the movie is not in the database.
+    """
+    with _connect() as connection:
+        movie = _select_movie_by_title(connection, title, ignore_case, user_id)
+
+    if movie is None:
+        return None
+    return movie._asdict()
+
+def _select_movie_by_title(connection, title, ignore_case=False, user_id=None):
+    """
+    Select a single movie by its title on an open connection.
+    :param connection: open database connection
+    :param title: title of the movie
+    :param ignore_case: if True, the title is compared case-insensitively.
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Movie record or None if the movie is not in the database.
+    """
+    collation = "COLLATE NOCASE" if ignore_case else ""
+    result = connection.execute(text(f"""SELECT 
+                                             title, 
+                                             year, 
+                                             rating, 
+                                             poster_url, 
+                                             poster_path 
+                                         FROM {_get_movies_table(user_id)}
+                                         WHERE title = :title {collation}
+                                         LIMIT 1"""),
+                                {"title": title, "user_id": user_id})
+    row = result.fetchone()
+    return None if row is None else Movie(*row)
+
+def movie_exists(title, ignore_case=False, user_id=None):
+    """
+    Check if a movie with the given title is in the database.
+    :param title: title of the movie
+    :param ignore_case: if True, the title is compared case-insensitively.
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: True if the movie exists, otherwise False.
+    """
+    collation = "COLLATE NOCASE" if ignore_case else ""
+    with _connect() as connection:
+        result = connection.execute(text(f"""SELECT 1 
+                                             FROM {_get_movies_table(user_id)}
+                                             WHERE title = :title {collation}
+                                             LIMIT 1"""),
+                                    {"title": title, "user_id": user_id})
+        return result.fetchone() is not None
+
+def add_write_listener(listener):
+    """
+    Register a callable which is notified after each successful write to the movies table.
+    It is used to keep in-memory structures in sync with the database.
+    Writes inside a transaction are notified after its commit, rolled back writes are not notified.
+    :param listener: callable with the arguments (event, movie),
+    where event is "add", "delete" or "update" and movie is the affected Movie record.
+    """
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+def _notify_write_listeners(event, movie):
+    """
+    Notify the registered write listeners about a write.
+    Inside a transaction the notification is buffered until the commit.
+    :param event: "add", "delete" or "update"
+    :param movie: affected Movie record
+    """
+    pending_notifications = getattr(_transaction_state, "pending_notifications", None)
+    if pending_notifications is not None:
+        pending_notifications.append((event, movie))
+        return
+    for listener in _write_listeners:
+        listener(event, movie)
+
+@contextmanager
+def _connect():
+    """
+    Connection for a read. Inside a transaction it is the connection of the transaction,
+    so that the read sees the uncommitted writes and does not return the shared connection
+    of an in-memory database in the middle of the transaction.
+    :return: Context manager which yields the connection.
+    """
+    connection = getattr(_transaction_state, "connection", None)
+    if connection is not None:
+        yield connection
+        return
     with engine.connect() as connection:
-        result = connection.execute(text("""SELECT 
-                                                title, 
-                                                year, 
-                                                rating, 
-                                                poster_url 
-                                            FROM movies"""))
-        movies = result.fetchall()
-
-    return [{"title": row[0],
-             "year": row[1],
-             "rating": row[2],
-             "poster_url": row[3]} for row in movies]
-
-def add_movie(title, year, rating, poster_url):
-    """Add a new movie to the database."""
+        yield connection
+
+@contextmanager
+def transaction():
+    """
+    Unit of work: the writes inside share one connection and are committed together.
+    An exception rolls all of them back. Nested transactions join the outer one,
+    which commits at its end.
+
+        with storage.transaction():
+            storage.delete_movies(old_titles)
+            storage.add_movies(new_movies)
+
+    :return: Context manager which yields the open connection.
+    """
+    connection = getattr(_transaction_state, "connection", None)
+    if connection is not None:
+        yield connection
+        return
+
+    pending_notifications = []
     with engine.connect() as connection:
+        # the write lock is taken at the start, so that checks like the one of add_movies
+        # can not be overtaken by a write of another process before the transaction writes
+        connection.execution_options(**{TRANSACTION_MODE_OPTION: "IMMEDIATE"})
+        _transaction_state.connection = connection
+        _transaction_state.pending_notifications = pending_notifications
         try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            _transaction_state.connection = None
+            _transaction_state.pending_notifications = None
+
+    for write_event, movie in pending_notifications:
+        _notify_write_listeners(write_event, movie)
+
+def add_movie(title, year, rating, poster_url, user_id=None):
+    """Add a new movie to the database, or to the collection of a user."""
+    try:
+        with transaction() as connection:
+            if user_id is not None:
+                result, = _add_user_movies(connection, user_id, [Movie(title, year, rating, poster_url)])
+                if result.status == EXISTS:
+                    print(f"Movie '{title}' is already in the collection.")
+                    return
+            else:
+                query = """INSERT INTO movies (title, year, rating, poster_url) 
+                           VALUES (:title, :year, :rating, :poster_url)"""
+                connection.execute(text(query),
+                {"title": title, "year": year, "rating": rating, "poster_url": poster_url})
+                _notify_write_listeners("add", Movie(title, year, rating, poster_url))
+        print(f"Movie '{title}' added successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+
+@instrumentation.timed("storage.add_movies")
+def add_movies(movies, user_id=None, user_ratings=None):
+    """
+    Add many movies to the database with executemany in a single transaction.
+    Movies whose titles are already in the database (ignoring the letter case)
+    or repeated in the input are skipped.
+    In the scope of a user the movies are added to the collection of the user,
+    the shared data is only added for movies which are not in the database yet.
+    The shared data always gets the rating of the given movies, e.g. the one of OMDb,
+    the ratings of the user are only stored in the collection.
+    :param movies: iterable of Movie records or tuples (title, year, rating, poster_url)
+    :param user_id: id of the user, None for the shared movies
+    :param user_ratings: dictionary title -> rating of the user, the movies without an entry
+    start with the rating of the given movie
+    :return: List of WriteResult records in the order of the input,
+    with the status ADDED, EXISTS or DUPLICATE.
+    :raise ValueError: if there is no user with the id.
+    """
+    movies = [Movie(*movie) for movie in movies]
+    if user_id is not None:
+        with transaction() as connection:
+            return _add_user_movies(connection, user_id, movies, user_ratings)
+    results = []
+    added_movies = []
+    with transaction() as connection:
+        existing_titles = _find_existing_titles(connection, [movie.title for movie in movies])
+        seen_titles = set()
+        for movie in movies:
+            lower_title = movie.title.lower()
+            if lower_title in existing_titles:
+                results.append(WriteResult(movie.title, EXISTS))
+            elif lower_title in seen_titles:
+                results.append(WriteResult(movie.title, DUPLICATE))
+            else:
+                seen_titles.add(lower_title)
+                added_movies.append(movie)
+                results.append(WriteResult(movie.title, ADDED, movie))
+
+        if added_movies:
             query = """INSERT INTO movies (title, year, rating, poster_url) 
                        VALUES (:title, :year, :rating, :poster_url)"""
-            connection.execute(text(query),
-            {"title": title, "year": year, "rating": rating, "poster_url": poster_url})
-            connection.commit()
-            print(f"Movie '{title}' added successfully.")
-        except Exception as e:
-            print(f"Error: {e}")
+            # a list of parameter sets is executed with executemany
+            connection.execute(text(query), [movie._asdict() for movie in added_movies])
+        for movie in added_movies:
+            _notify_write_listeners("add", movie)
+    return results
 
-def delete_movie(title):
-    """Delete a movie from the database."""
-    with engine.connect() as connection:
-        try:
-            query = """DELETE FROM movies
-                        WHERE title = :title"""
-            connection.execute(text(query),
-                               {"title": title})
-            connection.commit()
-            print(f"Movie '{title}' deleted successfully.")
-        except Exception as e:
-            print(f"Error: {e}")
+@instrumentation.timed("storage.upsert_movies")
+def upsert_movies(movies, user_id=None, user_ratings=None):
+    """
+    Add new movies and update the year, rating and poster URL of existing movies
+    in a single transaction. An existing movie is matched ignoring the letter case
+    and keeps its stored title. Its version is only increased if the data changed.
+    In the scope of a user only the ratings of the user are updated, see add_movies.
+    :param movies: iterable of Movie records or tuples (title, year, rating, poster_url)
+    :param user_id: id of the user, None for the shared movies
+    :param user_ratings: dictionary title -> rating of the user, see add_movies
+    :return: List of WriteResult records in the order of the input,
+    with the status ADDED, UPDATED or UNCHANGED.
+    :raise ValueError: if there is no user with the id.
+    """
+    movies = [Movie(*movie) for movie in movies]
+    if user_id is not None:
+        with transaction() as connection:
+            return _upsert_user_movies(connection, user_id, movies, user_ratings)
+    results = []
+    written_movies = {}
+    with transaction() as connection:
+        stored_movies = _select_movies_by_titles(connection, [movie.title for movie in movies])
+        for movie in movies:
+            stored_movie = stored_movies.get(movie.title.lower())
+            if stored_movie is None:
+                status = ADDED
+            else:
+                movie = movie._replace(title=stored_movie.title, poster_path=stored_movie.poster_path)
+                status = UNCHANGED if movie == stored_movie else UPDATED
+            results.append(WriteResult(movie.title, status, movie))
+            stored_movies[movie.title.lower()] = movie
+            if status != UNCHANGED:
+                # a title repeated in the input is written once with its last data
+                written_movies[movie.title.lower()] = (status, movie)
 
-def update_movie(title, rating):
-    """Update a movie's rating in the database."""
-    with engine.connect() as connection:
-        try:
+        if written_movies:
+            query = """INSERT INTO movies (title, year, rating, poster_url)
+                       VALUES (:title, :year, :rating, :poster_url)
+                       ON CONFLICT (title) DO UPDATE SET
+                           year = excluded.year,
+                           rating = excluded.rating,
+                           poster_url = excluded.poster_url,
+                           version = movies.version + 1"""
+            connection.execute(text(query), [movie._asdict() for _, movie in written_movies.values()])
+        for status, movie in written_movies.values():
+            _notify_write_listeners("add" if status == ADDED else "update", movie)
+    return results
+
+def _add_shared_movies(connection, movies):
+    """
+    Add the shared data of the movies which are not in the database yet, ignoring the letter case.
+    :param connection: open database connection
+    :param movies: list of Movie records
+    :return: Dictionary lower case title -> stored Movie record of all given movies.
+    """
+    shared_movies = _select_movies_by_titles(connection, [movie.title for movie in movies])
+    added_movies = {}
+    for movie in movies:
+        lower_title = movie.title.lower()
+        if lower_title not in shared_movies and lower_title not in added_movies:
+            added_movies[lower_title] = movie
+    if added_movies:
+        query = """INSERT INTO movies (title, year, rating, poster_url) 
+                   VALUES (:title, :year, :rating, :poster_url)"""
+        connection.execute(text(query), [movie._asdict() for movie in added_movies.values()])
+        for movie in added_movies.values():
+            _notify_write_listeners("add", movie)
+    return {**shared_movies, **added_movies}
+
+def _add_user_movies(connection, user_id, movies, user_ratings=None):
+    """
+    Add movies to the collection of a user on an open connection, see add_movies.
+    :param connection: open database connection
+    :param user_id: id of the user
+    :param movies: list of Movie records with the shared data
+    :param user_ratings: dictionary title -> rating of the user or None
+    :return: List of WriteResult records in the order of the input.
+    """
+    _check_user(connection, user_id)
+    user_ratings = user_ratings or {}
+    results = []
+    added_movies = {}
+    existing_titles = _find_existing_titles(connection, [movie.title for movie in movies], user_id)
+    for movie in movies:
+        lower_title = movie.title.lower()
+        if lower_title in existing_titles:
+            results.append(WriteResult(movie.title, EXISTS))
+        elif lower_title in added_movies:
+            results.append(WriteResult(movie.title, DUPLICATE))
+        else:
+            added_movies[lower_title] = movie
+            results.append(WriteResult(movie.title, ADDED, movie))
+
+    if added_movies:
+        shared_movies = _add_shared_movies(connection, list(added_movies.values()))
+        for lower_title, movie in added_movies.items():
+            # the collection shows the shared data with the rating of the user
+            added_movies[lower_title] = shared_movies[lower_title]._replace(
+                rating=user_ratings.get(movie.title, movie.rating))
+        query = """INSERT INTO user_movies (user_id, movie_id, rating)
+                   SELECT :user_id, id, :rating FROM movies WHERE title = :title"""
+        connection.execute(text(query), [{"user_id": user_id, "title": movie.title, "rating": movie.rating}
+                                         for movie in added_movies.values()])
+    return [WriteResult(result.title, result.status, added_movies[result.title.lower()])
+            if result.status == ADDED else result for result in results]
+
+def _upsert_user_movies(connection, user_id, movies, user_ratings=None):
+    """
+    Add movies to the collection of a user or update the ratings of the user on an open connection,
+    see upsert_movies.
+    :param connection: open database connection
+    :param user_id: id of the user
+    :param movies: list of Movie records with the shared data
+    :param user_ratings: dictionary title -> rating of the user or None
+    :return: List of WriteResult records in the order of the input.
+    """
+    _check_user(connection, user_id)
+    user_ratings = user_ratings or {}
+    shared_movies = _add_shared_movies(connection, movies)
+    stored_movies = _select_movies_by_titles(connection, [movie.title for movie in movies], user_id)
+    results = []
+    written_movies = {}
+    for movie in movies:
+        lower_title = movie.title.lower()
+        stored_movie = stored_movies.get(lower_title)
+        new_movie = shared_movies[lower_title]._replace(rating=user_ratings.get(movie.title, movie.rating))
+        if stored_movie is None:
+            status = ADDED
+        else:
+            status = UNCHANGED if new_movie == stored_movie else UPDATED
+        results.append(WriteResult(new_movie.title, status, new_movie))
+        stored_movies[lower_title] = new_movie
+        if status != UNCHANGED:
+            written_movies[lower_title] = new_movie
+
+    if written_movies:
+        query = """INSERT INTO user_movies (user_id, movie_id, rating)
+                   SELECT :user_id, id, :rating FROM movies WHERE title = :title
+                   ON CONFLICT (user_id, movie_id) DO UPDATE SET
+                       rating = excluded.rating,
+                       version = user_movies.version + 1"""
+        connection.execute(text(query), [{"user_id": user_id, "title": movie.title, "rating": movie.rating}
+                                         for movie in written_movies.values()])
+    return results
+
+def find_existing_titles(titles, user_id=None):
+    """
+    Find which of the given titles are in the database, ignoring the letter case.
+    :param titles: iterable of titles
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Set of the lower case titles which are in the database.
+    """
+    with _connect() as connection:
+        return _find_existing_titles(connection, list(titles), user_id)
+
+def get_movies_by_titles(titles, user_id=None):
+    """
+    Retrieve the movies with the given titles, ignoring the letter case.
+    :param titles: iterable of titles
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Dictionary lower case title -> Movie record of the titles which are in the database.
+    """
+    with _connect() as connection:
+        return _select_movies_by_titles(connection, list(titles), user_id)
+
+def _find_existing_titles(connection, titles, user_id=None):
+    """
+    Find which of the given titles are in the database on an open connection.
+    :param connection: open database connection
+    :param titles: list of titles
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Set of the lower case titles which are in the database.
+    """
+    return set(_select_movies_by_titles(connection, titles, user_id))
+
+def _select_movies_by_titles(connection, titles, user_id=None):
+    """
+    Select the movies with the given titles on an open connection, ignoring the letter case.
+    :param connection: open database connection
+    :param titles: list of titles
+    :param user_id: id of the user whose collection is searched, None for all movies.
+    :return: Dictionary lower case title -> Movie record.
+    """
+    movies = {}
+    # stay below the limit of bound parameters per statement
+    for start in range(0, len(titles), DEFAULT_BATCH_SIZE):
+        chunk = titles[start:start + DEFAULT_BATCH_SIZE]
+        parameters = {f"title_{i}": title for i, title in enumerate(chunk)}
+        placeholders = ", ".join(f":{name}" for name in parameters)
+        result = connection.execute(text(f"""
+            SELECT title, year, rating, poster_url, poster_path
+            FROM {_get_movies_table(user_id)} WHERE title COLLATE NOCASE IN ({placeholders})
+        """), {**parameters, "user_id": user_id})
+        movies.update((row[0].lower(), Movie(*row)) for row in result)
+    return movies
+
+def delete_movie(title, user_id=None):
+    """Delete a movie from the database, or only from the collection of a user."""
+    try:
+        with transaction() as connection:
+            if user_id is not None:
+                _delete_user_movies(connection, user_id, [title])
+            else:
+                deleted_movie = _select_movie_by_title(connection, title)
+                query = """DELETE FROM movies
+                            WHERE title = :title"""
+                connection.execute(text(query),
+                                   {"title": title})
+                if deleted_movie is not None:
+                    _notify_write_listeners("delete", deleted_movie)
+        print(f"Movie '{title}' deleted successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+
+@instrumentation.timed("storage.delete_movies")
+def delete_movies(titles, user_id=None):
+    """
+    Delete many movies with executemany in a single transaction.
+    The titles have to match exactly, like in delete_movie.
+    In the scope of a user the movies are only removed from the collection of the user.
+    :param titles: iterable of titles
+    :param user_id: id of the user, None for the shared movies
+    :return: List of WriteResult records in the order of the input,
+    with the status DELETED or NOT_FOUND.
+    :raise ValueError: if there is no user with the id.
+    """
+    titles = list(titles)
+    if user_id is not None:
+        with transaction() as connection:
+            return _delete_user_movies(connection, user_id, titles)
+    results = []
+    deleted_movies = {}
+    with transaction() as connection:
+        stored_movies = _select_movies_by_titles(connection, titles)
+        for title in titles:
+            stored_movie = stored_movies.get(title.lower())
+            if stored_movie is None or stored_movie.title != title or title in deleted_movies:
+                results.append(WriteResult(title, NOT_FOUND))
+            else:
+                deleted_movies[title] = stored_movie
+                results.append(WriteResult(title, DELETED, stored_movie))
+
+        if deleted_movies:
+            connection.execute(text("DELETE FROM movies WHERE title = :title"),
+                               [{"title": title} for title in deleted_movies])
+        for movie in deleted_movies.values():
+            _notify_write_listeners("delete", movie)
+    return results
+
+def _delete_user_movies(connection, user_id, titles):
+    """
+    Remove movies from the collection of a user on an open connection, see delete_movies.
+    :param connection: open database connection
+    :param user_id: id of the user
+    :param titles: list of titles
+    :return: List of WriteResult records in the order of the input.
+    """
+    _check_user(connection, user_id)
+    results = []
+    deleted_movies = {}
+    stored_movies = _select_movies_by_titles(connection, titles, user_id)
+    for title in titles:
+        stored_movie = stored_movies.get(title.lower())
+        if stored_movie is None or stored_movie.title != title or title in deleted_movies:
+            results.append(WriteResult(title, NOT_FOUND))
+        else:
+            deleted_movies[title] = stored_movie
+            results.append(WriteResult(title, DELETED, stored_movie))
+
+    if deleted_movies:
+        query = """DELETE FROM user_movies
+                   WHERE user_id = :user_id
+                   AND movie_id = (SELECT id FROM movies WHERE title = :title)"""
+        connection.execute(text(query), [{"user_id": user_id, "title": title} for title in deleted_movies])
+    return results
+
+def update_movie(title, rating, user_id=None):
+    """Update a movie's rating in the database, or the rating of a user."""
+    try:
+        with transaction() as connection:
+            if user_id is not None:
+                _update_ratings(connection, [(title, rating)], user_id)
+            else:
+                query = """UPDATE movies
+                SET
+                    rating = :rating,
+                    version = version + 1
+                WHERE movies.title = :title"""
+                connection.execute(text(query),
+                                   {"title": title, "rating": rating})
+                updated_movie = _select_movie_by_title(connection, title)
+                if updated_movie is not None:
+                    _notify_write_listeners("update", updated_movie)
+        print(f"Movie '{title}' updated successfully.")
+    except Exception as e:
+        print(f"Error: {e}")
+
+@instrumentation.timed("storage.update_ratings")
+def update_ratings(ratings, user_id=None):
+    """
+    Update the ratings of many movies with executemany in a single transaction,
+    e.g. for a re-sync of the ratings with OMDb. The version of each updated movie is increased.
+    The titles have to match exactly, like in update_movie.
+    :param ratings: iterable of tuples (title, rating) or a dictionary title -> rating
+    :param user_id: id of the user whose ratings are updated, None for the shared ratings
+    :return: List of WriteResult records in the order of the input,
+    with the status UPDATED or NOT_FOUND.
+    :raise ValueError: if there is no user with the id.
+    """
+    with transaction() as connection:
+        results = _update_ratings(connection, ratings, user_id)
+        # the listeners keep the shared data up to date, the ratings of the users are not part of it
+        if user_id is None:
+            for result in results:
+                if result.status == UPDATED:
+                    _notify_write_listeners("update", result.movie)
+    return results
+
+def _update_ratings(connection, ratings, user_id=None):
+    """
+    Update the ratings of many movies on an open connection without notifying the listeners.
+    It is shared with movie_storage_async.
+    :param connection: open database connection
+    :param ratings: iterable of tuples (title, rating) or a dictionary title -> rating
+    :param user_id: id of the user whose ratings are updated, None for the shared ratings
+    :return: List of WriteResult records in the order of the input.
+    """
+    ratings = list(ratings.items() if isinstance(ratings, dict) else ratings)
+    if user_id is not None:
+        _check_user(connection, user_id)
+    results = []
+    updated_movies = {}
+    stored_movies = _select_movies_by_titles(connection, [title for title, _ in ratings], user_id)
+    for title, rating in ratings:
+        stored_movie = stored_movies.get(title.lower())
+        if stored_movie is None or stored_movie.title != title:
+            results.append(WriteResult(title, NOT_FOUND))
+        else:
+            updated_movies[title] = stored_movie._replace(rating=rating)
+            results.append(WriteResult(title, UPDATED, updated_movies[title]))
+
+    if updated_movies:
+        if user_id is None:
             query = """UPDATE movies
-            SET 
-                rating = :rating
-            WHERE movies.title = :title"""
-            connection.execute(text(query),
-                               {"title": title, "rating": rating})
-            connection.commit()
-            print(f"Movie '{title}' updated successfully.")
-        except Exception as e:
-            print(f"Error: {e}")
+                       SET rating = :rating, version = version + 1
+                       WHERE title = :title"""
+        else:
+            query = """UPDATE user_movies
+                       SET rating = :rating, version = version + 1
+                       WHERE user_id = :user_id
+                       AND movie_id = (SELECT id FROM movies WHERE title = :title)"""
+        connection.execute(text(query), [{"title": movie.title, "rating": movie.rating, "user_id": user_id}
+                                         for movie in updated_movies.values()])
+    return results
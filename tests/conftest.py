@@ -0,0 +1,28 @@
+import pytest
+from movie_storage import movie_storage_sql as storage
+
+
+@pytest.fixture(params=[":memory:", "file"])
+def database(request, tmp_path):
+    """
+    Storage configured with an empty in-memory database or an empty database file.
+    :return: Path of the database.
+    """
+    db_path = request.param if request.param == ":memory:" else str(tmp_path / "movies.db")
+    storage.configure_database(db_path)
+    storage.connect_to_sql_db()
+    yield db_path
+    storage.configure_database(storage.DB_PATH)
+
+
+@pytest.fixture
+def file_database(tmp_path):
+    """
+    Storage configured with an empty database file.
+    :return: Path of the database file.
+    """
+    db_path = str(tmp_path / "movies.db")
+    storage.configure_database(db_path)
+    storage.connect_to_sql_db()
+    yield db_path
+    storage.configure_database(storage.DB_PATH)
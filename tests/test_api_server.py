@@ -0,0 +1,59 @@
+import asyncio
+import json
+import sqlite3
+import pytest
+from movie_server import api_server
+from movie_search import search_index
+from movie_storage import movie_storage_sql as storage
+
+
+@pytest.fixture
+def server(file_database, monkeypatch):
+    """
+    API server state on an empty database file, the data version is polled on every request.
+    """
+    monkeypatch.setattr(api_server, "DATA_VERSION_POLL_SECONDS", 0)
+    monkeypatch.setattr(api_server, "_data_version", None)
+    monkeypatch.setattr(api_server, "_next_data_version_poll", 0.0)
+    api_server.invalidate_response_cache()
+    search_index.invalidate_index()
+    yield api_server
+    api_server.invalidate_response_cache()
+    search_index.invalidate_index()
+
+
+def get_json(server, target):
+    status, _, body = asyncio.run(server.get_response(target))
+    assert status == 200
+    return json.loads(body)
+
+
+def add_movie_in_another_process(db_path, title, year, rating):
+    """
+    Writes with an own connection, like the menu or the CLI in another process.
+    The write listeners of the storage module are not called.
+    """
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute("INSERT INTO movies (title, year, rating, poster_url) VALUES (?, ?, ?, '')",
+                           (title, year, rating))
+    connection.close()
+
+
+def test_writes_of_another_process_reach_the_cache_and_the_search_index(server, file_database):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+    assert get_json(server, "/search?q=Jawz")["similar_titles"] == []
+    assert get_json(server, "/stats")["ratings"]["count"] == 1
+
+    add_movie_in_another_process(file_database, "Jaws", 1975, 8.1)
+
+    similar_titles = get_json(server, "/search?q=Jawz")["similar_titles"]
+    assert [suggestion["title"] for suggestion in similar_titles] == ["Jaws"]
+    assert get_json(server, "/stats")["ratings"]["count"] == 2
+
+
+def test_responses_are_cached_while_the_data_version_is_unchanged(server, file_database):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+    first = asyncio.run(server.get_response("/movies"))
+    assert "/movies" in server._response_cache
+    assert asyncio.run(server.get_response("/movies")) == first
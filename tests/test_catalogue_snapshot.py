@@ -0,0 +1,60 @@
+import os
+import pytest
+import main
+from movie_analytics import catalogue_snapshot
+from movie_storage import movie_storage_sql as storage
+
+
+def test_valid_snapshot_of_an_empty_catalogue_is_not_written_again(file_database, monkeypatch):
+    snapshot = catalogue_snapshot.write_snapshot()
+    assert snapshot is not None and len(snapshot) == 0
+
+    def fail_write():
+        pytest.fail("the valid snapshot was written again")
+
+    monkeypatch.setattr(catalogue_snapshot, "write_snapshot", fail_write)
+    refreshed_snapshot = catalogue_snapshot.refresh_snapshot()
+    assert refreshed_snapshot is not None
+    assert refreshed_snapshot.data_version == snapshot.data_version
+    assert refreshed_snapshot.random_movie() is None
+    assert refreshed_snapshot.rating_stats() is None
+
+
+def test_snapshot_is_written_again_after_a_write(file_database):
+    catalogue_snapshot.write_snapshot()
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+
+    snapshot = catalogue_snapshot.refresh_snapshot()
+    assert [movie.title for movie in snapshot.query_movies()] == ["Alien"]
+
+
+@pytest.mark.parametrize("snapshot_enabled", [True, False])
+def test_random_movie_of_an_empty_catalogue(file_database, monkeypatch, capsys, snapshot_enabled):
+    monkeypatch.setattr(catalogue_snapshot, "SNAPSHOT_ENABLED", snapshot_enabled)
+    main.generate_random_movie()
+    assert "No movies in the database." in capsys.readouterr().out
+
+
+def test_snapshot_keeps_the_downloaded_poster_path(file_database):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg"), ("Heat", 1995, 8.3, "heat.jpg")])
+    catalogue_snapshot.write_snapshot()
+    movie_ids = {movie.title: movie_id for movie_id, _, movie in storage.iter_movies_with_versions()}
+    data_version = storage.get_data_version()
+    storage.save_poster_paths([(movie_ids["Alien"], "abc.jpg", None, None)])
+    assert storage.get_data_version() != data_version
+
+    snapshot = catalogue_snapshot.refresh_snapshot()
+    assert [(movie.title, movie.poster_path) for movie in snapshot.query_movies()] == [
+        ("Alien", "abc.jpg"), ("Heat", None)]
+
+
+def test_failed_snapshot_write_removes_its_temporary_file(file_database, monkeypatch, tmp_path):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+
+    def fail_replace(source, destination):
+        raise OSError("disk is full")
+
+    monkeypatch.setattr(catalogue_snapshot.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        catalogue_snapshot.write_snapshot()
+    assert not [file_name for file_name in os.listdir(tmp_path) if file_name.endswith(".tmp")]
@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+import os
+import re
+from movie_cli import cli
+from movie_storage import movie_storage_sql as storage
+
+
+def add_movies_with_poster():
+    storage.add_movies([("Alien", 1979, 8.5, "https://posters.example/alien.jpg"),
+                        ("Heat", 1995, 8.3, "https://posters.example/heat.jpg")])
+    movie_ids = {movie.title: movie_id for movie_id, _, movie in storage.iter_movies_with_versions()}
+    storage.save_poster_paths([(movie_ids["Alien"], "alien.jpg", None, None)])
+
+
+def test_list_writes_the_poster_path_as_json_lines(file_database, capsys):
+    add_movies_with_poster()
+
+    assert cli.main(["list", "--order-by", "title"]) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows == [
+        {"title": "Alien", "year": 1979, "rating": 8.5,
+         "poster_url": "https://posters.example/alien.jpg", "poster_path": "alien.jpg"},
+        {"title": "Heat", "year": 1995, "rating": 8.3,
+         "poster_url": "https://posters.example/heat.jpg", "poster_path": None}]
+
+
+def test_filter_writes_the_poster_path_as_csv(file_database, capsys):
+    add_movies_with_poster()
+
+    assert cli.main(["filter", "--min-rating", "8.4", "--format", "csv"]) == 0
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert [(row["title"], row["poster_path"]) for row in rows] == [("Alien", "alien.jpg")]
+
+
+def test_update_reports_the_status_per_title(file_database, capsys):
+    add_movies_with_poster()
+
+    assert cli.main(["update", "Alien", "9", "Missing", "5"]) == 1
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(row["title"], row["status"]) for row in rows] == [("Alien", "updated"), ("Missing", "not_found")]
+    assert storage.get_movie_by_title("Alien")["rating"] == 9.0
+
+
+def get_linked_files(file_name):
+    """
+    Paths of the stylesheet and the poster thumbnails linked by a website, relative to its folder.
+    """
+    with open(file_name, encoding="utf-8") as html_file:
+        content = html_file.read()
+    urls = re.findall(r'href="([^"]+\.css)"', content) + re.findall(r"src='([^']+-128\.jpg)'", content)
+    return [os.path.normpath(os.path.join(os.path.dirname(file_name), url)) for url in urls]
+
+
+def test_build_site_creates_the_output_folder_and_links_the_static_files(file_database, tmp_path, capsys):
+    add_movies_with_poster()
+    expected_files = [os.path.abspath(os.path.join("static", "style.css")),
+                      os.path.abspath(os.path.join("static", "posters", "thumbs", "alien-128.jpg"))]
+
+    # the cached fragments are rendered again for the other folder
+    for file_name in (tmp_path / "out" / "index.html", tmp_path / "index.html"):
+        assert cli.main(["build-site", "--output", str(file_name)]) == 0
+        assert get_linked_files(str(file_name)) == expected_files
+    capsys.readouterr()
@@ -0,0 +1,62 @@
+import os
+import re
+import pytest
+from movie_html import html_handler
+from movie_storage import movie_storage_sql as storage
+
+TEMPLATE_PARTS = html_handler.PLACEHOLDER_PATTERN.split("<ul>__TEMPLATE_MOVIE_GRID__</ul>")
+
+
+def test_concurrent_writers_use_own_temporary_files(tmp_path):
+    file_name = str(tmp_path / "index.html")
+
+    def first_grid():
+        yield "<li>first</li>"
+        # another build writes the same file while the first one is in the middle
+        html_handler.render_template_to_file(file_name, TEMPLATE_PARTS,
+                                             {"__TEMPLATE_MOVIE_GRID__": "<li>second</li>"})
+        yield "<li>first again</li>"
+
+    assert html_handler.render_template_to_file(file_name, TEMPLATE_PARTS,
+                                                {"__TEMPLATE_MOVIE_GRID__": first_grid()})
+    with open(file_name, encoding="utf-8") as html_file:
+        assert html_file.read() == "<ul><li>first</li><li>first again</li></ul>"
+    assert os.listdir(tmp_path) == ["index.html"]
+
+
+def test_failed_write_keeps_the_file_and_removes_the_temporary_file(tmp_path):
+    file_name = str(tmp_path / "index.html")
+    html_handler.render_template_to_file(file_name, TEMPLATE_PARTS, {"__TEMPLATE_MOVIE_GRID__": "old"})
+
+    def broken_grid():
+        yield "<li>new</li>"
+        raise RuntimeError("database is gone")
+
+    with pytest.raises(RuntimeError):
+        html_handler.render_template_to_file(file_name, TEMPLATE_PARTS,
+                                             {"__TEMPLATE_MOVIE_GRID__": broken_grid()})
+    with open(file_name, encoding="utf-8") as html_file:
+        assert html_file.read() == "<ul>old</ul>"
+    assert os.listdir(tmp_path) == ["index.html"]
+
+
+@pytest.mark.parametrize("output_folder", ["pages", os.path.join("site", "pages", "movies")])
+def test_paginated_website_links_the_static_files_from_its_output_folder(file_database, tmp_path,
+                                                                           output_folder):
+    storage.add_movies([("Alien", 1979, 8.5, "https://posters.example/alien.jpg"),
+                        ("Heat", 1995, 8.3, "https://posters.example/heat.jpg")])
+    movie_ids = {movie.title: movie_id for movie_id, _, movie in storage.iter_movies_with_versions()}
+    storage.save_poster_paths([(movie_ids["Alien"], "alien.jpg", None, None)])
+    output_folder = str(tmp_path / output_folder)
+
+    html_handler.build_paginated_website(output_folder, "Movies", movies_per_page=1, workers=1)
+
+    for file_name in ("index.html", "page-0001.html"):
+        with open(os.path.join(output_folder, file_name), encoding="utf-8") as html_file:
+            content = html_file.read()
+        stylesheet_url = re.search(r'<link rel="stylesheet" href="([^"]+)"', content).group(1)
+        assert (os.path.normpath(os.path.join(output_folder, stylesheet_url))
+                == os.path.abspath(os.path.join(html_handler.STATIC_FOLDER, "style.css")))
+    thumbnail_url = re.search(r"src='([^']+)'", content).group(1)
+    assert (os.path.normpath(os.path.join(output_folder, thumbnail_url))
+            == os.path.abspath(os.path.join(html_handler.THUMBNAIL_URL_FOLDER, "alien-128.jpg")))
@@ -0,0 +1,10 @@
+import subprocess
+import sys
+
+
+def test_menu_starts_without_the_chart_and_image_libraries():
+    # a fresh interpreter, the other tests may have imported the libraries already
+    output = subprocess.run([sys.executable, "-c", "import sys, main; "
+                             "print(sorted({'PIL', 'matplotlib'} & set(sys.modules)))"],
+                            capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
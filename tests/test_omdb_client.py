@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine
+from benchmarks.omdb_stub_server import start_stub_server
+from movie_api import api_communication as api
+from movie_api import response_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_database(tmp_path, monkeypatch):
+    """
+    Empty response cache, which also counts the requests of the quota.
+    """
+    db_path = tmp_path / "omdb_cache.db"
+    monkeypatch.setattr(response_cache, "cache_engine", create_engine(f"sqlite:///{db_path}"))
+    monkeypatch.setattr(response_cache, "_store_is_created", False)
+
+
+@pytest.fixture
+def stub_server():
+    server = start_stub_server(responses={"Limited": {"Response": "False",
+                                                      "Error": api.QUOTA_ERROR_MESSAGE}})
+    yield server
+    server.shutdown()
+
+
+def create_client(stub_server, **options):
+    return api.OmdbClient(api_url=f"http://127.0.0.1:{stub_server.server_port}/", **options)
+
+
+def test_requests_above_the_daily_quota_fail(stub_server):
+    client = create_client(stub_server, requests_per_day=2)
+    client.fetch_movie_json("Alien")
+    client.fetch_movie_json("Heat")
+    assert client.get_metrics()["quota_remaining"] == 0
+
+    with pytest.raises(api.OmdbQuotaExceededError):
+        client.fetch_movie_json("Up")
+    assert stub_server.request_count == 2
+    client.close()
+
+
+def test_quota_is_shared_by_the_processes():
+    # every process creates an own client with an own quota
+    api.RequestQuota(limit=2, period=60).acquire()
+    api.RequestQuota(limit=2, period=60).acquire()
+    with pytest.raises(api.OmdbQuotaExceededError):
+        api.RequestQuota(limit=2, period=60).acquire()
+    assert api.RequestQuota(limit=3, period=60).remaining() == 1
+
+
+def test_quota_of_the_period_is_restored(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    quota = api.RequestQuota(limit=1, period=60)
+    quota.acquire()
+    with pytest.raises(api.OmdbQuotaExceededError):
+        quota.acquire()
+
+    now[0] += 60
+    quota.acquire()
+    assert quota.remaining() == 0
+
+
+def test_request_limit_answer_of_omdb_is_a_quota_error(stub_server):
+    client = create_client(stub_server, requests_per_day=None)
+    with pytest.raises(api.OmdbQuotaExceededError):
+        client.fetch_movie_json("Limited")
+    assert "quota_remaining" not in client.get_metrics()
+    client.close()
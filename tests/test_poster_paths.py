@@ -0,0 +1,19 @@
+from movie_storage import movie_storage_sql as storage
+
+
+def save_alien_poster():
+    storage.add_movies([("Alien", 1979, 8.5, "https://posters.example/alien.jpg"),
+                        ("Heat", 1995, 8.3, "https://posters.example/heat.jpg")])
+    movie_ids = {movie.title: movie_id for movie_id, _, movie in storage.iter_movies_with_versions()}
+    storage.save_poster_paths([(movie_ids["Alien"], "alien.jpg", '"etag"', None)])
+
+
+def test_reads_return_the_downloaded_poster_path(database):
+    save_alien_poster()
+
+    assert {movie.title: movie.poster_path for movie in storage.iter_movies()} == {
+        "Alien": "alien.jpg", "Heat": None}
+    assert storage.get_movie_by_title("Alien")["poster_path"] == "alien.jpg"
+    assert [movie.poster_path for movie in storage.query_movies(order_by="title")] == ["alien.jpg", None]
+    assert storage.search_titles("alien")[0].poster_path == "alien.jpg"
+    assert storage.list_movies()[0]["poster_path"] == "alien.jpg"
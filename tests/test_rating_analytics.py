@@ -0,0 +1,38 @@
+import sqlite3
+import pytest
+from movie_analytics import catalogue_snapshot
+from movie_analytics import rating_analytics
+from movie_storage import movie_storage_sql as storage
+
+
+@pytest.fixture(params=[False, True], ids=["database", "snapshot"])
+def analytics(request, file_database, monkeypatch):
+    monkeypatch.setattr(catalogue_snapshot, "SNAPSHOT_ENABLED", request.param)
+    monkeypatch.setattr(rating_analytics, "_catalogue_is_loaded", False)
+    yield rating_analytics
+    rating_analytics._catalogue_is_loaded = False
+
+
+def test_writes_of_another_process_reach_the_arrays(analytics, file_database):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+    assert analytics.rating_stats().count == 1
+    assert analytics.filter_movies(min_rating=9) == []
+
+    connection = sqlite3.connect(file_database)
+    with connection:
+        connection.execute("INSERT INTO movies (title, year, rating, poster_url) "
+                           "VALUES ('Jaws', 1975, 9.9, '')")
+    connection.close()
+
+    stats = analytics.rating_stats()
+    assert (stats.count, stats.best_title) == (2, "Jaws")
+    assert analytics.filter_movies(min_rating=9) == [("Jaws", 1975, 9.9)]
+
+
+def test_writes_of_this_process_reach_the_arrays(analytics):
+    storage.add_movies([("Alien", 1979, 8.5, "alien.jpg"), ("Jaws", 1975, 8.1, "jaws.jpg")])
+    assert analytics.rating_stats().count == 2
+
+    storage.update_movie("Jaws", 9.9)
+    storage.delete_movie("Alien")
+    assert analytics.filter_movies() == [("Jaws", 1975, 9.9)]
@@ -0,0 +1,53 @@
+import os
+import pytest
+from sqlalchemy import create_engine, text
+from movie_api import response_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """
+    Empty response cache in a folder which does not exist yet.
+    """
+    db_path = tmp_path / "missing" / "folder" / "omdb_cache.db"
+    monkeypatch.setattr(response_cache, "cache_engine", create_engine(f"sqlite:///{db_path}"))
+    monkeypatch.setattr(response_cache, "_store_is_created", False)
+    monkeypatch.setattr(response_cache, "STORE_MAX_ENTRIES", 3)
+    response_cache._memory_cache.clear()
+    yield response_cache
+    response_cache._memory_cache.clear()
+
+
+def count_stored_responses(cache):
+    with cache.cache_engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM omdb_responses")).scalar()
+
+
+def test_default_store_is_independent_of_the_working_directory():
+    project_folder = os.path.dirname(os.path.dirname(os.path.abspath(response_cache.__file__)))
+    assert response_cache.DEFAULT_CACHE_DB_PATH == os.path.join(project_folder, "data", "omdb_cache.db")
+
+
+def test_store_creates_its_folder(cache):
+    cache.store_response("Alien", {"Title": "Alien"})
+    cache._memory_cache.clear()
+    assert cache.get_cached_response("alien") == {"Title": "Alien"}
+
+
+def test_oldest_responses_are_evicted_above_the_limit(cache):
+    for number in range(5):
+        cache.store_response(f"Movie {number}", {"Title": f"Movie {number}"})
+    # updating an existing response does not count as a new entry
+    cache.store_response("Movie 4", {"Title": "Movie 4"})
+
+    assert count_stored_responses(cache) == 3
+    cache._memory_cache.clear()
+    assert cache.get_cached_response("Movie 0") is None
+    assert cache.get_cached_response("Movie 4") == {"Title": "Movie 4"}
+
+
+def test_expired_responses_are_evicted_once_the_earliest_expiry_passed(cache, monkeypatch):
+    monkeypatch.setattr(cache, "NEGATIVE_CACHE_TTL_SECONDS", -1)
+    cache.store_response("Unknown", {"Response": "False", "Error": "Movie not found!"})
+    assert count_stored_responses(cache) == 0
+    assert cache._store_next_expiry is None
@@ -0,0 +1,33 @@
+import threading
+from movie_search import search_index
+from movie_storage import movie_storage_sql as storage
+
+
+def test_searches_while_the_index_is_built_again(file_database):
+    storage.add_movies([(f"Movie {number}", 2000, 7.0, "") for number in range(2000)])
+    search_index.invalidate_index()
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        try:
+            while not stop.is_set():
+                assert search_index.find_similar_titles("Movie 1234", workers=1)[0][0] == "Movie 1234"
+        except Exception as error:
+            errors.append(error)
+
+    def invalidate():
+        for _ in range(20):
+            search_index.invalidate_index()
+            search_index._ensure_index()
+        stop.set()
+
+    threads = [threading.Thread(target=search) for _ in range(6)] + [threading.Thread(target=invalidate)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(search_index._titles) == len(search_index._title_positions) == 2000
+    search_index.invalidate_index()
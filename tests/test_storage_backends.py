@@ -0,0 +1,174 @@
+"""
+Behaviour shared by the sync storage and the async storage on aiosqlite.
+Every test runs against both backends through the same small interface.
+"""
+import asyncio
+import pytest
+from movie_storage import movie_storage_sql as storage
+from movie_storage import movie_storage_async as async_storage
+
+MOVIES = [("Alien", 1979, 8.5, "alien.jpg"),
+          ("Heat", 1995, 8.3, "heat.jpg"),
+          ("Up", 2009, 8.2, "up.jpg"),
+          ("Cats", 2019, 2.8, "cats.jpg")]
+
+
+class SyncBackend:
+    def __init__(self, db_path):
+        storage.configure_database(db_path)
+        storage.connect_to_sql_db()
+
+    def close(self):
+        storage.configure_database(storage.DB_PATH)
+
+    def list_movies(self):
+        return storage.list_movies()
+
+    def iter_movies(self, batch_size):
+        return list(storage.iter_movies(batch_size))
+
+    def query_movies(self, **arguments):
+        return list(storage.query_movies(**arguments))
+
+    def count_movies(self):
+        return storage.count_movies()
+
+    def get_movie_by_title(self, title, ignore_case=False):
+        return storage.get_movie_by_title(title, ignore_case)
+
+    def add_movie(self, *movie):
+        storage.add_movie(*movie)
+
+    def delete_movie(self, title):
+        storage.delete_movie(title)
+
+    def update_movie(self, title, rating):
+        storage.update_movie(title, rating)
+
+    def update_ratings(self, ratings):
+        return storage.update_ratings(ratings)
+
+
+class AsyncBackend:
+    def __init__(self, db_path):
+        # the sync engine is used by the shared helpers, the async engine by the async functions
+        storage.configure_database(db_path)
+        self.loop = asyncio.new_event_loop()
+        self._run(async_storage.configure_database(db_path))
+        self._run(async_storage.connect_to_sql_db())
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    async def _collect(self, generator):
+        return [item async for item in generator]
+
+    def close(self):
+        self._run(async_storage.configure_database(storage.DB_PATH))
+        self._run(async_storage.engine.dispose())
+        self.loop.close()
+        storage.configure_database(storage.DB_PATH)
+
+    def list_movies(self):
+        return self._run(async_storage.list_movies())
+
+    def iter_movies(self, batch_size):
+        return self._run(self._collect(async_storage.iter_movies(batch_size)))
+
+    def query_movies(self, **arguments):
+        return self._run(self._collect(async_storage.query_movies(**arguments)))
+
+    def count_movies(self):
+        return self._run(async_storage.count_movies())
+
+    def get_movie_by_title(self, title, ignore_case=False):
+        return self._run(async_storage.get_movie_by_title(title, ignore_case))
+
+    def add_movie(self, *movie):
+        self._run(async_storage.add_movie(*movie))
+
+    def delete_movie(self, title):
+        self._run(async_storage.delete_movie(title))
+
+    def update_movie(self, title, rating):
+        self._run(async_storage.update_movie(title, rating))
+
+    def update_ratings(self, ratings):
+        return self._run(async_storage.update_ratings(ratings))
+
+
+@pytest.fixture(params=[SyncBackend, AsyncBackend], ids=["sync", "async"])
+def backend(request, tmp_path):
+    backend = request.param(str(tmp_path / "movies.db"))
+    for movie in MOVIES:
+        backend.add_movie(*movie)
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def notifications():
+    notifications = []
+
+    def listener(write_event, movie):
+        notifications.append((write_event, movie.title, movie.rating))
+
+    storage.add_write_listener(listener)
+    yield notifications
+    storage._write_listeners.remove(listener)
+
+
+def test_list_movies(backend):
+    movies = backend.list_movies()
+    assert [movie["title"] for movie in movies] == [title for title, _, _, _ in MOVIES]
+    assert movies[0] == {"title": "Alien", "year": 1979, "rating": 8.5,
+                         "poster_url": "alien.jpg", "poster_path": None}
+
+
+def test_iter_movies_in_small_batches(backend):
+    movies = backend.iter_movies(batch_size=3)
+    assert [tuple(movie[:4]) for movie in movies] == MOVIES
+
+
+def test_count_movies(backend):
+    assert backend.count_movies() == len(MOVIES)
+
+
+def test_query_movies_filters_sorts_and_paginates(backend):
+    movies = backend.query_movies(min_rating=8.0, year_range=(1980, None),
+                                  order_by="rating", descending=True)
+    assert [movie.title for movie in movies] == ["Heat", "Up"]
+
+    movies = backend.query_movies(order_by="year", limit=2, offset=1)
+    assert [movie.title for movie in movies] == ["Heat", "Up"]
+
+
+def test_query_movies_rejects_unknown_column(backend):
+    with pytest.raises(ValueError):
+        backend.query_movies(order_by="poster_url")
+
+
+def test_get_movie_by_title(backend):
+    assert backend.get_movie_by_title("Heat")["year"] == 1995
+    assert backend.get_movie_by_title("heat") is None
+    assert backend.get_movie_by_title("heat", ignore_case=True)["title"] == "Heat"
+
+
+def test_writes_update_the_movies_and_notify(backend, notifications):
+    backend.add_movie("Jaws", 1975, 8.1, "jaws.jpg")
+    backend.update_movie("Jaws", 8.0)
+    backend.delete_movie("Cats")
+
+    assert backend.get_movie_by_title("Jaws")["rating"] == 8.0
+    assert backend.get_movie_by_title("Cats") is None
+    assert backend.count_movies() == len(MOVIES)
+    assert notifications == [("add", "Jaws", 8.1), ("update", "Jaws", 8.0), ("delete", "Cats", 2.8)]
+
+
+def test_update_ratings(backend, notifications):
+    results = backend.update_ratings({"Alien": 9.0, "Missing": 5.0})
+
+    assert [(result.title, result.status) for result in results] == [
+        ("Alien", storage.UPDATED), ("Missing", storage.NOT_FOUND)]
+    assert backend.get_movie_by_title("Alien")["rating"] == 9.0
+    assert notifications == [("update", "Alien", 9.0)]
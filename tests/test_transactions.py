@@ -0,0 +1,82 @@
+import sqlite3
+import pytest
+from movie_storage import movie_storage_sql as storage
+
+
+def test_reads_inside_a_transaction_see_its_writes(database):
+    with storage.transaction():
+        storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+        assert storage.movie_exists("Alien")
+        assert storage.get_movie_by_title("Alien")["year"] == 1979
+        storage.add_movies([("Heat", 1995, 8.3, "heat.jpg")])
+
+    assert [movie["title"] for movie in storage.list_movies()] == ["Alien", "Heat"]
+    assert storage.count_movies() == 2
+
+
+def test_streaming_read_inside_a_transaction_keeps_the_writes(database):
+    with storage.transaction():
+        storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+        assert [movie.title for movie in storage.iter_movies()] == ["Alien"]
+        storage.add_movies([("Heat", 1995, 8.3, "heat.jpg")])
+
+    assert storage.count_movies() == 2
+
+
+def test_rolled_back_transaction_is_not_notified(database):
+    notifications = []
+
+    def listener(write_event, movie):
+        notifications.append((write_event, movie.title))
+
+    storage.add_write_listener(listener)
+    try:
+        try:
+            with storage.transaction():
+                storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+                assert storage.movie_exists("Alien")
+                raise RuntimeError("abort")
+        except RuntimeError:
+            pass
+        storage.add_movies([("Heat", 1995, 8.3, "heat.jpg")])
+    finally:
+        storage._write_listeners.remove(listener)
+
+    assert notifications == [("add", "Heat")]
+    assert [movie["title"] for movie in storage.list_movies()] == ["Heat"]
+
+
+def test_cache_writes_join_the_open_transaction(database):
+    try:
+        with storage.transaction():
+            storage.add_movies([("Alien", 1979, 8.5, "alien.jpg")])
+            movie_id = next(storage.iter_movies_with_versions())[0]
+            storage.save_poster_paths([(movie_id, "alien.jpg", None, None)])
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+
+    assert storage.count_movies() == 0
+
+
+def test_writes_of_another_process_wait_for_the_checks_of_add_movies(file_database, monkeypatch):
+    find_existing_titles = storage._find_existing_titles
+    blocked_writes = []
+
+    def find_existing_titles_and_race(connection, titles, user_id=None):
+        existing_titles = find_existing_titles(connection, titles, user_id)
+        # another process tries to add a checked title before the INSERT of add_movies
+        other_connection = sqlite3.connect(file_database, timeout=0)
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            other_connection.execute("INSERT INTO movies (title, year, rating, poster_url) "
+                                     "VALUES ('Jaws', 1975, 8.1, '')")
+        other_connection.close()
+        blocked_writes.append("Jaws")
+        return existing_titles
+
+    monkeypatch.setattr(storage, "_find_existing_titles", find_existing_titles_and_race)
+    results = storage.add_movies([("Alien", 1979, 8.5, "alien.jpg"), ("Jaws", 1975, 8.1, "jaws.jpg")])
+
+    assert blocked_writes == ["Jaws"]
+    assert [result.status for result in results] == [storage.ADDED, storage.ADDED]
+    assert storage.count_movies() == 2
@@ -0,0 +1,115 @@
+import pytest
+from movie_html import html_handler
+from movie_storage import movie_storage_sql as storage
+
+MOVIES = [("Alien", 1979, 8.5, "alien.jpg"),
+          ("Heat", 1995, 8.3, "heat.jpg"),
+          ("Up", 2009, 8.2, "up.jpg")]
+
+
+@pytest.fixture
+def users(database):
+    return storage.add_user("anna"), storage.add_user("ben")
+
+
+def get_ratings(user_id=None):
+    return {movie.title: movie.rating for movie in storage.iter_movies(user_id=user_id)}
+
+
+def test_add_keeps_the_ratings_of_the_users_out_of_the_shared_movies(users):
+    anna, ben = users
+    results = storage.add_movies(MOVIES[:2], anna, user_ratings={"Alien": 3.0})
+    assert [result.status for result in results] == [storage.ADDED, storage.ADDED]
+    assert storage.add_movies([MOVIES[0]], anna)[0].status == storage.EXISTS
+    storage.add_movies([MOVIES[0]], ben, user_ratings={"Alien": 9.5})
+
+    assert get_ratings(anna) == {"Alien": 3.0, "Heat": 8.3}
+    assert get_ratings(ben) == {"Alien": 9.5}
+    assert get_ratings() == {"Alien": 8.5, "Heat": 8.3}
+    assert storage.rating_stats().mean == pytest.approx((8.5 + 8.3) / 2)
+
+
+def test_add_movie_reports_a_movie_in_the_collection(users, capsys):
+    anna, _ = users
+    storage.add_movie("Alien", 1979, 8.5, "alien.jpg", anna)
+    assert "added successfully" in capsys.readouterr().out
+
+    storage.add_movie("Alien", 1979, 8.5, "alien.jpg", anna)
+    output = capsys.readouterr().out
+    assert "already in the collection" in output
+    assert "added successfully" not in output
+
+
+def test_upsert_updates_only_the_ratings_of_the_user(users):
+    anna, ben = users
+    storage.add_movies(MOVIES, ben)
+    results = storage.upsert_movies([MOVIES[0], MOVIES[1]], anna, user_ratings={"Alien": 5.0})
+    assert [result.status for result in results] == [storage.ADDED, storage.ADDED]
+
+    results = storage.upsert_movies([MOVIES[0], MOVIES[1]], anna, user_ratings={"Alien": 6.0})
+    assert [result.status for result in results] == [storage.UPDATED, storage.UNCHANGED]
+    assert get_ratings(anna) == {"Alien": 6.0, "Heat": 8.3}
+    assert get_ratings(ben) == {"Alien": 8.5, "Heat": 8.3, "Up": 8.2}
+    assert get_ratings() == {"Alien": 8.5, "Heat": 8.3, "Up": 8.2}
+
+
+def test_update_and_delete_work_on_the_collection_of_the_user(users):
+    anna, ben = users
+    storage.add_movies(MOVIES, anna)
+    storage.add_movies(MOVIES, ben)
+
+    results = storage.update_ratings({"Alien": 2.0, "Missing": 5.0}, anna)
+    assert [result.status for result in results] == [storage.UPDATED, storage.NOT_FOUND]
+    results = storage.delete_movies(["Heat", "Missing"], anna)
+    assert [result.status for result in results] == [storage.DELETED, storage.NOT_FOUND]
+
+    assert get_ratings(anna) == {"Alien": 2.0, "Up": 8.2}
+    assert get_ratings(ben) == {"Alien": 8.5, "Heat": 8.3, "Up": 8.2}
+    assert storage.count_movies() == 3
+
+
+@pytest.mark.parametrize("write", [
+    lambda user_id: storage.add_movies(MOVIES, user_id),
+    lambda user_id: storage.upsert_movies(MOVIES, user_id),
+    lambda user_id: storage.update_ratings({"Alien": 1.0}, user_id),
+    lambda user_id: storage.delete_movies(["Alien"], user_id)],
+    ids=["add", "upsert", "update", "delete"])
+def test_writes_of_an_unknown_user_fail(users, write):
+    with pytest.raises(ValueError):
+        write(max(users) + 1)
+
+
+def test_statistics_of_a_user(users):
+    anna, _ = users
+    storage.add_movies(MOVIES, anna, user_ratings={"Alien": 4.0, "Heat": 6.0})
+
+    stats = storage.rating_stats(anna)
+    assert (stats.count, stats.best_title, stats.worst_title) == (3, "Up", "Alien")
+    assert stats.mean == pytest.approx((4.0 + 6.0 + 8.2) / 3)
+    assert [(year.year, year.count) for year in storage.year_stats(anna)] == [(1979, 1), (1995, 1), (2009, 1)]
+    assert storage.rating_histogram(anna) == [(4.0, 1), (6.0, 1), (8.2, 1)]
+    assert storage.rating_histogram() == [(8.2, 1), (8.3, 1), (8.5, 1)]
+
+
+def test_deleted_movie_is_removed_from_all_collections(users):
+    anna, ben = users
+    storage.add_movies(MOVIES, anna)
+    storage.add_movies(MOVIES[:1], ben)
+
+    storage.delete_movies(["Alien"])
+
+    assert set(get_ratings(anna)) == {"Heat", "Up"}
+    assert get_ratings(ben) == {}
+    assert storage.rating_stats(ben) is None
+
+
+def test_website_of_a_user_shows_the_collection(users, tmp_path):
+    anna, ben = users
+    storage.add_movies(MOVIES[:2], anna)
+    storage.add_movies(MOVIES[2:], ben)
+    file_name = str(tmp_path / "index.html")
+
+    assert html_handler.build_website(file_name, "Anna", user_id=anna)
+    with open(file_name, encoding="utf-8") as html_file:
+        content = html_file.read()
+    assert "Alien" in content and "Heat" in content and "Up</div>" not in content